@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+generate.py
+
+Time the stages of model generation : loading the ontology documents, indexing
+the graph, and generating the code of every class. Nothing is written to disk.
+Run it from the top of the source tree, where the ontology documents are :
+
+	$ python benchmarks/generate.py
+"""
+
+import sys
+import os
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from rdflib import RDF, BNode
+import genpy
+
+def timeGeneration():
+	"""Seconds spent in each stage, with the sizes of the ontology and the model."""
+	devnull = open(os.devnull, "w")
+	stdout = sys.stdout
+	sys.stdout = devnull # genpy is chatty
+	try:
+		start = time.time()
+		g = genpy.loadOntology()
+		genpy.bindNamespaces(g)
+		loaded = time.time()
+		index = genpy.OntologyIndex(g)
+		indexed = time.time()
+		classes = list(set(s for s in g.subjects(RDF.type, genpy.OWL.Class) if type(s) != BNode))
+		classes.sort()
+		for classId, c in enumerate(classes):
+			gen = genpy.Generator(g, c, classId=classId, index=index)
+			gen.printAll()
+			gen.getParents()
+		generated = time.time()
+	finally:
+		sys.stdout = stdout
+		devnull.close()
+	return {"load" : loaded - start, "index" : indexed - loaded, "generate" : generated - indexed, "total" : generated - start,\
+			"triples" : len(g), "classes" : len(classes), "properties" : len(index.properties)}
+
+def main():
+	t = timeGeneration()
+	print "%-28s %8.3fs (%d triples)" % ("Loading ontologies", t["load"], t["triples"])
+	print "%-28s %8.3fs" % ("Indexing graph", t["index"])
+	print "%-28s %8.3fs (%d classes, %d properties)" % ("Generating classes", t["generate"], t["classes"], t["properties"])
+	print "%-28s %8.3fs" % ("Total", t["total"])
+
+if __name__ == '__main__':
+	main()
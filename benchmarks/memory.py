@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+memory.py
+
+Measure construction time and per-object memory of the generated model classes.
+
+Run it once against a model generated with "python genpy.py" and once against
+one generated with "python genpy.py --compact" to compare the two layouts :
+
+	$ python benchmarks/memory.py 100000
+"""
+
+import sys
+import os
+import time
+import resource
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mopy.model import mo___SoloMusicArtist, mo___Track, timeline___Interval
+
+def objSize(obj):
+	"""Bytes used by obj, its __dict__ (if any) and its PropertySets."""
+	size = sys.getsizeof(obj)
+	if hasattr(obj, "__dict__"):
+		size += sys.getsizeof(obj.__dict__)
+	size += sys.getsizeof(obj._props)
+	for propSet in obj._props.values():
+		size += sys.getsizeof(propSet)
+		if isinstance(getattr(propSet, "_value", None), set):
+			size += sys.getsizeof(propSet._value)
+	return size
+
+def build(cls, n, setProps):
+	objs = []
+	for i in xrange(n):
+		o = cls("http://example.org/"+cls.__name__+"/"+str(i))
+		setProps(o, i)
+		objs.append(o)
+	return objs
+
+def artistProps(o, i):
+	o.name = "Artist "+str(i)
+
+def trackProps(o, i):
+	o.title = "Track "+str(i)
+	o.track_number = i % 20
+
+def intervalProps(o, i):
+	o.beginsAtDuration = "PT"+str(i)+"S"
+	o.durationXSD = "PT1S"
+
+def main(n):
+	layout = hasattr(mo___Track, "__slots__") and "compact" or "dict"
+	print "Model layout : "+layout
+	for cls, setProps in [(mo___SoloMusicArtist, artistProps), (mo___Track, trackProps), (timeline___Interval, intervalProps)]:
+		rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		start = time.time()
+		objs = build(cls, n, setProps)
+		elapsed = time.time() - start
+		rssDelta = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+		print "%-22s %8d objects %8.3fs %6d bytes/object (getsizeof) %8d kB peak RSS growth" \
+			% (cls.__name__, n, elapsed, objSize(objs[-1]), rssDelta)
+		del objs
+
+if __name__ == '__main__':
+	if len(sys.argv) > 1:
+		main(int(sys.argv[1]))
+	else:
+		main(100000)
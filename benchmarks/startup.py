@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+startup.py
+
+Time "import mopy" in fresh interpreters. The namespaces of the model are only
+imported when first used, so compare importing mopy on its own, using the
+classes of one namespace, and loading every namespace (which is what importing
+mopy used to cost) :
+
+	$ python benchmarks/startup.py 20
+"""
+
+import sys
+import os
+import time
+import subprocess
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+cases = [("import mopy", "import mopy"),
+		 ("import mopy, use mo.Track", "import mopy; mopy.mo.Track('http://example.org/track')"),
+		 ("import mopy, load all", "import mopy; mopy.model.loadAll()")]
+
+def timeImport(code):
+	"""Seconds taken to run code in a new interpreter, less the interpreter's own startup."""
+	start = time.time()
+	subprocess.check_call([sys.executable, "-c", code], cwd=root)
+	return time.time() - start
+
+def median(xs):
+	xs = sorted(xs)
+	return xs[len(xs)/2]
+
+def main(runs):
+	timeImport("import mopy; mopy.model.loadAll()") # Compile any stale .pyc files first
+	baseline = median([timeImport("pass") for i in range(runs)])
+	for name, code in cases:
+		print "%-28s %8.3fs" % (name, median([timeImport(code) for i in range(runs)]) - baseline)
+
+if __name__ == '__main__':
+	if len(sys.argv) > 1:
+		main(int(sys.argv[1]))
+	else:
+		main(10)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+suite.py
+
+Time imports, exports, merges, blind node matching, object construction and
+model generation on synthetic data (see synthetic.py), and write the results as
+JSON to compare them across commits. Each workload runs in a process of its
+own, so that its peak RSS is its own :
+
+	$ python benchmarks/suite.py --artists 1000 --output before.json
+	$ git checkout my-branch
+	$ python benchmarks/suite.py --artists 1000 --output after.json
+	$ python benchmarks/suite.py --compare before.json after.json
+
+Name workloads after the options to only run those. The workloads are :
+
+	construct    make artists, tracks and intervals and set their properties
+	import       importRDFFile of the data, as N-Triples
+	export-nt    exportRDFFile of the imported data, as N-Triples
+	export-xml   exportRDFFile of the imported data, as RDF/XML
+	add-merge    MusicInfo.add of a second import of the named objects, which are all merged
+	add-blind    MusicInfo.add of a second import of the blind nodes, which are all matched
+	genpy        generating the model from the ontologies
+
+Seconds are the best of --runs runs, peak RSS the largest, in kB.
+"""
+
+import sys
+import os
+import time
+import json
+import resource
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.join(here, "..")
+sys.path.insert(0, root)
+sys.path.insert(0, here)
+
+import synthetic
+
+workloads = ["construct", "import", "export-nt", "export-xml", "add-merge", "add-blind", "genpy"]
+
+def countLines(filename):
+	n = 0
+	for line in open(filename):
+		n += 1
+	return n
+
+def runConstruct(data, artists):
+	import memory
+	from mopy.model import mo___SoloMusicArtist, mo___Track, timeline___Interval
+	n = 20*artists # About as many tracks as in the data
+	start = time.time()
+	keep = [memory.build(cls, n, setProps) for cls, setProps in \
+			[(mo___SoloMusicArtist, memory.artistProps), (mo___Track, memory.trackProps), (timeline___Interval, memory.intervalProps)]]
+	return time.time() - start, None, 3*n
+
+def runImport(data, artists):
+	import mopy
+	start = time.time()
+	mi = mopy.importRDFFile(data, "nt")
+	return time.time() - start, countLines(data), len(mi.MainIdx)
+
+def runExport(format):
+	def run(data, artists):
+		import mopy
+		mi = mopy.importRDFFile(data, "nt")
+		out = tempfile.mktemp(suffix="."+format)
+		try:
+			start = time.time()
+			mopy.exportRDFFile(mi, out, format)
+			elapsed = time.time() - start
+			if format == "nt":
+				triples = countLines(out)
+			else:
+				triples = len(mopy.exportRDFGraph(mi)) # No bigger than the graph just serialized
+		finally:
+			if os.path.exists(out):
+				os.remove(out)
+		return elapsed, triples, len(mi.MainIdx)
+	return run
+
+def runAdd(blind):
+	def run(data, artists):
+		import mopy
+		from mopy.MusicInfo import isBlind
+		mi = mopy.importRDFFile(data, "nt")
+		objs = [o for o in mopy.importRDFFile(data, "nt").MainIdx.values() if isBlind(o) == blind]
+		start = time.time()
+		for o in objs:
+			mi.add(o)
+		return time.time() - start, None, len(objs)
+	return run
+
+def runGenpy(data, artists):
+	import generate
+	os.chdir(root) # Where the ontology documents are
+	t = generate.timeGeneration()
+	return t["total"], t["triples"], t["classes"]
+
+runners = {"construct" : runConstruct,
+		   "import" : runImport,
+		   "export-nt" : runExport("nt"),
+		   "export-xml" : runExport("xml"),
+		   "add-merge" : runAdd(False),
+		   "add-blind" : runAdd(True),
+		   "genpy" : runGenpy}
+
+def runHere(name, data, artists):
+	"""Run a workload in this process, printing its result as a line of JSON."""
+	seconds, triples, objects = runners[name](data, artists)
+	print json.dumps({"seconds" : seconds, "triples" : triples, "objects" : objects,\
+					  "peak_rss_kb" : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss})
+
+def runWorkload(name, data, artists, runs):
+	"""The result of the best of runs runs of a workload, each in a new process."""
+	results = []
+	for i in range(runs):
+		out = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--run", name, data, str(artists)],\
+							   stdout=subprocess.PIPE).communicate()[0]
+		results.append(json.loads(out.strip().splitlines()[-1])) # genpy may have printed before it
+	best = min(results, key=lambda r: r["seconds"])
+	best["peak_rss_kb"] = max(r["peak_rss_kb"] for r in results)
+	for count in ["triples", "objects"]:
+		if best[count] != None and best["seconds"] > 0:
+			best[count+"_per_sec"] = best[count] / best["seconds"]
+	return best
+
+def gitCommit():
+	try:
+		return subprocess.Popen(["git", "rev-parse", "HEAD"], cwd=root, stdout=subprocess.PIPE,\
+								stderr=open(os.devnull, "w")).communicate()[0].strip() or None
+	except OSError:
+		return None
+
+def rate(result, count):
+	if result.get(count+"_per_sec") == None:
+		return "%12s" % "-"
+	return "%12.0f" % result[count+"_per_sec"]
+
+def printResults(results):
+	print "%-12s %10s %12s %12s %12s" % ("workload", "seconds", "triples/s", "objects/s", "peak RSS kB")
+	for name in workloads:
+		if results.has_key(name):
+			r = results[name]
+			print "%-12s %10.3f %s %s %12d" % (name, r["seconds"], rate(r, "triples"), rate(r, "objects"), r["peak_rss_kb"])
+
+def compare(before, after):
+	"""Print the ratios of the times and peak RSS of two result files, after / before."""
+	old, new = json.load(open(before)), json.load(open(after))
+	print "%s (%s) -> %s (%s), %d -> %d artists" % (before, old["commit"], after, new["commit"], old["artists"], new["artists"])
+	print "%-12s %10s %10s %8s %12s %12s %8s" % ("workload", "before s", "after s", "ratio", "before kB", "after kB", "ratio")
+	for name in workloads:
+		if old["results"].has_key(name) and new["results"].has_key(name):
+			a, b = old["results"][name], new["results"][name]
+			print "%-12s %10.3f %10.3f %8.2f %12d %12d %8.2f" % (name, a["seconds"], b["seconds"], b["seconds"] / max(a["seconds"], 1e-9),\
+																 a["peak_rss_kb"], b["peak_rss_kb"], float(b["peak_rss_kb"]) / a["peak_rss_kb"])
+
+def main(names, artists, seed, runs, output):
+	tmp = tempfile.mkdtemp()
+	data = os.path.join(tmp, "data.nt")
+	try:
+		out = open(data, "w")
+		triples = synthetic.writeData(out, artists, seed)
+		out.close()
+		results = {}
+		for name in names:
+			results[name] = runWorkload(name, data, artists, runs)
+	finally:
+		if os.path.exists(data):
+			os.remove(data)
+		os.rmdir(tmp)
+	printResults(results)
+	if output != None:
+		json.dump({"commit" : gitCommit(), "python" : sys.version.split()[0], "time" : time.time(),\
+				   "artists" : artists, "seed" : seed, "runs" : runs, "triples" : triples, "results" : results},\
+				  open(output, "w"), indent=1, sort_keys=True)
+
+if __name__ == '__main__':
+	if len(sys.argv) > 1 and sys.argv[1] == "--run":
+		runHere(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+		sys.exit(0)
+	parser = OptionParser(usage="%prog [options] [workload ...] | --compare before.json after.json")
+	parser.add_option("--artists", type="int", default=100, help="number of artists in the synthetic data")
+	parser.add_option("--seed", type="int", default=0, help="seed of the synthetic data")
+	parser.add_option("--runs", type="int", default=1, help="runs of each workload, the best one being kept")
+	parser.add_option("--output", help="file to write the results to, as JSON")
+	parser.add_option("--compare", action="store_true", help="compare two result files")
+	options, args = parser.parse_args()
+	if options.compare:
+		if len(args) != 2:
+			parser.error("--compare takes two result files")
+		compare(args[0], args[1])
+	else:
+		for name in args:
+			if name not in workloads:
+				parser.error("unknown workload %s, pick from %s" % (name, ", ".join(workloads)))
+		main(args or workloads, options.artists, options.seed, options.runs, options.output)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+synthetic.py
+
+Write synthetic Music Ontology data as N-Triples, for benchmarks. Each artist
+makes a few records of about ten tracks each, and each track has a signal with
+a timeline on which a few events happen. The signals and events are placed on
+the timelines by blank node intervals. The same scale and seed always give the
+same triples, written as they are made, so there is no limit on the scale :
+
+	$ python benchmarks/synthetic.py 1000 > data.nt
+	$ python benchmarks/synthetic.py 1000000 42 | gzip > data.nt.gz
+"""
+
+import sys
+import random
+
+BASE = "http://example.org/synthetic/"
+RDF = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+MO = "http://purl.org/ontology/mo/"
+FOAF = "http://xmlns.com/foaf/0.1/"
+DC = "http://purl.org/dc/elements/1.1/"
+EVENT = "http://purl.org/NET/c4dm/event.owl#"
+TL = "http://purl.org/NET/c4dm/timeline.owl#"
+XSD = "http://www.w3.org/2001/XMLSchema#"
+
+class Writer(object):
+	"""Writes triples to out, counting them."""
+	def __init__(self, out):
+		self.out = out
+		self.triples = 0
+		self.blanks = 0
+
+	def blank(self):
+		self.blanks += 1
+		return "_:b%d" % self.blanks
+
+	def triple(self, s, p, o):
+		self.out.write("%s <%s> %s .\n" % (s, p, o))
+		self.triples += 1
+
+	def typed(self, s, cls):
+		self.triple(s, RDF+"type", "<%s>" % cls)
+
+	def interval(self, timeLine, begin, duration):
+		"""A blank node interval of timeLine, begin and duration in seconds."""
+		b = self.blank()
+		self.typed(b, TL+"Interval")
+		self.triple(b, TL+"onTimeLine", timeLine)
+		self.triple(b, TL+"beginsAtDuration", durationLiteral(begin))
+		self.triple(b, TL+"durationXSD", durationLiteral(duration))
+		return b
+
+def uri(kind, *ids):
+	return "<%s%s/%s>" % (BASE, kind, "/".join(str(i) for i in ids))
+
+def literal(text):
+	return '"%s"' % text
+
+def durationLiteral(seconds):
+	return '"PT%dS"^^<%sduration>' % (seconds, XSD)
+
+def integer(i):
+	return '"%d"^^<%sint>' % (i, XSD)
+
+def writeArtist(w, rnd, i, events):
+	artist = uri("artist", i)
+	w.typed(artist, MO+"MusicArtist")
+	w.triple(artist, FOAF+"name", literal("Artist %d" % i))
+	for r in xrange(rnd.randint(1, 3)):
+		record = uri("record", i, r)
+		w.typed(record, MO+"Record")
+		w.triple(record, DC+"title", literal("Record %d of artist %d" % (r, i)))
+		w.triple(record, FOAF+"maker", artist)
+		for t in xrange(rnd.randint(8, 12)):
+			track = uri("track", i, r, t)
+			w.typed(track, MO+"Track")
+			w.triple(track, DC+"title", literal("Track %d" % (t+1)))
+			w.triple(track, MO+"track_number", integer(t+1))
+			w.triple(track, FOAF+"maker", artist)
+			w.triple(record, MO+"track", track)
+			length = rnd.randint(120, 480)
+			signal = uri("signal", i, r, t)
+			timeLine = uri("timeline", i, r, t)
+			w.typed(signal, MO+"Signal")
+			w.typed(timeLine, TL+"TimeLine")
+			w.triple(signal, MO+"time", w.interval(timeLine, 0, length))
+			for e in xrange(events):
+				event = uri("event", i, r, t, e)
+				begin = rnd.randint(0, length-1)
+				w.typed(event, EVENT+"Event")
+				w.triple(event, EVENT+"agent", artist)
+				w.triple(event, EVENT+"time", w.interval(timeLine, begin, rnd.randint(1, length-begin)))
+
+def writeData(out, artists, seed=0, events=4):
+	"""Write the data for this many artists to the file out, with events per track. Returns the number of triples."""
+	w = Writer(out)
+	rnd = random.Random(seed)
+	for i in xrange(artists):
+		writeArtist(w, rnd, i, events)
+	return w.triples
+
+def main(artists, seed):
+	writeData(sys.stdout, artists, seed)
+
+if __name__ == '__main__':
+	if len(sys.argv) > 2:
+		main(int(sys.argv[1]), int(sys.argv[2]))
+	elif len(sys.argv) > 1:
+		main(int(sys.argv[1]), 0)
+	else:
+		main(100, 0)
@@ -12,19 +12,115 @@ Copyright (c) 2007 Chris Sutton. All rights reserved.
 import sys
 import time
 import os
+import re
+import cPickle
+import hashlib
 from os import mkdir
-import rdflib; from rdflib import RDF, RDFS, BNode, URIRef, Literal
-from rdflib.Collection import Collection
+import rdflib; from rdflib import RDF, RDFS, BNode, URIRef, Literal, plugin
+from rdflib.syntax.parsers import Parser
 
 OWL = rdflib.Namespace("http://www.w3.org/2002/07/owl#")
 DC = rdflib.Namespace("http://purl.org/dc/elements/1.1/")
 
+class OntologyIndex:
+	"""
+	The triples of the ontology graph which the Generators look up, indexed in a
+	single pass over the graph, with the properties of each class and the parents
+	of each class worked out once and remembered.
+	"""
+	def __init__(self, graph):
+		self.graph = graph
+		self.log = None # (method, args) -> result of the lookups made, while generating a class for the BuildCache
+		self.objectMap = {} # (predicate, subject) -> [objects]
+		self.subjectMap = {} # (predicate, object) -> [subjects]
+		for s, p, o in graph.triples((None, None, None)):
+			self.objectMap.setdefault((p, s), []).append(o)
+			self.subjectMap.setdefault((p, o), []).append(s)
+		# The graph's own order changes from run to run
+		for terms in self.objectMap.values() + self.subjectMap.values():
+			terms.sort()
+
+		self.properties = self.subjects(RDF.type, RDF.Property)
+		for subType in self.subjects(RDFS.subClassOf, RDF.Property):
+			self.properties.extend(self.subjects(RDF.type, subType))
+
+		# Classes named in the domain (possibly in a unionOf) or range of each property
+		self.domainProps = {} # class -> properties
+		self.rangeProps = {} # class -> properties
+		for prop in self.properties:
+			for d in self.objects(prop, RDFS.domain):
+				if isinstance(d, BNode):
+					domain = self.unionOf(d)
+					if domain == None:
+						print "Unhandled Blind Node in getProperties ! No unionOf found. Triples :"
+						print "\n".join(list(graph.triples((d,None,None))))
+						raise Exception("Unhandled Blind Node in getProperties")
+				else:
+					domain = [d]
+				for c in domain:
+					self.domainProps.setdefault(c, []).append(prop)
+			for r in self.objects(prop, RDFS.range):
+				self.rangeProps.setdefault(r, []).append(prop)
+
+		self.parents = {} # class -> parents, see Generator.getParents
+		self.classProperties = {} # class -> properties, see Generator.getProperties
+
+	def lookup(self, method, a, b, result):
+		if self.log != None:
+			self.log[(method, a, b)] = result
+		return list(result)
+
+	def objects(self, s, p):
+		return self.lookup("objects", s, p, self.objectMap.get((p, s), []))
+
+	def subjects(self, p, o):
+		return self.lookup("subjects", p, o, self.subjectMap.get((p, o), []))
+
+	def propertiesWithDomain(self, c, unused=None):
+		return self.lookup("propertiesWithDomain", c, unused, self.domainProps.get(c, []))
+
+	def propertiesWithRange(self, c, unused=None):
+		return self.lookup("propertiesWithRange", c, unused, self.rangeProps.get(c, []))
+
+	def qname(self, uri, unused=None):
+		q = self.graph.qname(uri)
+		if self.log != None:
+			self.log[("qname", uri, unused)] = q
+		return q
+
+	def definitionHash(self, c):
+		"""Hash of the triples about c, which its generated code is cached with."""
+		return hashlib.sha1(repr(sorted(self.graph.predicate_objects(c)))).hexdigest()
+
+	def replay(self, log):
+		"""Whether the lookups in a log made while generating a class give the same results now."""
+		for (method, a, b), result in log.iteritems():
+			if getattr(self, method)(a, b) != result:
+				return False
+		return True
+
+	def unionOf(self, bn):
+		"""The members of the owl:unionOf of bn, or None if it hasn't got one."""
+		un = self.objects(bn, OWL["unionOf"])
+		if len(un) == 0:
+			return None
+		members = []
+		node = un[0]
+		while node != RDF.nil and len(self.objects(node, RDF.first)) > 0:
+			members.append(self.objects(node, RDF.first)[0])
+			rest = self.objects(node, RDF.rest)
+			if len(rest) == 0:
+				break
+			node = rest[0]
+		return members
+
 class Generator:
-	def __init__(self, graph, target_class, excludeClasses = None):
+	def __init__(self, graph, target_class, excludeClasses = None, compact = False, classId = None, index = None):
 		self.graph = graph
+		self.index = index or OntologyIndex(graph)
 		self.c = target_class
-		[self.ns, self.name] = self.graph.qname(self.c).split(":")
-		self.pyname = ClassQNameToPyClassName(self.graph.qname(self.c))
+		[self.ns, self.name] = self.index.qname(self.c).split(":")
+		self.pyname = ClassQNameToPyClassName(self.index.qname(self.c))
 		self.filename = "model.py"
 		self.out = []
 		self.write = self.out.append
@@ -34,6 +130,8 @@ class Generator:
 		self.props = ""
 		self.utils = ""
 		self.excludeClasses = excludeClasses or []
+		self.compact = compact # Generate __slots__ based classes, see addInit
+		self.classId = classId # Position in the class hierarchy tables of model.py
 
 		# Do we have any non-inherited properties ?
 		self.properties = self.getProperties()
@@ -56,14 +154,14 @@ class Generator:
 	def addHeader(self):
 		self.hdr = '\t"""\n'
 		self.hdr+="\t"+self.ns+":"+self.name+"\n"
-		for comment in self.graph.objects(self.c, RDFS.comment):
+		for comment in self.index.objects(self.c, RDFS.comment):
 			self.hdr+="\t"+comment+"\n"
 		self.hdr+= '\t"""\n'
 
 	def addClassDef(self):
 		cd=""
 		parentURIs = self.getParents()
-		parentqnames = [self.graph.qname(p) for p in parentURIs]
+		parentqnames = [self.index.qname(p) for p in parentURIs]
 		parentpynames = [ClassQNameToPyClassName(q) for q in parentqnames]
 		parentpynames.sort() # For consistency across runs
 		self.classDef+="\nclass "+self.pyname+"("
@@ -76,51 +174,60 @@ class Generator:
 		
 
 	def addInit(self):
-		parentURIs = self.getParents()
-		parentqnames = [self.graph.qname(p) for p in parentURIs]
-		parentpynames = [ClassQNameToPyClassName(q) for q in parentqnames]
-		if len(parentpynames)>0:
-			self.init+="\t\t# Initialise parents\n"
-		for p in parentpynames:
-			self.init+="\t\t"+p+".__init__(self)\n"
-		
+		if self.compact:
+			self.addCompactInit()
+			return
+		# PropertySets are created on first access by the PropertyDescriptors
+		# below, so there is nothing for the parent classes to initialise.
 		self.init+="\t\tself._initialised = False\n"
-		self.init+="\t\tself.shortname = \""+self.name+"\"\n"
 		self.init+="\t\tself.URI = URI\n"
-		if self.haveProperties:
-			self.init+="\t\tself._props = getattr(self,\"_props\",{}) # Initialise if a parent class hasn't already\n"
+		self.init+="\t\tself._props = {} # PropertySets which have been accessed\n"
 
+	def addCompactInit(self):
+		# Instance state lives in __slots__ declared by the root class, so there
+		# are no per-instance dicts, and assigning to an unknown attribute fails
+		# without needing protector. shortname is a class constant.
+		if len(self.getParents()) == 0:
+			self.init ="\t__slots__ = (\"URI\", \"_props\", \"_watchers\")\n"
+			self.init+="\tdef __init__(self,URI=None):\n"
+			self.init+="\t\tself.URI = URI\n"
+			self.init+="\t\tself._props = {} # PropertySets which have been accessed\n"
+			self.init+="\t\tself._watchers = () # MusicInfo objects holding this object\n"
+		else:
+			self.init ="\t__slots__ = ()\n"
 			
 	def addProperties(self):
+		self.props+="\tshortname = \""+self.name+"\"\n"
 		self.props+="\tclassURI = \""+str(self.c)+"\"\n"
+		if self.classId != None:
+			self.props+="\tclassId = "+str(self.classId)+"\n"
 		if self.haveProperties:
 			self.props+="\n\n\t# Python class properties to wrap the PropertySet objects\n"
 		for prop in self.properties:
-				propname = PropQNameToPyName(self.graph.qname(prop))
+				propname = PropQNameToPyName(self.index.qname(prop))
 				URIstr = str(prop)
 				validTypes = ""
-				rTypes = list(self.graph.objects(prop, RDFS.range))
+				rTypes = self.index.objects(prop, RDFS.range)
 				
 				# Add the range types of any parent properties
-				for parent in self.graph.objects(prop,RDFS.subPropertyOf):
+				for parent in self.index.objects(prop,RDFS.subPropertyOf):
 					#print "Added range types from parent property "+str(parent)+" to subproperty "+str(prop)
-					rTypes.extend(self.graph.objects(parent, RDFS.range))
+					rTypes.extend(self.index.objects(parent, RDFS.range))
 				
 				# Add the domain types of any inverse properties
-				for invProp in self.graph.objects(prop, OWL.inverseOf):
+				for invProp in self.index.objects(prop, OWL.inverseOf):
 					print "Adding domain types of "+str(invProp)+" inverse of "+str(prop)
-					rTypes.extend(self.graph.objects(invProp, RDFS.domain))
+					rTypes.extend(self.index.objects(invProp, RDFS.domain))
 				
 				rTypeNames = []
 				allowLits=False
 				for rT in rTypes:
 					if isinstance(rT, BNode):
-						try:
-							un = (self.graph.objects(rT,OWL["unionOf"])).next()
-							col = Collection(self.graph, un)
+						col = self.index.unionOf(rT)
+						if col != None:
 							for c in col:
 								rTypeNames.append(self.TypeToPyTypeName(c))
-						except StopIteration:
+						else:
 							print "Unhandled Blind Node in addProperties ! No unionOf found. Triples :"
 							print "\n".join(list(self.graph.triples(rT,None,None)))
 							raise Exception("Unhandled Blind Node in addProperties !")
@@ -131,86 +238,77 @@ class Generator:
 				if "rdfs___Literal" in rTypeNames:
 					allowLits=True
 					rTypeNames.remove("rdfs___Literal")
-				if len(rTypeNames) > 1:
-					validTypes="("+",".join(rTypeNames)+")"
-				elif len(rTypeNames) == 1:
-					validTypes=rTypeNames[0]
+				# Model classes are given by name, and looked up in mopy.model on first
+				# use, as their namespaces may not be loaded yet
+				rTypeNames = [("___" in n and "\""+n+"\"") or n for n in rTypeNames]
+				if len(rTypeNames) > 0:
+					validTypes="("+", ".join(sorted(rTypeNames))+",)"
 				else:
 					validTypes="None"
 
-				self.init+="\t\tself._props[\""+propname+"\"] = PropertySet(\""+propname+"\",\""+URIstr+"\", "+validTypes
-				self.init+=", "+str(allowLits)+")\n"
-				# Wrap the PropertySet up to be usable and protected :
-				self.props+="\t" + propname + " = property(fget=lambda x: x._props[\"" + propname + "\"].get()"\
-														", fset=lambda x,y : x._props[\"" + propname + "\"].set(y)"\
-														", fdel=None, doc=propDocs[\""+propname+"\"])\n"
-		self.init+="\t\tself._initialised = True\n"
+				# Wrap the PropertySet up to be usable and protected. The docstring is
+				# read from mopy.docs when it is asked for.
+				if self.compact:
+					descriptor = "CompactPropertyDescriptor" # Single values kept inline
+				else:
+					descriptor = "PropertyDescriptor"
+				self.props+="\t" + propname + " = "+descriptor+"(\""+propname+"\", \""+URIstr+"\""\
+														", "+validTypes+", "+str(allowLits)+")\n"
+		if not self.compact:
+			self.init+="\t\tself._initialised = True\n"
 		
 	def addUtils(self):
 		self.utils+="\n\t# Utility methods\n" # TODO : serialisation routine here ?
-		self.utils+="\t__setattr__ = protector\n"
+		if not self.compact:
+			self.utils+="\t__setattr__ = protector\n"
+		if len(self.getParents()) == 0 and not self.compact:
+			self.utils+="\t_watchers = () # MusicInfo objects holding this object\n"
 		self.utils+="\t__str__ = objToStr\n"
 	
 	def getProperties(self):
-		props=[]
-		graph_props = list(self.graph.subjects(RDF.type, RDF.Property))
-		for subType in self.graph.subjects(RDFS.subClassOf, RDF.Property):
-			graph_props.extend(list(self.graph.subjects(RDF.type, subType)))
-			
-		for prop in graph_props:
-			# Simple case : Named explicitly in property's domain
-			if len(list(self.graph.triples((prop,RDFS.domain,self.c)))) > 0:
-				props.append(prop)
-			# Harder case : Named in a property's range and we know of an inverseProperty
-			if len(list(self.graph.triples((prop,RDFS.range,self.c)))) > 0:
-				inverses = list(self.graph.objects(prop,OWL.inverseOf)) + list(self.graph.subjects(OWL.inverseOf,prop))
-				props.extend(inverses)
-			 
-			# Harder case : Named in a collection in property's domain
-			for bn in (o for (s,p,o) in self.graph.triples((prop,RDFS.domain,None)) if isinstance(o, BNode)):
-				try:
-					un = (self.graph.objects(bn,OWL["unionOf"])).next()
-					domain = Collection(self.graph, un)
-					if self.c in domain:
-						props.append(prop)
-				except StopIteration:
-					print "Unhandled Blind Node in getProperties ! No unionOf found. Triples :"
-					print "\n".join(list(self.graph.triples(bn,None,None)))
-					raise Exception("Unhandled Blind Node in getProperties")
+		if len(self.excludeClasses) == 0 and self.index.classProperties.has_key(self.c):
+			return list(self.index.classProperties[self.c])
+		# Named in the property's domain, explicitly or in a collection
+		props = self.index.propertiesWithDomain(self.c)
+		# Named in a property's range and we know of an inverseProperty
+		for prop in self.index.propertiesWithRange(self.c):
+			props.extend(self.index.objects(prop,OWL.inverseOf) + self.index.subjects(OWL.inverseOf,prop))
 		
 		# Then need to add the known subproperties for properties we've found
 		for prop in props:
-			for child in self.graph.subjects(RDFS.subPropertyOf, prop):
+			for child in self.index.subjects(RDFS.subPropertyOf, prop):
 				#print "Adding child property "+str(child)+" because we have the parent property "+str(prop)
 				props.append(child)
 		
 		# Handle owl:sameAs links
-		for x in set(list(self.graph.objects(self.c, OWL.sameAs)) + list(self.graph.subjects(OWL.sameAs, self.c))):
+		for x in set(self.index.objects(self.c, OWL.sameAs) + self.index.subjects(OWL.sameAs, self.c)):
 			if x not in self.excludeClasses:
 				#print "Adding properties from "+str(x)+" sameAs "+str(self.c)
 				#print " exclude classes : "+str(self.excludeClasses)
-				g = Generator(self.graph, x, excludeClasses = self.excludeClasses + [self.c])
+				g = Generator(self.graph, x, excludeClasses = self.excludeClasses + [self.c], index = self.index)
 				props.extend(g.getProperties())
 		
-		removeDeprecated(self.graph, props)
+		removeDeprecated(self.index, props)
 		props = list(set(props)) # Remove duplicates
 		props.sort() # Aid consistency of generated code
 		#print str(self.c)+" has properties : "+str(props)
+		if len(self.excludeClasses) == 0:
+			self.index.classProperties[self.c] = list(props)
 		return props
 
 	def getParents(self):
+		if len(self.excludeClasses) == 0 and self.index.parents.has_key(self.c):
+			return list(self.index.parents[self.c])
 		p = []
-		for parent in self.graph.objects(self.c, RDFS.subClassOf):
+		for parent in self.index.objects(self.c, RDFS.subClassOf):
 			if not isinstance(parent, BNode):
 				p.append(parent)
 			else:
-				try:
-					un = (self.graph.objects(parent,OWL["unionOf"])).next()
-					parents = Collection(self.graph, un)
+				if self.index.unionOf(parent) != None:
 					print "WARNING : Ignoring union of parents !" # FIXME
 					#p.extend(parents) # FIXME : If the union'd nodes are themselves complicated, we will fail
-				except StopIteration:
-					parentTypeList = list(self.graph.objects(parent, RDF.type))
+				else:
+					parentTypeList = self.index.objects(parent, RDF.type)
 					if len(parentTypeList) > 0 and parentTypeList[0] == OWL.Restriction:
 						print "WARNING : Ignoring owl:Restriction on parents of "+str(self.c)
 					else:
@@ -219,10 +317,10 @@ class Generator:
 						raise Exception("Unhandled Blind Node in getParents")
 				
 		# Handle owl:sameAs links
-		for x in set(list(self.graph.objects(self.c, OWL.sameAs)) + list(self.graph.subjects(OWL.sameAs, self.c))):
+		for x in set(self.index.objects(self.c, OWL.sameAs) + self.index.subjects(OWL.sameAs, self.c)):
 			if x not in self.excludeClasses:
 				#print "Adding parents from "+str(x)+" sameAs "+str(self.c)
-				g = Generator(self.graph, x, excludeClasses=self.excludeClasses + [self.c])
+				g = Generator(self.graph, x, excludeClasses=self.excludeClasses + [self.c], index=self.index)
 				their_parents = g.getParents()
 				if their_parents != [RDFS.Resource]:
 					p.extend(their_parents)
@@ -234,39 +332,38 @@ class Generator:
 			else:
 				p.append(RDFS.Resource)
 				
-		removeDeprecated(self.graph, p)
+		removeDeprecated(self.index, p)
 		p = list(set(p)) # Remove duplicates
 		p.sort()
+		if len(self.excludeClasses) == 0:
+			self.index.parents[self.c] = list(p)
 		return p
 
-	def addImportForClass(self):
-		nsInit = open(os.path.join("mopy",self.ns,"__init__.py"), 'a')
-#		nsInit.write("from mopy.model import "+self.name+"\n")
-		nsInit.write("from mopy.model import "+ClassQNameToPyClassName(self.graph.qname(self.c))+" as "+self.name+"\n")
-		nsInit.close()
-
 	def TypeToPyTypeName(self, t):
-		# FIXME : One day it might be nice to actually model these and restrict as appropriate O_o
-		typeMapping = {"http://www.w3.org/2001/XMLSchema#integer" : "int",\
-					   "http://www.w3.org/2001/XMLSchema#int" : "int",\
-					   "http://www.w3.org/2001/XMLSchema#decimal" : "float",\
-					   "http://www.w3.org/2001/XMLSchema#float" : "float",\
-					   "http://www.w3.org/2001/XMLSchema#nonNegativeInteger" : "int",\
-					   "http://www.w3.org/2001/XMLSchema#duration": "str",\
-					   "http://www.w3.org/2001/XMLSchema#date" : "str",\
-					   "http://www.w3.org/2001/XMLSchema#dateTime" : "str",\
-				   	   "http://www.w3.org/2001/XMLSchema#gYear" : "int",\
-					   "http://www.w3.org/2001/XMLSchema#gYearMonth" : "str",\
-					   "http://www.w3.org/2001/XMLSchema#gMonth" : "int",\
-					   "http://www.w3.org/2001/XMLSchema#gDay" : "int",
-					   "http://www.w3.org/2001/XMLSchema#string" : "str"}
 		if not str(t).startswith("http://www.w3.org/2001/XMLSchema#"):
-			return (ClassQNameToPyClassName(self.graph.qname(t)))
-		elif str(t) in typeMapping.keys(): #FIXME handle others
-			return typeMapping[str(t)]
+			return (ClassQNameToPyClassName(self.index.qname(t)))
+		elif xsdTypeNames.has_key(str(t)): #FIXME handle others
+			return xsdTypeNames[str(t)]
 		else:
 			raise Exception("Got an unknown xmls type : " + t)
 			
+# validTypes of properties whose range is an XSD datatype. Literals of these are
+# coerced by mopy.XSD when RDF is imported.
+# FIXME : One day it might be nice to actually model these and restrict as appropriate O_o
+xsdTypeNames = {"http://www.w3.org/2001/XMLSchema#integer" : "int",\
+				"http://www.w3.org/2001/XMLSchema#int" : "int",\
+				"http://www.w3.org/2001/XMLSchema#decimal" : "XSD.decimalTypes",\
+				"http://www.w3.org/2001/XMLSchema#float" : "float",\
+				"http://www.w3.org/2001/XMLSchema#nonNegativeInteger" : "int",\
+				"http://www.w3.org/2001/XMLSchema#duration": "XSD.durationTypes",\
+				"http://www.w3.org/2001/XMLSchema#date" : "XSD.dateTypes",\
+				"http://www.w3.org/2001/XMLSchema#dateTime" : "XSD.dateTimeTypes",\
+				"http://www.w3.org/2001/XMLSchema#gYear" : "int",\
+				"http://www.w3.org/2001/XMLSchema#gYearMonth" : "XSD.gYearMonthTypes",\
+				"http://www.w3.org/2001/XMLSchema#gMonth" : "int",\
+				"http://www.w3.org/2001/XMLSchema#gDay" : "int",
+				"http://www.w3.org/2001/XMLSchema#string" : "str"}
+
 def PropQNameToPyName(qname):
 #	return qname.replace(":","_") # Probably don't need namespace in property names
 	return qname.split(":")[1]
@@ -278,24 +375,89 @@ def ClassQNameToPyClassName(qname):
 	return qname.replace(":", "___")
 def PyClassNameToClassQName(pyname):
 	return pyname.replace("___",":")
+def InstanceQNameToPyName(qname):
+	"""Instances are named by URIs whose local names aren't always identifiers
+	(myspace:Nu-Jazz), so other characters are replaced by an underscore."""
+	prefix, local = qname.split(":", 1)
+	return prefix+"___"+re.sub(r"_*[^A-Za-z0-9_]+_*", "_", local)
 
-def setupNamespace(ns, fromScratch=True):
+def setupNamespace(ns):
 	if not os.path.exists(os.path.join("mopy",ns)):
 		mkdir(os.path.join("mopy",ns))
-		fromScratch = True # If we've had to create the directory, we better start from scratch
-	if fromScratch:
-		nsInit = open(os.path.join("mopy",ns,"__init__.py"), 'w')
-		nsInit.write("import mopy.model\n\n")
-		nsInit.close()
-		packageInit = open(os.path.join("mopy","__init__.py"),'a')
-		packageInit.write("import "+ns+"\n")
-		packageInit.close()
-
-def addImportForInstance(ns, i):
-	nsInit = open(os.path.join("mopy",ns,"__init__.py"), 'a')
-	nsInit.write("from mopy.model import "+i+" as " + PyClassNameToClassQName(i).split(":")[1] + "\n")
+	packageInit = open(os.path.join("mopy","__init__.py"),'a')
+	packageInit.write("import "+ns+"\n")
+	packageInit.close()
+
+def writeNamespaceModule(ns, names):
+	"""Write mopy/<ns>/__init__.py, a lazy module of the classes and instances of the
+	namespace. names maps their names in the namespace to their names in mopy.model."""
+	nsInit = open(os.path.join("mopy",ns,"__init__.py"), 'w')
+	nsInit.write("from mopy.LazyModule import lazyModule\n\n")
+	nsInit.write("lazyModule(__name__, {\n")
+	for name in sorted(names.keys()):
+		nsInit.write("\t\""+name+"\" : (\"mopy.model\", \""+names[name]+"\"),\n")
+	nsInit.write("})\n")
 	nsInit.close()
-	
+
+def namespaceGroups(deps):
+	"""
+	Takes a dict of namespace -> namespaces its classes and instances need when
+	they are defined (parent classes, classes of instances). Namespaces which need
+	each other, like owl and rdfs, are written to a single module. Returns a dict
+	of namespace -> the namespace whose directory holds its module.
+	"""
+	reach = {}
+	for ns in deps.keys():
+		reach[ns] = set([ns])
+		todo = [ns]
+		while len(todo) > 0:
+			for d in deps[todo.pop()]:
+				if d not in reach[ns]:
+					reach[ns].add(d)
+					todo.append(d)
+	return dict([(ns, min([other for other in reach[ns] if ns in reach[other]])) for ns in deps.keys()])
+
+def hierarchyBits(classes, parents):
+	"""Returns the ancestorBits and descendantBits tables of model.py, for the classes
+	in order. Bit j of ancestorBits[i] is set when classes[j] is classes[i] or one of
+	its ancestors, and likewise for descendantBits."""
+	ids = dict([(c, i) for i, c in enumerate(classes)])
+	ancestors = {}
+	def ancestorsOf(c):
+		if not ancestors.has_key(c):
+			ancestors[c] = 0 # Guards against cycles
+			bits = 1 << ids[c]
+			for p in parents[c]:
+				if ids.has_key(p):
+					bits |= ancestorsOf(p)
+			ancestors[c] = bits
+		return ancestors[c]
+	ancestorBits = [ancestorsOf(c) for c in classes]
+	descendantBits = [0] * len(classes)
+	for i in range(len(classes)):
+		for j in range(len(classes)):
+			if ancestorBits[i] >> j & 1:
+				descendantBits[j] |= 1 << i
+	return ancestorBits, descendantBits
+
+def bindNamespaces(graph):
+	"""Bind the namespaces of the ontology which have no prefix, in sorted order, so
+	the prefixes made up for them (_32...) are the same from one run to the next,
+	however many classes are generated again."""
+	terms = set()
+	for triple in graph.triples((None, None, None)):
+		terms.update([t for t in triple if isinstance(t, URIRef)])
+	for term in sorted(terms):
+		try:
+			graph.namespace_manager.compute_qname(term)
+		except Exception: # No namespace and name to split it into
+			pass
+
+def withClassId(code, classId):
+	"""The code of a class generated without a classId, with one added after its classURI."""
+	end = code.index("\n", code.index("\tclassURI = ")) + 1
+	return code[:end] + "\tclassId = " + str(classId) + "\n" + code[end:]
+
 def removeDeprecated(g, xs):
 	for x in xs:
 		status = list(g.objects(x, URIRef("http://www.w3.org/2003/06/sw-vocab-status/ns#term_status")))
@@ -303,20 +465,118 @@ def removeDeprecated(g, xs):
 			print "DEPRECATED : "+str(x)
 			xs.remove(x)
 			
-def main():
+def topologicalOrder(classes, parents):
+	"""Returns classes ordered so that each comes after its parents, otherwise keeping to the given order."""
+	order = []
+	state = {} # class -> "visiting" or "done"
+	def visit(c):
+		if state.get(c) == "done":
+			return
+		if state.get(c) == "visiting" or not parents.has_key(c):
+			raise Exception("Couldn't find a serialisation order ! Stuck at class : " + c)
+		state[c] = "visiting"
+		for p in parents[c]:
+			visit(p)
+		state[c] = "done"
+		order.append(c)
+	for c in classes:
+		visit(c)
+	return order
+
+# add mew ontologies here...
+ontologyFiles = ["owl.rdfs", "time.owl", "classicalmusicnav.owl", "musicontology.rdfs", "extras.rdfs",\
+				 "foaf.rdfs", "chordontology.rdfs", "timeline.rdf", "event.rdf", "myspace.owl"]
+
+class DocumentRecorder(object):
+	"""Parser sink keeping the triples and namespace bindings of an ontology document, in order."""
+	def __init__(self):
+		self.triples = []
+		self.bindings = []
+	def add(self, triple):
+		self.triples.append(triple)
+	def bind(self, prefix, namespace, override=True):
+		self.bindings.append((prefix, namespace, override))
+
+class BuildCache:
+	"""
+	What earlier runs of genpy worked out, kept in a file between runs : the
+	parsed contents of each ontology document, keyed by the hash of the document,
+	and the generated code of each class, with the index lookups it was generated
+	from. A class is only generated again when the triples about it or one of
+	those lookups have changed, or when genpy.py itself has.
+	"""
+	def __init__(self, filename=".genpy-cache"):
+		self.filename = filename
+		self.documents = {} # content hash -> (triples, bindings)
+		self.classes = {} # classURI -> (key, lookups, code, parents)
+		self.generatorHash = fileHash(os.path.splitext(os.path.abspath(__file__))[0] + ".py")
+		try:
+			f = open(filename, "rb")
+			try:
+				generatorHash, self.documents, self.classes = cPickle.load(f)
+			finally:
+				f.close()
+			if generatorHash != self.generatorHash:
+				self.classes = {}
+		except Exception: # No cache yet, or an unreadable one
+			self.documents, self.classes = {}, {}
+
+	def save(self):
+		f = open(self.filename, "wb")
+		cPickle.dump((self.generatorHash, self.documents, self.classes), f, 2)
+		f.close()
+
+def fileHash(filename):
+	f = open(filename, "rb")
+	h = hashlib.sha1(f.read()).hexdigest()
+	f.close()
+	return h
+
+def nameBlankNodes(triples):
+	"""The triples of a document, with each blank node named after the triple
+	leading to it (its subject, predicate and how many blank nodes that subject
+	and predicate led to before). The parser's names change every time a document
+	is parsed, and these only change where it was edited, so the lookups of the
+	classes which only follow unchanged unionOf lists still replay."""
+	refs = {} # blank node -> (subject, predicate, count) of the first triple leading to it
+	counts = {} # (subject, predicate) -> blank nodes it leads to
+	for s, p, o in triples:
+		if isinstance(o, BNode) and not refs.has_key(o):
+			counts[(s, p)] = counts.get((s, p), 0) + 1
+			refs[o] = (s, p, counts[(s, p)])
+	names = {}
+	def name(b):
+		if not names.has_key(b):
+			names[b] = b # Until it is named, in case of a cycle
+			if refs.has_key(b):
+				s, p, n = refs[b]
+				if isinstance(s, BNode):
+					s = name(s)
+				names[b] = BNode(hashlib.sha1(repr((s, p, n))).hexdigest()[:20])
+		return names[b]
+	named = []
+	for triple in triples:
+		named.append(tuple([isinstance(t, BNode) and name(t) or t for t in triple]))
+	return named
+
+def loadOntology(cache=None):
 	spec_g = rdflib.ConjunctiveGraph()
 	print "Loading ontology documents..."
-	# add mew ontologies here...
-	spec_g.load("owl.rdfs")
-	spec_g.load("time.owl")
-	spec_g.load("classicalmusicnav.owl")
-	spec_g.load("musicontology.rdfs")
-	spec_g.load("extras.rdfs")
-	spec_g.load("foaf.rdfs")
-	spec_g.load("chordontology.rdfs")
-	spec_g.load("timeline.rdf")
-	spec_g.load("event.rdf")
-	spec_g.load("myspace.owl")
+	for filename in ontologyFiles:
+		h = fileHash(filename)
+		if cache != None and cache.documents.has_key(h):
+			print " "+filename+" unchanged"
+			triples, bindings = cache.documents[h]
+		else:
+			doc = DocumentRecorder()
+			plugin.get("xml", Parser)().parse(spec_g.prepare_input_source(filename), doc)
+			triples, bindings = nameBlankNodes(doc.triples), doc.bindings
+			if cache != None:
+				cache.documents[h] = (triples, bindings)
+		for prefix, namespace, override in bindings:
+			spec_g.bind(prefix, namespace, override)
+		for triple in triples:
+			spec_g.add(triple)
 
 	# FIXME : Why do these get lost in loading ?
 	spec_g.namespace_manager.bind("owl",rdflib.URIRef('http://www.w3.org/2002/07/owl#'))
@@ -324,6 +584,22 @@ def main():
 	spec_g.namespace_manager.bind("timeline",rdflib.URIRef('http://purl.org/NET/c4dm/timeline.owl#'))
 	spec_g.namespace_manager.bind("time", rdflib.URIRef("http://www.w3.org/2006/time#"))
 	spec_g.namespace_manager.bind("myspace", rdflib.URIRef("http://grasstunes.net/ontology/myspace.owl#"))
+	return spec_g
+
+def main(compact=False, useCache=True):
+	if useCache:
+		cache = BuildCache()
+		# Only keep the documents we still use
+		documents, cache.documents = cache.documents, {}
+		for filename in ontologyFiles:
+			h = fileHash(filename)
+			if documents.has_key(h):
+				cache.documents[h] = documents[h]
+	else:
+		cache = None
+	spec_g = loadOntology(cache)
+	bindNamespaces(spec_g)
+	index = OntologyIndex(spec_g)
 
 	classes = list(set(s for s in spec_g.subjects(RDF.type, OWL.Class) if type(s) != BNode)) # rdflib says rdfs:Class is a subClass of owl:Class - check !
 	removeDeprecated(spec_g, classes)
@@ -334,20 +610,148 @@ def main():
 	packageInit = open(os.path.join("mopy","__init__.py"),'w')
 	packageInit.write("import model\n")
 	packageInit.write("from MusicInfo import MusicInfo\n")
-	packageInit.write("from RDFInterface import importRDFGraph, importRDFFile, exportRDFGraph, exportRDFFile\n\n")
+	packageInit.write("from RDFInterface import importRDFGraph, importRDFFile, exportRDFGraph, exportRDFFile, exportRDFStream\n")
+	packageInit.write("from Snapshot import saveSnapshot, loadSnapshot\n\n")
 	packageInit.close()
-	
-	for ns in set([spec_g.qname(c).split(":")[0] for c in classes]):
+
+	#
+	# Property docstrings, only imported when one is read
+	#
+	docs = open(os.path.join("mopy","docs.py"), "w")
+	docs.write(fileHeader("docs.py - Docstrings of the properties of the model"))
+	docs.write("propDocs = {}\n")
+	graph_props = list(index.properties)
+	removeDeprecated(index, graph_props)
+	graph_props.sort()
+	print "properties : " + str(graph_props)
+	for p in graph_props:
+		doc = "\n".join(index.objects(p, RDFS.comment))
+		if len(doc) > 0:
+			if doc[-1] == '"':
+				doc = doc+"." # or python gets confused.
+			docs.write("propDocs[\""+PropQNameToPyName(spec_g.qname(p))+"\"]=\\\n\"\"\""+doc.strip()+"\"\"\"\n")
+		else:
+			docs.write("propDocs[\""+PropQNameToPyName(spec_g.qname(p))+"\"]=\"\"\n")
+	docs.close()
+
+	# The code of a class is cached with its definition, and the lookups (qnames
+	# included) it was generated from. Its classId is added as it is written out,
+	# so the classes after a new one are still reused.
+	reused = 0
+	for c in classes:
+		key = (compact, index.definitionHash(c))
+		cached = cache and cache.classes.get(str(c))
+		if cached and cached[0] == key and index.replay(cached[1]):
+			classtxt[str(c)] = cached[2]
+			parents[str(c)] = list(cached[3])
+			reused += 1
+		else:
+			print "processing " + str(c)
+			index.log = {}
+			g = Generator(spec_g, c, compact=compact, index=index)
+			g.printAll()
+			classtxt[str(c)] = g.out
+			parents[str(c)] = [str(p) for p in g.getParents()]
+			if cache != None:
+				cache.classes[str(c)] = (key, index.log, g.out, list(parents[str(c)]))
+			index.log = None
+	print "reused "+str(reused)+" of "+str(len(classes))+" classes"
+	ancestorBits, descendantBits = hierarchyBits([str(c) for c in classes], parents)
+	classIds = dict([(str(c), classId) for classId, c in enumerate(classes)])
+	pynames = dict([(str(c), ClassQNameToPyClassName(spec_g.qname(c))) for c in classes])
+
+	#
+	# Ontology-defined Instances
+	#
+	# FIXME : Properties aren't handled !
+	instances = [] # (class, instance, description, name)
+	instanceNames = set()
+	for c in classes:
+		if c == RDFS.Class:
+			continue
+		cInstances = [s for s in index.subjects(RDF.type, c) if type(s) != BNode]
+		removeDeprecated(spec_g, cInstances)
+		cInstances.sort()
+		for i in cInstances:
+			instancename = InstanceQNameToPyName(spec_g.qname(i))
+			if instancename in pynames.values():
+				print "WARNING : Ignoring instance "+str(i)+", its name is taken by a class"
+				continue
+			if instancename in instanceNames:
+				print "WARNING : Ignoring instance "+str(i)+", its name is taken by another instance"
+				continue
+			if not re.match(r"[A-Za-z_][A-Za-z0-9_]*$", instancename):
+				print "WARNING : Ignoring instance "+str(i)+", "+instancename+" isn't a valid name"
+				continue
+			instanceNames.add(instancename)
+			print "Instance of "+pynames[str(c)]+" : "+str(i)
+			descrip="\n".join([d.strip() for d in index.objects(i, DC.description)])
+			instances.append((str(c), i, descrip, instancename))
+
+	#
+	# Classes and instances are written to a module per namespace, which is
+	# imported the first time one of its names is used through mopy.model
+	#
+	def nsOf(name):
+		return name.split("___")[0]
+	deps = {} # namespace -> namespaces it needs when it is imported
+	for c in classes:
+		deps.setdefault(nsOf(pynames[str(c)]), set()).update([nsOf(pynames[p]) for p in parents[str(c)] if pynames.has_key(p)])
+	for c, i, descrip, instancename in instances:
+		deps.setdefault(nsOf(instancename), set()).add(nsOf(pynames[c]))
+	for ns in sorted(deps.keys()):
+		deps[ns].discard(ns)
 		setupNamespace(ns)
-					
+	groups = namespaceGroups(deps)
+	lazyNames = {} # name in mopy.model -> module defining it
+	nsNames = dict([(ns, {}) for ns in deps.keys()]) # namespace -> name in the namespace -> name in mopy.model
+	for group in sorted(set(groups.values())):
+		members = sorted([ns for ns in deps.keys() if groups[ns] == group])
+		moduleName = "mopy."+group+"._model"
+		groupClasses = [c for c in topologicalOrder([str(c) for c in classes], parents) if groups[nsOf(pynames[c])] == group]
+		groupInstances = [instance for instance in instances if groups[nsOf(instance[3])] == group]
+		# Names this module needs from other modules when it is imported
+		imported = set([pynames[p] for c in groupClasses for p in parents[c] if pynames.has_key(p)] + [pynames[instance[0]] for instance in groupInstances])
+		imported = sorted([name for name in imported if groups[nsOf(name)] != group])
+
+		module = open(os.path.join("mopy",group,"_model.py"), "w")
+		module.write(fileHeader(group+"/_model.py - Classes and instances of the "+" and ".join(members)+" namespace"+"s"[:len(members)-1]))
+		module.write("from mopy.PropertySet import PropertySet, PropertyDescriptor, CompactPropertyDescriptor, protector\n")
+		module.write("from mopy import model, XSD\n")
+		module.write("from mopy.model import objToStr\n")
+		for name in imported:
+			module.write("from mopy.model import "+name+"\n")
+		module.write("\n\n# ========================  Class Definitions  ====================== \n")
+		for c in groupClasses:
+			module.write(withClassId(classtxt[c], classIds[c]))
+			lazyNames[pynames[c]] = moduleName
+			nsNames[nsOf(pynames[c])][pynames[c].split("___")[1]] = pynames[c]
+		if len(groupInstances) > 0:
+			module.write("\n\n# ======================= Instance Definitions ======================= \n")
+			lastClass = None
+			for c, i, descrip, instancename in groupInstances:
+				if c != lastClass:
+					module.write("\n")
+					lastClass = c
+				module.write(instancename+" = "+ pynames[c]+"(\""+str(i)+"\")\n")
+				if len(descrip)>0:
+					if descrip[-1] == '"':
+						descrip = descrip+"." # or python gets confused.
+					module.write(instancename+".description = \\\n\"\"\""+descrip+"\"\"\"\n")
+				lazyNames[instancename] = moduleName
+				nsNames[nsOf(instancename)][instancename.split("___")[1]] = instancename
+		# The classes are reached through mopy.model, and keep its name in reprs and pickles
+		module.write("\nfor _c in ("+"".join([pynames[c]+", " for c in groupClasses])+"):\n")
+		module.write("\t_c.__module__ = \"mopy.model\"\n")
+		module.close()
+
+	for ns, names in nsNames.iteritems():
+		writeNamespaceModule(ns, names)
+
 	model = open(os.path.join("mopy","model.py"), "w")
-	model.write("""
-# ===================================================================
-# = model.py - Core and External Classes of the Music Ontology 
-# =            Generated automatically on """+time.asctime()+"""
-# ===================================================================\n\n\n""")
+	model.write(fileHeader("model.py - Core and External Classes of the Music Ontology"))
 	model.write("import sys\n")
-	model.write("from mopy.PropertySet import PropertySet, protector\n\n")
+	model.write("from mopy.LazyModule import lazyModule\n\n")
 	
 	objToStr = """
 def objToStr(c):
@@ -368,89 +772,44 @@ def objToStr(c):
 	return s.encode(sys.getdefaultencoding(), 'replace')
 """
 	model.write(objToStr)
-	model.write("\n# ======================== Property Docstrings ====================== \n\n")
-	model.write("propDocs = {}\n")
-	graph_props = list(spec_g.subjects(RDF.type, RDF.Property))
-	for subType in spec_g.subjects(RDFS.subClassOf, RDF.Property):
-		graph_props.extend(list(spec_g.subjects(RDF.type, subType)))
-	removeDeprecated(spec_g, graph_props)
-	graph_props.sort()
-	print "properties : " + str(graph_props)
-	for p in graph_props:
-		doc = "\n".join(spec_g.objects(p, RDFS.comment))
-		if len(doc) > 0:
-			if doc[-1] == '"':
-				doc = doc+"." # or python gets confused.
-			model.write("propDocs[\""+PropQNameToPyName(spec_g.qname(p))+"\"]=\\\n\"\"\""+doc.strip()+"\"\"\"\n")
-		else:
-			model.write("propDocs[\""+PropQNameToPyName(spec_g.qname(p))+"\"]=\"\"\n")
-		
-	model.write("\n\n\n\n# ========================  Class Definitions  ====================== \n")
-
-	for c in classes:
-		print "processing " + str(c)
-		g = Generator(spec_g, c)
-		g.printAll()
-		classtxt[str(c)] = g.out
-		parents[str(c)] = [str(p) for p in g.getParents()]
-		g.addImportForClass() # Add the class to the right namespace
 
 	#
-	# Serialise classes in an appropriate order
+	# Class hierarchy tables, so that subclass queries don't need to walk MROs
 	#
-	remclasses = [str(c) for c in classes]
-	n=1; lastlen = len(remclasses)+1
-	while (len(remclasses) > 0) and len(remclasses) < lastlen:
-		lastlen = len(remclasses)
-		print("pass "+ str(n))
-		for c in remclasses:
-			if len(parents[c]) == 0: # Write out orphans immediately
-				model.write(classtxt[c])
-				print(" wrote "+c)
-				remclasses.remove(c)
-				for k in remclasses:    # And abandon any classes who were waiting for us
-					if c in parents[k]:
-						parents[k].remove(c)
-		n+=1
-
-	if len(remclasses) > 0:
-		raise Exception("Couldn't find a serialisation order ! Remaining classes : " + "\n".join(remclasses))
-		
+	model.write("\n\n# ====================== Class Hierarchy Tables ===================== \n")
+	model.write("# Bit j of ancestorBits[c.classId] is set when classNamesById[j] is c or one\n")
+	model.write("# of its ancestors, and of descendantBits[c.classId] when it is c or a subclass.\n\n")
+	model.write("classNamesById = (" + ",\n\t".join(["\""+pynames[str(c)]+"\"" for c in classes]) + ")\n")
+	model.write("ancestorBits = (" + ",\n\t".join([hex(b) for b in ancestorBits]) + ")\n")
+	model.write("descendantBits = (" + ",\n\t".join([hex(b) for b in descendantBits]) + ")\n")
 
 	#
-	# Ontology-defined Instances
+	# Names of the classes and instances, by URI, so that they can be found without loading them
 	#
-	# FIXME : Properties aren't handled !
-	model.write("\n\n# ======================= Instance Definitions ======================= \n")
-	for c in classes:
-		if c == RDFS.Class:
-			continue
-		instances = [s for s in spec_g.subjects(RDF.type, c) if type(s) != BNode]
-		removeDeprecated(spec_g, instances)
-		instances.sort()
-		for ns in set([spec_g.qname(i).split(":")[0] for i in instances]):
-			setupNamespace(ns, False)
-		if len(instances)>0:
-			classname= ClassQNameToPyClassName(spec_g.qname(c))
-			model.write("\n")
-			for i in instances:
-				print "Instance of "+classname+" : "+str(i)
-				instancename = ClassQNameToPyClassName(spec_g.qname(i))
-				model.write(instancename+" = "+ classname+"(\""+str(i)+"\")\n")
-				descrip="\n".join([d.strip() for d in spec_g.objects(i, DC.description)])
-				if len(descrip)>0:
-					if descrip[-1] == '"':
-						descrip = descrip+"." # or python gets confused.
-					model.write(instancename+".description = \\\n\"\"\""+descrip+"\"\"\"\n")
-				addImportForInstance(spec_g.qname(i).split(":")[0], instancename)
+	model.write("\n\n# ===================== Class and Instance Names ===================== \n")
+	model.write("classNames = {" + ",\n\t".join(["\""+str(c)+"\" : \""+pynames[str(c)]+"\"" for c in classes]) + "}\n")
+	model.write("instanceNames = {" + ",\n\t".join(["\""+str(i)+"\" : \""+instancename+"\"" for c, i, descrip, instancename in instances]) + "}\n")
 	
 	NamespaceBindings = ",".join(["\"" + NSName + "\":\"" + str(NSURI) + "\"" for NSName, NSURI in spec_g.namespaces()])
 	model.write("\nnamespaceBindings = {" + NamespaceBindings + "}\n\n")
-	model.write("\n\n# =======================       Clean Up       ======================= \n")
-	model.write("del objToStr, propDocs\n")
-	
+
+	model.write("\n\n# ========================= Lazy Definitions ========================= \n")
+	model.write("# The classes and instances of each namespace are imported the first time one is used\n\n")
+	model.write("lazyModule(__name__, {\n")
+	for name in sorted(lazyNames.keys()):
+		model.write("\t\""+name+"\" : (\""+lazyNames[name]+"\", \""+name+"\"),\n")
+	model.write("})\n")
 	model.close()
+	if cache != None:
+		cache.save()
+
+def fileHeader(title):
+	return """
+# ===================================================================
+# = """+title+"""
+# =            Generated automatically on """+time.asctime()+"""
+# ===================================================================\n\n\n"""
 
 if __name__ == '__main__':
-	main()
+	main(compact = "--compact" in sys.argv[1:], useCache = "--no-cache" not in sys.argv[1:])
 
@@ -0,0 +1,199 @@
+"""
+Ingest.py
+
+Import many small RDF documents, such as per-artist descriptions fetched from
+the web, into one MusicInfo :
+
+	>>> mi = ingestSources(["http://zitgist.com/music/artist/2f58d07c-4ed6-4f29-8b10-95266e16fe1b",
+	...                     "artists/megadeth.rdf"], concurrency=16)
+
+Up to concurrency sources are fetched at once, by threads, and the documents
+they return are parsed by a pool of processes. The objects of each document are
+then added to the MusicInfo from the calling thread, with add_many, so that
+objects with the same URI are merged and blind nodes matched as when importing
+the documents one by one, with a SourceImporter each so that their blank node
+IDs don't clash, and adding the results by hand. At most backlog parsed
+documents wait to be added : when the MusicInfo can't keep up (an SQLite store,
+say), fetching stops until it does.
+
+A fetcher is a function taking a source and returning (data, format) : the
+document as a string, and the rdflib name of its format. fetchSource, the
+default, reads http: and https: sources with an HTTPFetcher and others as files.
+References to URIs a document doesn't describe are resolved against the objects
+already in the MusicInfo.
+"""
+
+import threading
+import multiprocessing
+import urllib2
+import Queue
+from logging import error
+from mopy.MusicInfo import MusicInfo, getBlindURI
+from mopy.RDFInterface import RDFImporter, ImportException, parseData
+
+# File extension -> format, for files and for documents served without a known Content-Type
+extensionFormats = {"rdf" : "xml", "xml" : "xml", "owl" : "xml", "nt" : "nt", "nq" : "nq",\
+					"n3" : "n3", "ttl" : "n3"}
+# Content-Type -> format
+contentFormats = {"application/rdf+xml" : "xml", "application/xml" : "xml", "text/xml" : "xml",\
+				  "text/plain" : "nt", "application/n-triples" : "nt", "application/n-quads" : "nq",\
+				  "text/rdf+n3" : "n3", "text/n3" : "n3", "text/turtle" : "n3"}
+
+def formatOf(name, contentType=None, default="xml"):
+	"""The format of a document, from its Content-Type if known, or else from the extension of its name."""
+	if contentType != None:
+		contentType = contentType.split(";")[0].strip().lower()
+		if contentFormats.has_key(contentType):
+			return contentFormats[contentType]
+	extension = name.split("?")[0].rsplit("/", 1)[-1].rsplit(".", 1)[-1].lower()
+	return extensionFormats.get(extension, default)
+
+def fetchFile(source):
+	"""Read a file, given by its path or a file: URI."""
+	if source.startswith("file://"):
+		path = source[len("file://"):]
+	else:
+		path = source
+	f = open(path, "rb")
+	try:
+		return f.read(), formatOf(path)
+	finally:
+		f.close()
+
+class HTTPFetcher(object):
+	"""Fetch documents over HTTP, asking for RDF. See also urllib2.install_opener, for proxies."""
+	accept = "application/rdf+xml, text/rdf+n3;q=0.9, text/turtle;q=0.9, text/plain;q=0.5"
+
+	def __init__(self, timeout=30, accept=None):
+		self.timeout = timeout
+		if accept != None:
+			self.accept = accept
+
+	def __call__(self, url):
+		response = urllib2.urlopen(urllib2.Request(url, headers={"Accept" : self.accept}), timeout=self.timeout)
+		try:
+			return response.read(), formatOf(response.geturl(), response.info().gettype())
+		finally:
+			response.close()
+
+_httpFetcher = HTTPFetcher()
+
+def fetchSource(source):
+	if source.startswith("http://") or source.startswith("https://"):
+		return _httpFetcher(source)
+	return fetchFile(source)
+
+class SourceImporter(RDFImporter):
+	"""An RDFImporter giving the blind nodes of one document URIs of their own, as
+	documents parsed apart reuse the same node IDs."""
+	def __init__(self, strict=True, validate=True, profile=None):
+		RDFImporter.__init__(self, strict, validate, profile)
+		self.prefix = getBlindURI()[len("blind:"):]+"."
+
+	def blindURI(self, node):
+		return getBlindURI(self.prefix+str(node))
+
+def parseSource(args):
+	"""Run by the parsing processes of ingestSources."""
+	data, format, base, strict, validate = args
+	importer = SourceImporter(strict, validate)
+	parseData(importer, data, format, base)
+	return importer.partial()
+
+def ingestSources(sources, mi=None, fetcher=fetchSource, concurrency=8, processes=None, backlog=None,\
+				  strict=True, validate=True, failures=None, profile=None):
+	"""
+	Fetch, parse and add the documents of sources (an iterable of URLs or file
+	names, only read as fetchers are free) to mi, or to a new MusicInfo, and
+	return it.
+
+	processes is the number of parsing processes, by default one for each CPU.
+	With processes=0, the fetching threads parse documents themselves.
+	backlog is the number of parsed documents which can be waiting to be added,
+	by default twice concurrency.
+
+	With strict=True, the first source which can't be fetched or parsed stops
+	the ingestion, raising an ImportException. Otherwise failed sources are
+	logged and skipped, and (source, exception) pairs appended to the list
+	failures, if given.
+
+	A Profile given as profile times "waiting" (for a document to be parsed)
+	and the stages of adding each document to the MusicInfo (see RDFImporter),
+	and counts "sources" and "failed sources".
+	"""
+	if mi == None:
+		mi = MusicInfo(profile=profile)
+	if processes == None:
+		processes = multiprocessing.cpu_count()
+	if backlog == None:
+		backlog = 2*concurrency
+	pool = None
+	if processes > 0:
+		pool = multiprocessing.Pool(processes)
+	sources = iter(sources)
+	sourcesLock = threading.Lock()
+	stop = threading.Event()
+	done = Queue.Queue(backlog) # (source, partial import, exception), or None when a fetcher ends
+
+	def fetch():
+		try:
+			while not stop.is_set():
+				sourcesLock.acquire()
+				try:
+					source = next(sources, None)
+				finally:
+					sourcesLock.release()
+				if source == None:
+					break
+				try:
+					data, format = fetcher(source)
+					args = (data, format, source, strict, validate)
+					if pool != None:
+						partial = pool.apply(parseSource, (args,))
+					else:
+						partial = parseSource(args)
+					done.put((source, partial, None))
+				except Exception, e:
+					done.put((source, None, e))
+		finally:
+			done.put(None)
+
+	threads = [threading.Thread(target=fetch) for i in range(concurrency)]
+	for t in threads:
+		t.daemon = True
+		t.start()
+	running = len(threads)
+	wait = done.get
+	if profile != None:
+		wait = profile.timed("waiting", wait)
+	try:
+		while running > 0:
+			item = wait()
+			if item == None:
+				running -= 1
+				continue
+			source, partial, e = item
+			if e != None:
+				if profile != None:
+					profile.count("failed sources")
+				if strict:
+					raise ImportException("Couldn't import "+source+" : "+str(e))
+				error("Couldn't import %s : %s", source, e)
+				if failures != None:
+					failures.append((source, e))
+				continue
+			if profile != None:
+				profile.count("sources")
+			importer = RDFImporter(strict, validate, profile)
+			importer.addPartials([partial])
+			mi.add_many(importer.resolve(mi.MainIdx))
+			mi.namespaceBindings.update(importer.namespaces)
+	finally:
+		stop.set()
+		while running > 0: # Let the fetchers finish what they are doing
+			if done.get() == None:
+				running -= 1
+		if pool != None:
+			pool.close()
+			pool.join()
+	return mi
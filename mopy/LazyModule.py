@@ -0,0 +1,50 @@
+"""
+LazyModule.py
+
+Modules whose attributes are imported from other modules when first used.
+
+genpy.py writes the classes and instances of each namespace to a module of
+their own, and makes mopy.model and the namespace packages (mopy.mo, mopy.foaf,
+...) lazy modules, so that "import mopy" doesn't define every class of every
+ontology. A namespace is loaded the first time one of its names is used.
+"""
+
+import sys
+from types import ModuleType
+
+class LazyModule(ModuleType):
+	"""
+	Stands in for a module in sys.modules. It has the attributes of the module,
+	and the names in lazyNames, which map to the module to import and the
+	attribute to read there.
+	"""
+	def __init__(self, module, lazyNames):
+		ModuleType.__init__(self, module.__name__, module.__doc__)
+		self.__dict__.update(module.__dict__)
+		self._module = module # Python 2 clears the globals of a module when it is freed
+		self._lazyNames = lazyNames
+		if not self.__dict__.has_key("__all__"):
+			self.__all__ = sorted([name for name in self.__dict__.keys() + lazyNames.keys() if not name.startswith("_")])
+
+	def __getattr__(self, name):
+		if name.startswith("__") or not self._lazyNames.has_key(name):
+			raise AttributeError("'module' object has no attribute '"+name+"'")
+		moduleName, attr = self._lazyNames[name]
+		__import__(moduleName)
+		value = getattr(sys.modules[moduleName], attr)
+		setattr(self, name, value)
+		return value
+
+	def __dir__(self):
+		return sorted(set(self.__dict__.keys() + self._lazyNames.keys()))
+
+	def loadAll(self):
+		"""Import every lazy name of the module."""
+		for name in self._lazyNames.keys():
+			getattr(self, name)
+
+def lazyModule(name, lazyNames):
+	"""Replace the module called name in sys.modules with a LazyModule. Call it last thing in the module."""
+	module = LazyModule(sys.modules[name], lazyNames)
+	sys.modules[name] = module
+	return module
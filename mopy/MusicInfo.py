@@ -9,8 +9,13 @@ Copyright (c) 2007 Chris Sutton. All rights reserved.
 
 from logging import log, error, warning, info, debug
 from mopy import model
+from mopy.PropertySet import PropertySet
+from mopy.TimeLine import TimeLineIndex, timeLineProperties
+import bisect
 import random
 
+rdfType = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+
 class MusicInfoException(Exception):
 	def __init__(self, message) :
 		self.message = message
@@ -18,12 +23,30 @@ class MusicInfoException(Exception):
 		return self.message
 
 class MusicInfo(object):
-	def __init__(self, objects=None, namespaceBindings = model.namespaceBindings):
+	"""
+	A store of MO objects, indexed by URI and by class.
+	
+	A Profile given as profile (see mopy.Profile) times the stages "store"
+	(adding objects) and "blind matching" (looking for a known blind node like
+	an added one), and counts the "merges" of objects with the same URI and the
+	"blind matches" found.
+	"""
+	def __init__(self, objects=None, namespaceBindings = model.namespaceBindings, profile=None):
 		if objects==None:
 			objects = []
 		self.MainIdx = {}
-		for obj in objects:
-			self.add(obj)
+		self._referrers = {} # URI -> set of (holder, propName) pairs pointing at it
+		self._blindSigs = {} # class -> {signature : {URI : blind obj}}
+		self._sigOf = {} # blind URI -> signature it is indexed under
+		self._indexes = {} # propName -> PropertyIndex
+		self._timeLines = None # TimeLineIndex, once indexTimeLines() is called
+		self._changes = None # (added, subject URI, propertyURI, value key) for each change, once checkpoint() is called
+		self._changesBase = 0 # Checkpoint of the first entry in _changes
+		self.literals = {} # unicode literal -> the copy shared by the objects of this store
+		self.profile = profile
+		if profile != None:
+			profile.instrument(self, {"add" : "store", "add_many" : "store", "findExistingBlindObj" : "blind matching"})
+		self.add_many(objects)
 		self.namespaceBindings = namespaceBindings
 
 	def add(self, obj, URI=None):
@@ -34,11 +57,11 @@ class MusicInfo(object):
 				found = self.findExistingBlindObj(obj)
 				if found == None:
 					if not isBlind(obj):
-						debug(" Assigning a blind URI for "+str(obj).replace("\n","|"))
+						debug(" Assigning a blind URI for %s", OneLine(obj))
 						obj.URI = getBlindURI()
 				else:
-					debug("Already know blind obj "+str(obj).replace("\n","|"))
-					obj.URI = found.URI # Update other references to this blind node
+					debug("Already know blind obj %s", OneLine(obj))
+					self.sameBlind(obj, found)
 					return
 					
 			URI = obj.URI
@@ -51,6 +74,9 @@ class MusicInfo(object):
 			if not hasattr(self, obj.shortname+"Idx"):
 				setattr(self, obj.shortname+"Idx", {})
 			getattr(self, obj.shortname+"Idx")[URI] = obj
+			self.watch(obj)
+			if isBlind(obj):
+				self.indexBlind(obj)
 		else:
 			existing = self.MainIdx[URI]
 			if isinstance(obj, type(existing)):
@@ -62,57 +88,481 @@ class MusicInfo(object):
 			else:
 				raise MusicInfoException("Tried to add two objects for the same URI and classes are a mismatch !"\
 										 +"\n Existing : "+str(existing)+"\nAdding : "+str(obj))
-			debug("Merging Existing : "+str(existing)+"\nAdding : "+str(obj))
-			for propName in keep._props.keys():
-				 if add._props.has_key(propName):
-					for v in add._props[propName]:
+			debug("Merging Existing : %s\nAdding : %s", existing, obj)
+			if self.profile != None:
+				self.profile.count("merges")
+			for propName, propSet in add._props.items():
+				 if hasattr(keep, propName):
+					for v in propSet:
 						#debug("Adding "+str(v).replace("\n","|")+" to "+str(keep).replace("\n","|")+" as "+propName)
-						keep._props[propName].add(v)
+						getattr(keep, propName).add(v)
 
 			# Update references
+			if keep != existing:
+				del getattr(self, existing.shortname+"Idx")[URI]
 			self.MainIdx[URI] = keep
 			if not hasattr(self, keep.shortname+"Idx"):
 				setattr(self, keep.shortname+"Idx", {})
 			getattr(self, keep.shortname+"Idx")[URI] = keep
 			
 			if keep != existing:
-				del getattr(self, existing.shortname+"Idx")[URI]
-				for obj in self.MainIdx.values():
-					for propSet in obj._props.values():
-						outdatedRefs = [v for v in propSet if v==existing]
-						for v in outdatedRefs:
-							debug("Updating reference in "+str(obj).replace("\n","|"))
-							propSet.remove(v)
-							propSet.add(keep)
+				self.unwatch(existing)
+				if isBlind(existing):
+					self.unindexBlind(existing)
+				self.watch(keep)
+				if isBlind(keep):
+					self.indexBlind(keep)
+				for holder, propName in self.referrersOf(URI):
+					propSet = holder._props[propName]
+					outdatedRefs = [v for v in propSet if v is existing]
+					for v in outdatedRefs:
+						debug("Updating reference in %s", OneLine(holder))
+						propSet.remove(v)
+						propSet.add(keep)
 	
+	def add_many(self, objs):
+		"""Add the objects of objs, with the same result as calling add() for each in turn.
+		
+		Objects with new URIs, and blind nodes unlike any already known, are put
+		in MainIdx and the <shortname>Idx dicts with one update for each class.
+		Objects to be merged with one already added are given to add() in order."""
+		pending = {} # shortname -> {URI : new object}
+		pendingURIs = set()
+		pendingSigs = {} # (class, signature) -> new blind object
+		for obj in objs:
+			if not hasattr(obj, "shortname"):
+				raise MusicInfoException("No shortname property for object " + str(obj) + ", did it come from the MO model ?")
+			sig = None
+			if getattr(obj, "URI", None) == None or isBlind(obj):
+				sig = self.signature(obj)
+				found = pendingSigs.get((type(obj), sig))
+				if found == None:
+					found = self.findExistingBlindObj(obj, sig)
+				if found != None:
+					debug("Already know blind obj %s", OneLine(obj))
+					self.sameBlind(obj, found)
+					continue
+				if not isBlind(obj):
+					obj.URI = getBlindURI()
+			URI = obj.URI
+			if URI in pendingURIs or self.haveURI(URI):
+				self.addPending(pending, pendingSigs)
+				pendingURIs.clear()
+				self.add(obj)
+				continue
+			pendingURIs.add(URI)
+			if obj.shortname not in pending:
+				pending[obj.shortname] = {}
+			pending[obj.shortname][URI] = obj
+			if sig != None:
+				pendingSigs[(type(obj), sig)] = obj
+		self.addPending(pending, pendingSigs)
+
+	def sameBlind(self, obj, found):
+		"""obj, which isn't added, is the blind node found."""
+		if self.profile != None:
+			self.profile.count("blind matches")
+		obj.URI = found.URI # Update other references to this blind node
+
+	def addPending(self, pending, pendingSigs):
+		"""Put the new objects of add_many in the indexes, a class at a time."""
+		for shortname, objs in pending.iteritems():
+			self.MainIdx.update(objs)
+			if not hasattr(self, shortname+"Idx"):
+				setattr(self, shortname+"Idx", {})
+			getattr(self, shortname+"Idx").update(objs)
+		for objs in pending.itervalues():
+			self.watchMany(objs.itervalues())
+		for (cls, sig), obj in pendingSigs.iteritems():
+			self.indexBlind(obj, sig)
+		pending.clear()
+		pendingSigs.clear()
+
 	def haveURI(self, uri):
 		return self.MainIdx.has_key(uri)
+
+	def instances_of(self, cls, include_subclasses=True):
+		"""Returns a list of the objects of class cls, and of its subclasses unless include_subclasses is False."""
+		found = []
+		if include_subclasses and hasattr(cls, "classId"):
+			bits = model.descendantBits[cls.classId]
+			for shortname in descendantShortnames(cls.classId):
+				for o in getattr(self, shortname+"Idx", {}).itervalues():
+					classId = getattr(type(o), "classId", None)
+					if classId != None and bits >> classId & 1:
+						found.append(o)
+		else:
+			for o in getattr(self, cls.shortname+"Idx", {}).itervalues():
+				if type(o) is cls:
+					found.append(o)
+		return found
+
+	#
+	# Reverse references :
+	#
+	def watch(self, obj):
+		"""Index the references held by obj and follow changes to its properties."""
+		obj._watchers = obj._watchers + (self,)
+		if self._changes != None and getattr(obj, "classURI", None) != None:
+			self._changes.append((True, obj.URI, rdfType, ("uri", obj.classURI)))
+		for propSet in obj._props.values():
+			propSet.shareLiterals(self.literals)
+			for v in propSet:
+				self.propertyChanged(obj, propSet, v, True)
+		if self._timeLines != None:
+			self._timeLines.changed(obj)
+
+	def watchMany(self, objs):
+		"""watch() each of objs, only indexing their references if nothing else needs to see their values."""
+		if self._changes != None or self._indexes or self._timeLines != None:
+			for obj in objs:
+				self.watch(obj)
+			return
+		for obj in objs:
+			obj._watchers = obj._watchers + (self,)
+			for propSet in obj._props.itervalues():
+				propSet.shareLiterals(self.literals)
+				for v in propSet:
+					if not isinstance(v, propSet.Lits):
+						self.addReferrer(getattr(v, "URI", None), obj, propSet.shortname)
+
+	def unwatch(self, obj):
+		obj._watchers = tuple([w for w in obj._watchers if w is not self])
+		if self._timeLines != None:
+			self._timeLines.remove(obj)
+		if self._changes != None and getattr(obj, "classURI", None) != None:
+			self._changes.append((False, obj.URI, rdfType, ("uri", obj.classURI)))
+		for propSet in obj._props.values():
+			index = self._indexes.get(propSet.shortname)
+			for v in propSet:
+				if self._changes != None:
+					self._changes.append((False, obj.URI, propSet.propertyURI, valueKey(v)))
+				if index != None:
+					index.discard(valueKey(v), obj)
+				if not isinstance(v, propSet.Lits):
+					self.discardReferrer(getattr(v, "URI", None), obj, propSet.shortname)
+
+	def propertyChanged(self, holder, propSet, v, added):
+		"""Called by a watched PropertySet when v is added to or removed from it."""
+		if self._changes != None:
+			self._changes.append((added, holder.URI, propSet.propertyURI, valueKey(v)))
+		if self._sigOf.has_key(holder.URI):
+			self.reindexBlind(holder)
+		if self._indexes.has_key(propSet.shortname):
+			key = valueKey(v)
+			if added:
+				self._indexes[propSet.shortname].add(key, holder)
+			elif key not in [valueKey(other) for other in propSet]:
+				self._indexes[propSet.shortname].discard(key, holder)
+		if self._timeLines != None and propSet.shortname in timeLineProperties:
+			self._timeLines.changed(holder)
+		if isinstance(v, propSet.Lits):
+			return
+		uri = getattr(v, "URI", None)
+		if added:
+			self.addReferrer(uri, holder, propSet.shortname)
+		else:
+			for other in propSet:
+				if getattr(other, "URI", None) == uri and not isinstance(other, propSet.Lits):
+					return # Still referenced by another value
+			self.discardReferrer(uri, holder, propSet.shortname)
+
+	def addReferrer(self, uri, holder, propName):
+		self._referrers.setdefault(uri, set()).add((holder, propName))
+
+	def discardReferrer(self, uri, holder, propName):
+		if self._referrers.has_key(uri):
+			self._referrers[uri].discard((holder, propName))
+			if len(self._referrers[uri]) == 0:
+				del self._referrers[uri]
+
+	def referrersOf(self, uri):
+		"""Returns a list of (holder, propName) pairs whose property values include an object with this URI."""
+		# Values which had no URI when they were indexed may have been given one since
+		for holder, propName in list(self._referrers.get(None, ())):
+			propSet = holder._props[propName]
+			uris = set([getattr(v, "URI", None) for v in propSet if not isinstance(v, propSet.Lits)])
+			for u in uris:
+				self._referrers.setdefault(u, set()).add((holder, propName))
+			if None not in uris:
+				self._referrers[None].discard((holder, propName))
+		return list(self._referrers.get(uri, ()))
 		
-	def findExistingBlindObj(self, o):
+	#
+	# Secondary indexes :
+	#
+	def addIndex(self, propName, ordered=False):
+		"""Index the objects of the store by their values for propName, for find().
+		
+		An ordered index also keeps its values sorted, for range conditions on
+		numeric or date literals."""
+		if self._indexes.has_key(propName) and (self._indexes[propName].ordered or not ordered):
+			return
+		index = PropertyIndex(ordered)
+		for obj in self.MainIdx.values():
+			for v in obj._props.get(propName, ()):
+				index.add(valueKey(v), obj)
+		self._indexes[propName] = index
+
+	def removeIndex(self, propName):
+		del self._indexes[propName]
+
+	def find(self, cls=None, **conditions):
+		"""Returns a list of the objects of class cls (or a subclass) matching all the conditions.
+		
+		A condition propName=value matches objects having value among their values for
+		propName, objects being compared by URI. propName=slice(low, high) matches
+		objects having a value v with low <= v < high, either bound being optional.
+		The candidates come from the most selective index among those on the
+		conditions' properties, and are checked against the other conditions."""
+		best = None
+		for propName, condition in conditions.iteritems():
+			if self._indexes.has_key(propName):
+				candidates = self._indexes[propName].lookup(condition)
+				size = sum([len(c) for c in candidates])
+				if best == None or size < best[0]:
+					best = (size, propName, candidates)
+		if best == None:
+			objs = self.MainIdx.itervalues()
+		else:
+			objs = set()
+			for c in best[2]:
+				objs.update(c)
+			conditions = conditions.copy()
+			del conditions[best[1]]
+		found = []
+		for o in objs:
+			if cls != None and not isinstance(o, cls):
+				continue
+			for propName, condition in conditions.iteritems():
+				if not matches(o._props.get(propName, ()), condition):
+					break
+			else:
+				found.append(o)
+		return found
+
+	#
+	# Timelines :
+	#
+	def indexTimeLines(self):
+		"""Index the Instants and Intervals of the store by their positions on their timelines,
+		for overlapping(), at() and within(). The index is kept up to date from then on."""
+		if self._timeLines == None:
+			self._timeLines = TimeLineIndex(self.MainIdx.values())
+
+	def overlapping(self, timeLine, start, end):
+		"""Returns a list of the Instants and Intervals on timeLine (an object or its URI)
+		overlapping the range from start to end, which are numbers of seconds,
+		timedeltas or datetimes. Events can be found from their times with referrersOf()."""
+		self.indexTimeLines()
+		return self._timeLines.overlapping(self.MainIdx.get(timeLine, timeLine), start, end)
+
+	def at(self, timeLine, t):
+		"""Returns a list of the Instants and Intervals on timeLine at t."""
+		return self.overlapping(timeLine, t, t)
+
+	def within(self, timeLine, start, end):
+		"""Returns a list of the Instants and Intervals on timeLine lying between start and end."""
+		self.indexTimeLines()
+		return self._timeLines.within(self.MainIdx.get(timeLine, timeLine), start, end)
+
+	#
+	# Change log :
+	#
+	def checkpoint(self):
+		"""Start logging changes, if not already, and return a marker of the current state for changesSince()."""
+		if self._changes == None:
+			self._changes = []
+		return self._changesBase + len(self._changes)
+
+	def forgetChanges(self, before):
+		"""Drop the log of changes made before the checkpoint before."""
+		if self._changes != None and before > self._changesBase:
+			del self._changes[:before - self._changesBase]
+			self._changesBase = before
+
+	def changesSince(self, since):
+		"""Returns the (added, removed) triples since a checkpoint, as lists of
+		(subject URI, propertyURI, value) with objects given as ("uri", URI)."""
+		if self._changes == None or since < self._changesBase:
+			raise MusicInfoException("No log of the changes since checkpoint "+str(since))
+		first = {} # triple -> whether its first change was an addition
+		last = {}
+		for added, s, p, v in self._changes[since - self._changesBase:]:
+			key = (s, p, type(v), v)
+			if not first.has_key(key):
+				first[key] = added
+			last[key] = added
+		added = []
+		removed = []
+		for key, isAdded in last.iteritems():
+			if isAdded and not first[key]:
+				continue # Removed, then put back
+			if not isAdded and first[key]:
+				continue # Added, then removed again
+			s, p, t, v = key
+			if isAdded:
+				added.append((s, p, v))
+			else:
+				removed.append((s, p, v))
+		added.sort()
+		removed.sort()
+		return added, removed
+
+	def export_delta(self, since, out, format="sparql", removedOut=None):
+		"""Write the triples added and removed since a checkpoint. See RDFInterface.exportRDFDelta."""
+		from mopy.RDFInterface import exportRDFDelta
+		exportRDFDelta(self, since, out, format, removedOut)
+
+	def findExistingBlindObj(self, o, sig=None):
 		if not hasattr(o, "shortname"):
 			raise MusicInfoException("No shortname property for object " + str(o) + ", did it come from the MO model ?")
-		if not hasattr(self, o.shortname+"Idx"):
+		if not self._blindSigs.has_key(type(o)):
 			return None
-			
-		idx = getattr(self, o.shortname+"Idx")
-		for obj in idx.values():
-			if obj.URI.startswith("blind:"):
-				# test properties
-				match = True
-				try:
-					for propName in obj._props.keys():
-						if obj._props[propName] != o._props[propName]:
-							#print("Disregarding "+str(obj).replace("\n","|")+" due to property "+propName+" differing.\n")
-							match = False
-				except:
-					match = False
-					
-				if match == True:
-					info("Found object "+str(obj).replace("\n","|")+" to match "+str(o).replace("\n","|"))
-					return obj
-					
-		return None
 		
+		if sig == None:
+			sig = self.signature(o)
+		matches = self._blindSigs[type(o)].get(sig)
+		if not matches:
+			return None
+		obj = matches.values()[0]
+		info("Found object %s to match %s", OneLine(obj), OneLine(o))
+		return obj
+
+	#
+	# Blind node signatures :
+	#
+	def signature(self, o, visiting=None):
+		"""Canonical, hashable description of o's property values.
+		
+		Nested blind nodes are described by their own signatures, so two blind nodes
+		have the same signature exactly when findExistingBlindObj should treat them as
+		the same node."""
+		if isBlind(o) and self._sigOf.has_key(o.URI) and self.MainIdx.get(o.URI) is o:
+			return self._sigOf[o.URI]
+		if visiting == None:
+			visiting = set()
+		visiting.add(id(o))
+		items = []
+		for propName, propSet in o._props.iteritems():
+			if len(propSet) == 0:
+				continue
+			vals = []
+			for v in propSet:
+				if isinstance(v, propSet.Lits):
+					vals.append(v)
+				elif getattr(v, "URI", None) == None or isBlind(v):
+					if id(v) in visiting:
+						vals.append(("blind", None)) # Cycle of blind nodes
+					else:
+						vals.append(("blind", self.signature(v, visiting)))
+				else:
+					vals.append(("uri", v.URI))
+			items.append((propName, frozenset(vals)))
+		visiting.discard(id(o))
+		return frozenset(items)
+
+	def indexBlind(self, obj, sig=None):
+		if sig == None:
+			sig = self.signature(obj)
+		self._sigOf[obj.URI] = sig
+		self._blindSigs.setdefault(type(obj), {}).setdefault(sig, {})[obj.URI] = obj
+
+	def unindexBlind(self, obj):
+		sig = self._sigOf.pop(obj.URI)
+		sigs = self._blindSigs[type(obj)]
+		matches = sigs[sig]
+		if matches.get(obj.URI) is obj:
+			del matches[obj.URI]
+		if len(matches) == 0:
+			del sigs[sig]
+
+	def reindexBlind(self, obj, done=None):
+		"""Recompute the signature of a changed blind node, and of the blind nodes referring to it."""
+		if done == None:
+			done = set()
+		if obj.URI in done or self.MainIdx.get(obj.URI) is not obj:
+			return
+		done.add(obj.URI)
+		self.unindexBlind(obj)
+		self.indexBlind(obj)
+		for holder, propName in self.referrersOf(obj.URI):
+			if self._sigOf.has_key(holder.URI):
+				self.reindexBlind(holder, done)
+		
+class PropertyIndex(object):
+	"""The objects of a MusicInfo having each value of a property."""
+	def __init__(self, ordered=False):
+		self.ordered = ordered
+		self.holders = {} # value key -> set of objects
+		self.keys = [] # Sorted value keys, for ordered indexes
+
+	def add(self, key, holder):
+		if not self.holders.has_key(key):
+			self.holders[key] = set()
+			if self.ordered:
+				bisect.insort(self.keys, key)
+		self.holders[key].add(holder)
+
+	def discard(self, key, holder):
+		if not self.holders.has_key(key):
+			return
+		holders = self.holders[key]
+		holders.discard(holder)
+		if len(holders) == 0:
+			del self.holders[key]
+			if self.ordered:
+				del self.keys[bisect.bisect_left(self.keys, key)]
+
+	def lookup(self, condition):
+		"""Returns a list of the sets of objects matching a find() condition."""
+		if isinstance(condition, slice):
+			if not self.ordered:
+				return [holders for key, holders in self.holders.iteritems() if matches((key,), condition)]
+			start, stop = 0, len(self.keys)
+			if condition.start != None:
+				start = bisect.bisect_left(self.keys, condition.start)
+			if condition.stop != None:
+				stop = bisect.bisect_left(self.keys, condition.stop)
+			return [self.holders[key] for key in self.keys[start:stop]]
+		return [self.holders.get(valueKey(condition), ())]
+
+def valueKey(v):
+	"""What indexes and find() compare values by : literals themselves, objects by URI."""
+	if isinstance(v, PropertySet.Lits):
+		return v
+	return ("uri", getattr(v, "URI", None))
+
+def matches(values, condition):
+	if isinstance(condition, slice):
+		for v in values:
+			if (condition.start == None or v >= condition.start) and (condition.stop == None or v < condition.stop):
+				return True
+		return False
+	key = valueKey(condition)
+	for v in values:
+		if valueKey(v) == key:
+			return True
+	return False
+
+_descendants = {}
+
+def descendantShortnames(classId):
+	"""The shortnames of a class and its subclasses, read from the hierarchy tables
+	of the model without importing the namespaces of the subclasses."""
+	if not _descendants.has_key(classId):
+		bits = model.descendantBits[classId]
+		_descendants[classId] = set([name.split("___", 1)[1] for i, name in enumerate(model.classNamesById) if bits >> i & 1])
+	return _descendants[classId]
+
+class OneLine(object):
+	"""An object written on one line in log messages, only formatted if the message is logged."""
+	__slots__ = ("obj",)
+	def __init__(self, obj):
+		self.obj = obj
+	def __str__(self):
+		return str(self.obj).replace("\n","|")
+
 def isBlind(obj):
 	return hasattr(obj,"URI") and obj.URI != None and obj.URI.startswith("blind:")
 
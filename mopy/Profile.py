@@ -0,0 +1,84 @@
+"""
+Profile.py
+
+Timers and counters for the stages of an import or export.
+
+Pass a Profile to importRDFFile, importRDFGraph, exportRDFGraph,
+exportRDFStream or exportRDFFile, or to a MusicInfo, to find out where the
+time goes :
+
+	>>> p = Profile()
+	>>> mi = mopy.importRDFFile("dump.nt", "nt", profile=p)
+	>>> print p.report()
+
+The methods of the importer and store doing each stage are replaced by timed
+versions on the instance only, so nothing is timed, or slowed down, without a
+Profile. Stages can be nested, and each stage is only charged for the time not
+spent in the stages it calls : the time of "parse", around the rdflib parser,
+doesn't include the time spent making objects from the triples it finds.
+"""
+
+from __future__ import absolute_import # mopy.time is the OWL-Time namespace
+import time
+
+class Profile(object):
+	"""
+	Wall and CPU seconds spent in each stage, and counts of events such as
+	triples read, objects made and merges.
+
+	If callback is given, it is called as callback(profile, stage) whenever a
+	stage ends, eg. to report progress. It is called often for stages done for
+	each triple, so keep it cheap.
+	"""
+	def __init__(self, callback=None):
+		self.wall = {} # stage -> seconds, not counting nested stages
+		self.cpu = {}
+		self.calls = {} # stage -> number of times it was run
+		self.counts = {} # event -> count
+		self.callback = callback
+		self._running = [] # [stage, wall start, cpu start, wall of nested stages, cpu of nested stages]
+
+	def begin(self, stage):
+		self._running.append([stage, time.time(), time.clock(), 0.0, 0.0])
+
+	def end(self):
+		stage, wallStart, cpuStart, nestedWall, nestedCpu = self._running.pop()
+		wall = time.time() - wallStart
+		cpu = time.clock() - cpuStart
+		self.wall[stage] = self.wall.get(stage, 0.0) + wall - nestedWall
+		self.cpu[stage] = self.cpu.get(stage, 0.0) + cpu - nestedCpu
+		self.calls[stage] = self.calls.get(stage, 0) + 1
+		if self._running:
+			self._running[-1][3] += wall
+			self._running[-1][4] += cpu
+		if self.callback != None:
+			self.callback(self, stage)
+
+	def count(self, event, n=1):
+		self.counts[event] = self.counts.get(event, 0) + n
+
+	def timed(self, stage, f):
+		"""f, counted as stage whenever it is called."""
+		def timedCall(*args, **kwargs):
+			self.begin(stage)
+			try:
+				return f(*args, **kwargs)
+			finally:
+				self.end()
+		return timedCall
+
+	def instrument(self, obj, stages):
+		"""Time the methods of obj named in the dict stages, as the stage they map to."""
+		for methodName, stage in stages.iteritems():
+			setattr(obj, methodName, self.timed(stage, getattr(obj, methodName)))
+
+	def report(self):
+		"""The stages, slowest first, and the counts, as text."""
+		lines = ["%-16s %10s %10s %10s" % ("stage", "wall (s)", "cpu (s)", "calls")]
+		for stage in sorted(self.wall.keys(), key=lambda s: -self.wall[s]):
+			lines.append("%-16s %10.3f %10.3f %10d" % (stage, self.wall[stage], self.cpu[stage], self.calls[stage]))
+		if self.counts:
+			lines.append("%-16s %10s" % ("event", "count"))
+		for event in sorted(self.counts.keys()):
+			lines.append("%-16s %10d" % (event, self.counts[event]))
+		return "\n".join(lines)
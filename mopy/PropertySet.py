@@ -5,32 +5,85 @@ Created by Chris Sutton on 2007-08-11.
 Copyright (c) 2007 Chris Sutton. All rights reserved.
 """
 from logging import error, warning, info, debug
+from collections import MutableSet
+from mopy import XSD
 
-class PropertySet(set):
+def internLiteral(v, literals=None):
+	"""The shared copy of a string literal, so that equal strings held by many
+	objects (genre names, dates...) are stored once. str values are intern()ed,
+	unicode values are looked up in literals, the table of a store (see
+	MusicInfo.literals), if there is one."""
+	if type(v) == str:
+		return intern(v)
+	elif type(v) == unicode and literals != None:
+		return literals.setdefault(v, v)
+	return v
 
-	def __init__(self, shortname, propertyURI, validTypes, allowLits):
-		set.__init__(self)
-		self.shortname = shortname
-		self.propertyURI = propertyURI
-		self.validTypes = validTypes
-		self.allowLits = allowLits
-		self.Lits = (str, unicode, int, float) # Any more ? 
-	#
-	# Set functions :
-	#	
-	def add(self, o):
-		# type check :
-		#print "type checking against : "+str(self.validTypes)
-		#if self.allowLits:
-		#	print "(lits allowed)"
-		if not ((self.allowLits and isinstance(o, self.Lits))\
-				or (self.validTypes != None and isinstance(o, self.validTypes))\
-				or self.validTypes == None):
+class PropertySetMethods(object):
+	"""
+	What PropertySet and CompactPropertySet have in common. The description of
+	the property is shared by all the sets for it, through their schema (the
+	PropertyDescriptor of the class).
+	"""
+	__slots__ = ()
+	Lits = (str, unicode, int, float) + XSD.nativeTypes # Any more ? 
+
+	shortname = property(lambda self: self.schema.shortname)
+	propertyURI = property(lambda self: self.schema.propertyURI)
+	validTypes = property(lambda self: self.schema.validTypes)
+	allowLits = property(lambda self: self.schema.allowLits)
+
+	def check(self, o):
+		"""Raise a TypeError if o can't be a value of this property, otherwise return the value to store."""
+		# type check, remembering the verdict for each concrete type :
+		try:
+			ok = self.schema.typeVerdicts[type(o)]
+		except KeyError:
+			#print "type checking against : "+str(self.validTypes)
+			#if self.allowLits:
+			#	print "(lits allowed)"
+			ok = (self.allowLits and isinstance(o, self.Lits))\
+				 or (self.validTypes != None and isinstance(o, self.validTypes))\
+				 or self.validTypes == None
+			self.schema.typeVerdicts[type(o)] = ok
+		if not ok:
 			msg = "Invalid type for "+self.shortname+" property ! Got "+str(type(o))+" but expected one of : "+str(self.validTypes)
 			if self.allowLits:
 				msg+= " (or a literal)"
 			raise TypeError(msg)
-		set.add(self,o)
+		return internLiteral(o, self.literals())
+
+	def add(self, o):
+		self._store(self.check(o))
+
+	def add_many(self, values, validate=True):
+		"""Add several values. All are type checked before any is added, unless
+		validate is False (for values from a trusted source, eg. our own exports)."""
+		if validate:
+			values = [self.check(v) for v in values]
+		else:
+			literals = self.literals()
+			values = [internLiteral(v, literals) for v in values]
+		for v in values:
+			self._store(v)
+
+	def literals(self):
+		"""The literal table of the first store holding our object, if any."""
+		if self.holder != None and self.holder._watchers:
+			return getattr(self.holder._watchers[0], "literals", None)
+		return None
+
+	def shareLiterals(self, literals):
+		"""Swap our unicode values for their copies in literals, when our object
+		is put in a store. No notifications are sent, the values are equal."""
+		for v in [v for v in self if type(v) == unicode]:
+			shared = literals.setdefault(v, v)
+			if shared is not v:
+				self._replace(v, shared)
+
+	def update(self, *others):
+		for values in others:
+			self.add_many(values)
 	
 	def get(self):
 		#print "in custom get()"
@@ -40,6 +93,235 @@ class PropertySet(set):
 		self.clear()
 		self.add(v)
 
+	def notify(self, o, added):
+		if self.holder != None:
+			for store in self.holder._watchers:
+				store.propertyChanged(self.holder, self, o, added)
+
+	def __reduce__(self):
+		"""Pickled as the object holding the set, the name of the property and the
+		values. The schema is found again as the property of the holder's class."""
+		if self.holder == None:
+			return (type(self), (self.schema,), list(self))
+		return (holderPropertySet, (self.holder, self.shortname), list(self))
+
+def holderPropertySet(holder, shortname):
+	"""An empty PropertySet for the property shortname of holder, when unpickling."""
+	schema = getattr(type(holder), shortname)
+	return schema.setClass(schema, holder)
+
+class PropertySet(PropertySetMethods, set):
+
+	__slots__ = ("schema", "holder")
+
+	def __init__(self, schema, holder=None):
+		set.__init__(self)
+		self.schema = schema
+		self.holder = holder # The object this is a property of
+	#
+	# Set functions :
+	#	
+	def _store(self, o):
+		if o in self:
+			return
+		set.add(self,o)
+		self.notify(o, True)
+
+	def __ior__(self, other):
+		self.update(other)
+		return self
+
+	def __setstate__(self, values):
+		set.update(self, values) # The holder is still being unpickled, so no notifications
+
+	def _replace(self, old, new):
+		set.remove(self, old)
+		set.add(self, new)
+
+	def remove(self, o):
+		set.remove(self, o)
+		self.notify(o, False)
+
+	def discard(self, o):
+		if o in self:
+			self.remove(o)
+
+	def clear(self):
+		old = (self.holder != None and self.holder._watchers) and list(self) or ()
+		set.clear(self)
+		for o in old:
+			self.notify(o, False)
+
+class _Values(set):
+	"""Storage of a CompactPropertySet holding more than one value."""
+	pass
+
+_empty = object()
+
+class CompactPropertySet(PropertySetMethods, MutableSet):
+	"""
+	A PropertySet which keeps a single value inline, only allocating a real set
+	once a second value is added. Most properties only ever have one value.
+	"""
+	__slots__ = ("schema", "holder", "_value")
+
+	def __init__(self, schema, holder=None):
+		self.schema = schema
+		self.holder = holder
+		self._value = _empty
+
+	def __contains__(self, o):
+		if isinstance(self._value, _Values):
+			return o in self._value
+		return self._value is not _empty and self._value == o
+
+	def __iter__(self):
+		if isinstance(self._value, _Values):
+			return iter(list(self._value))
+		elif self._value is _empty:
+			return iter(())
+		return iter((self._value,))
+
+	def __len__(self):
+		if isinstance(self._value, _Values):
+			return len(self._value)
+		return int(self._value is not _empty)
+
+	def __repr__(self):
+		return "PropertySet("+repr(list(self))+")"
+
+	__hash__ = None # Mutable
+
+	def __setstate__(self, values):
+		if len(values) > 1:
+			self._value = _Values(values)
+		elif len(values) == 1:
+			self._value = values[0]
+
+	def _replace(self, old, new):
+		if isinstance(self._value, _Values):
+			self._value.remove(old)
+			self._value.add(new)
+		else:
+			self._value = new
+
+	#
+	# Set functions :
+	#	
+	def _store(self, o):
+		if o in self:
+			return
+		if self._value is _empty:
+			self._value = o
+		elif isinstance(self._value, _Values):
+			self._value.add(o)
+		else:
+			self._value = _Values((self._value, o))
+		self.notify(o, True)
+
+	def remove(self, o):
+		if o not in self:
+			raise KeyError(o)
+		if isinstance(self._value, _Values):
+			self._value.remove(o)
+			if len(self._value) == 1:
+				self._value = self._value.pop()
+		else:
+			self._value = _empty
+		self.notify(o, False)
+
+	def discard(self, o):
+		if o in self:
+			self.remove(o)
+
+	def clear(self):
+		old = list(self)
+		self._value = _empty
+		for o in old:
+			self.notify(o, False)
+
+class PropertyDoc(object):
+	"""
+	__doc__ of PropertyDescriptors. The docstrings of the model's properties are
+	kept in mopy.docs, which is only imported when one of them is first read.
+	"""
+	def __init__(self, classDoc):
+		self.classDoc = classDoc
+
+	def __get__(self, obj, cls=None):
+		if obj == None:
+			return self.classDoc
+		from mopy.docs import propDocs
+		obj.__doc__ = propDocs.get(obj.shortname, "")
+		return obj.__doc__
+
+class PropertyDescriptor(object):
+	"""
+	Class attribute wrapping one property of a model class.
+	
+	Each instance gets its PropertySet for the property the first time it is
+	accessed, and keeps it in its _props dict, so objects only pay for the
+	properties they use.
+	"""
+	__doc__ = PropertyDoc(__doc__)
+	setClass = PropertySet
+
+	def __init__(self, shortname, propertyURI, validTypes, allowLits, doc=None):
+		self.shortname = shortname
+		self.propertyURI = propertyURI
+		self._validTypes = validTypes # Tuple of types and names of model classes, or None
+		self.allowLits = allowLits
+		self.typeVerdicts = {} # Type of value -> whether it is allowed
+		if doc != None:
+			self.__doc__ = doc # Otherwise read from mopy.docs on first use
+
+	def getValidTypes(self):
+		"""The types values may have, names of model classes being looked up in
+		mopy.model the first time, as their namespaces may not be loaded before.
+		Classes the model doesn't have (ranges outside the ontologies genpy read,
+		such as rdf:List) are left out, and a property left with none takes any
+		value, as one without a range does."""
+		if self._validTypes != None and str in [type(t) for t in self._validTypes]:
+			from mopy import model
+			validTypes = []
+			for t in self._validTypes:
+				if type(t) == str:
+					if not hasattr(model, t):
+						warning("No class %s in the model for the range of %s, ignoring it", t, self.propertyURI)
+						continue
+					t = getattr(model, t)
+				validTypes.append(t)
+			self._validTypes = tuple(validTypes) or None
+		return self._validTypes
+	validTypes = property(getValidTypes)
+
+	def __get__(self, obj, cls=None):
+		if obj == None:
+			return self
+		try:
+			return obj._props[self.shortname]
+		except KeyError:
+			propSet = self.setClass(self, obj)
+			obj._props[self.shortname] = propSet
+			return propSet
+
+	def __set__(self, obj, value):
+		self.__get__(obj).set(value)
+
+class CompactPropertyDescriptor(PropertyDescriptor):
+	"""PropertyDescriptor of the classes generated by genpy.py --compact."""
+	__doc__ = PropertyDoc(__doc__)
+	setClass = CompactPropertySet
+
+def classProperties(cls):
+	"""Returns a dict of propName -> PropertyDescriptor for a model class, including inherited properties."""
+	props = {}
+	for c in reversed(cls.__mro__):
+		for name, attr in c.__dict__.iteritems():
+			if isinstance(attr, PropertyDescriptor):
+				props[name] = attr
+	return props
+
 def protector(self, item, value):
 	if (not self.__dict__.has_key("_initialised"))\
 		   or self._initialised == False \
@@ -23,10 +23,18 @@ Copyright (c) 2007 Chris Sutton. All rights reserved.
 
 from mopy import model
 from mopy import time
+from mopy import XSD
 from mopy.MusicInfo import MusicInfo, getBlindURI, isBlind
-from mopy.rdfs import Resource
-import rdflib; from rdflib import URIRef, Literal, BNode, RDF, RDFS, ConjunctiveGraph
+from mopy.PropertySet import classProperties
+import rdflib; from rdflib import URIRef, Literal, BNode, RDF, RDFS, Graph, ConjunctiveGraph, plugin
+from rdflib.StringInputSource import StringInputSource
+from rdflib.syntax.parsers import Parser
+from rdflib.syntax.parsers.NTParser import NTSink
+from rdflib.syntax.parsers.ntriples import NTriplesParser, ParseError, r_wspace, r_wspaces, r_tail
 from logging import log, error, warning, info, debug
+from StringIO import StringIO
+import multiprocessing
+import re
 
 class ImportException(Exception):
 	def __init__(self, message) :
@@ -40,129 +48,443 @@ class ExportException(Exception):
 	def __str__(self) :
 		return self.message
 
-def importRDFFile(filename, format="xml", strict=True):
-	g = ConjunctiveGraph()
-	g.load(filename, format=format)
-	return importRDFGraph(g, strict)
-
-def importRDFGraph(g, strict=True):
-	objs = {}
-	modelAttrs = [model.__dict__[c] for c in model.__dict__.keys()]
-	knownTypes = dict([(c.classURI, c) for c in modelAttrs if hasattr(c, "classURI") and type(c) == type])
-	knownInstances = dict([(i.URI, i) for i in modelAttrs if hasattr(i, "URI")])
+#
+# Tables describing the model, built once per process
+#
+
+_modelIndex = {}
+_propertyTables = {}
+_predicateRefs = {}
+
+class ModelTable(dict):
+	"""
+	A dict of URI -> class or instance of the model. It starts out holding the
+	names of the classes and instances in mopy.model, and only looks them up
+	(importing the namespace which defines them) when they are first used.
+	"""
+	def __getitem__(self, uri):
+		v = dict.__getitem__(self, uri)
+		if type(v) == str:
+			v = getattr(model, v)
+			dict.__setitem__(self, uri, v)
+		return v
+
+	def get(self, uri, default=None):
+		if not self.has_key(uri):
+			return default
+		return self[uri]
+
+def knownTypes():
+	"""Returns a dict of classURI -> class for the classes of the model."""
+	if not _modelIndex.has_key("types"):
+		_modelIndex["types"] = ModelTable(model.classNames)
+	return _modelIndex["types"]
+
+def knownInstances():
+	"""Returns a dict of URI -> instance for the instances defined by the model."""
+	if not _modelIndex.has_key("instances"):
+		_modelIndex["instances"] = ModelTable(model.instanceNames)
+	return _modelIndex["instances"]
+
+class PropertyTable(dict):
+	"""
+	A dict of propertyURI -> (propName, validTypes, allowLits, coerce) for a
+	model class. It starts out holding (propName, PropertyDescriptor) pairs, and
+	only resolves the valid types of a property, which may import other
+	namespaces, when the property is first looked up.
+	"""
+	def __getitem__(self, uri):
+		v = dict.__getitem__(self, uri)
+		if len(v) == 2:
+			propName, prop = v
+			v = (propName, prop.validTypes, prop.allowLits, literalCoercer(prop.validTypes))
+			dict.__setitem__(self, uri, v)
+		return v
+
+def propertyTable(cls):
+	"""Returns a PropertyTable of propertyURI -> (propName, validTypes, allowLits, coerce) for a model class.
+	
+	coerce turns an rdflib Literal into the value to store for that property."""
+	if not _propertyTables.has_key(cls):
+		_propertyTables[cls] = PropertyTable([(prop.propertyURI, (propName, prop)) for propName, prop in classProperties(cls).iteritems()])
+	return _propertyTables[cls]
+
+def predicateRefs(cls):
+	"""Returns a dict of propName -> URIRef of the property, for a model class."""
+	if not _predicateRefs.has_key(cls):
+		_predicateRefs[cls] = dict([(propName, URIRef(prop.propertyURI)) for propName, prop in classProperties(cls).iteritems()])
+	return _predicateRefs[cls]
+
+def flatTypes(validTypes):
+	"""validTypes as a list of types, without the nested tuples isinstance allows."""
+	if validTypes == None:
+		return []
+	elif not isinstance(validTypes, tuple):
+		return [validTypes]
+	return [t for ts in validTypes for t in flatTypes(ts)]
+
+def literalCoercer(validTypes):
+	validTypes = flatTypes(validTypes)
+	numericTypes = [t for t in validTypes if t in (int, float)]
+	def coerce(o):
+		if o.datatype != None and XSD.coercers.has_key(str(o.datatype)):
+			return XSD.coercers[str(o.datatype)](o)
+		# Untyped literal for a numeric property, eg. mo:track_number "1"
+		for t in numericTypes:
+			try:
+				return t(o)
+			except ValueError:
+				pass
+		return str(o)
+	return coerce
+
+# Formats whose rdflib parsers can write straight into an RDFImporter.
+# The others (n3...) need a real store to parse into.
+streamableFormats = ("xml", "rdf/xml", "nt")
+# Formats with one triple per line, which can be split by subject for a parallel import
+partitionableFormats = ("nt", "nq")
+
+def importRDFFile(filename, format="xml", strict=True, validate=True, processes=1, profile=None):
+	"""Returns a MusicInfo of the objects described in an RDF file. See mopy.Profile for profile."""
+	if processes > 1 and format in partitionableFormats:
+		return importRDFFileParallel(filename, format, strict, validate, processes, profile)
+	importer = RDFImporter(strict, validate, profile)
+	parse = parseFile
+	if profile != None:
+		parse = profile.timed("parse", parse)
+	parse(importer, filename, format)
+	return importer.close()
+
+def parseFile(importer, filename, format):
+	if format == "nq":
+		NQuadsParser(NTSink(importer)).parse(open(filename, "rb"))
+	elif format in streamableFormats:
+		source = Graph().prepare_input_source(filename)
+		plugin.get(format, Parser)().parse(source, importer)
+	else:
+		g = ConjunctiveGraph()
+		g.load(filename, format=format)
+		importer.addGraph(g)
+
+def parseData(importer, data, format, base=None):
+	"""Parse the string data, a document whose relative URIs are resolved against base, into importer."""
+	if format == "nq":
+		NQuadsParser(NTSink(importer)).parse(StringIO(data))
+		return
+	source = StringInputSource(data)
+	if base != None:
+		source.setPublicId(base)
+	if format in streamableFormats:
+		plugin.get(format, Parser)().parse(source, importer)
+	else:
+		g = ConjunctiveGraph()
+		g.parse(source, publicID=base, format=format)
+		importer.addGraph(g)
+
+def importRDFGraph(g, strict=True, validate=True, profile=None):
+	importer = RDFImporter(strict, validate, profile)
+	importer.addGraph(g)
+	return importer.close()
+
+def importRDFFileParallel(filename, format="nt", strict=True, validate=True, processes=None, profile=None):
+	"""
+	Import an N-Triples or N-Quads file using several processes.
+	
+	The lines of the file are split by subject, so that all the triples about a
+	subject go to the same worker. Each worker converts its share of the file,
+	and the results are merged into one MusicInfo, as a serial import would
+	build it.
+	"""
+	if format not in partitionableFormats:
+		raise ImportException("Can't split "+format+" files for a parallel import, use one of "+str(partitionableFormats))
+	if processes == None:
+		processes = multiprocessing.cpu_count()
+	parts = [[] for i in range(processes)]
+	for line in open(filename, "rb"):
+		terms = line.split(None, 1)
+		if len(terms) == 0 or terms[0].startswith("#"):
+			continue
+		if not line.endswith("\n"):
+			line += "\n"
+		parts[hash(terms[0]) % processes].append(line)
+	pool = multiprocessing.Pool(processes)
+	work = pool.map
+	if profile != None:
+		work = profile.timed("workers", work)
+	try:
+		partials = work(importPartition, [("".join(lines), format, strict, validate) for lines in parts])
+	finally:
+		pool.close()
+		pool.join()
+	importer = RDFImporter(strict, validate, profile)
+	importer.addPartials(partials)
+	return importer.close()
+
+def importPartition(args):
+	"""Run in a worker process by importRDFFileParallel."""
+	data, format, strict, validate = args
+	importer = RDFImporter(strict, validate)
+	if format == "nq":
+		NQuadsParser(NTSink(importer)).parse(StringIO(data))
+	else:
+		NTriplesParser(NTSink(importer)).parse(StringIO(data))
+	return importer.partial()
+
+class NQuadsParser(NTriplesParser):
+	"""Reads N-Quads (or N-Triples), leaving out the context of each statement."""
+	def parseline(self):
+		self.eat(r_wspace)
+		if (not self.line) or self.line.startswith('#'):
+			return # The line is empty or a comment
+
+		subject = self.subject()
+		self.eat(r_wspaces)
+
+		predicate = self.predicate()
+		self.eat(r_wspaces)
+
+		object = self.object()
+		self.eat(r_wspace)
+		if not self.peek('.'):
+			if not (self.uriref() or self.nodeid()):
+				raise ParseError("Context must be uriref or nodeID")
+		self.eat(r_tail)
+
+		if self.line:
+			raise ParseError("Trailing garbage")
+		self.sink.triple(subject, predicate, object)
+
+class RDFImporter(object):
+	"""
+	Builds MO objects from a stream of triples, in a single pass.
+	
+	An RDFImporter can be used directly as the sink of an rdflib parser, as it
+	has the add() and bind() methods of a graph. Blind nodes are given blind:
+	URIs as they arrive, properties of subjects whose rdf:type hasn't been seen
+	yet are held back until it is, and references to objects which haven't been
+	typed yet are resolved by close(), which returns the resulting MusicInfo.
 	
-	#
-	# Replace blind nodes with local names
-	#
-	for bn in [s for s,p,o in set(g.triples((None,None,None))) if type(s) == BNode]:
-		for p,o in set(g.predicate_objects(bn)):
-			g.remove((bn, p, o))
-			g.add((URIRef(getBlindURI(bn)), p, o))
-	for bn in [o for s,p,o in set(g.triples((None,None,None))) if type(o) == BNode]:
-		for s,p in set(g.subject_predicates(bn)):
-			g.remove((s,p,bn))
-			g.add((s, p, URIRef(getBlindURI(bn))))
+	With validate=False, property values are not type checked. Only use it for
+	trusted sources, such as files written by exportRDFFile.
 	
-	#
-	# Create Python objects to model triple subjects
-	#
-	for s in set(g.subjects()):
-		s_type = None
+	A Profile given as profile times the stages of the import : "triples"
+	(reading each triple), "bnodes" (naming blind nodes), "construct" (making an
+	object for each typed subject), "properties" (checking and adding property
+	values), "graph" (reading an rdflib graph), "partials" (merging the work of
+	importRDFFileParallel's workers) and "close" (resolving references and
+	adding the objects to the MusicInfo, whose own stages are described in
+	MusicInfo). importRDFFile adds "parse", for the rdflib parser itself, and
+	"workers" for a parallel import.
+	"""
+	def __init__(self, strict=True, validate=True, profile=None):
+		self.strict = strict
+		self.validate = validate
+		self.profile = profile
+		self.objs = {}
+		self.untyped = {} # URI -> [(p, o)] of subjects without a known type yet
+		self.unknownTypes = {} # URI -> rdf:type we have no class for
+		self.forwardRefs = {} # URI -> [(subject URI, propName)] waiting for that object
+		self.namespaces = {}
+		self.knownTypes = knownTypes()
+		self.knownInstances = knownInstances()
+		if profile != None:
+			profile.instrument(self, {"add" : "triples", "blindURI" : "bnodes", "addType" : "construct",\
+									  "setProperty" : "properties", "addGraph" : "graph", "addPartials" : "partials",\
+									  "close" : "close"})
+
+	def addGraph(self, g):
+		for NSName, NSURI in g.namespaces():
+			self.bind(NSName, NSURI)
+		for triple in g.triples((None,None,None)):
+			self.add(triple)
+
+	def bind(self, prefix, namespace, override=True):
+		if override or not self.namespaces.has_key(prefix):
+			self.namespaces[prefix] = str(namespace)
+
+	def add(self, triple):
+		s, p, o = triple
+		if self.profile != None:
+			self.profile.count("triples")
+		if type(s) == BNode:
+			s = self.blindURI(s)
+		else:
+			s = str(s)
+		if type(o) == BNode:
+			o = URIRef(self.blindURI(o))
+
+		if p == RDF.type:
+			self.addType(s, o)
+		elif self.objs.has_key(s):
+			self.addProperty(s, p, o)
+		else:
+			self.untyped.setdefault(s, []).append((p, o))
+
+	def blindURI(self, node):
+		return getBlindURI(node) # A method of its own, for Profile.instrument
+
+	def addType(self, s, s_type):
+		if self.objs.has_key(s):
+			return # Modelled by the first type we knew a class for
+		# FIXME : Definately want some type inference here
+		if not self.knownTypes.has_key(str(s_type)):
+			self.unknownTypes.setdefault(s, str(s_type))
+			return
+			# FIXME : Maybe use a Resource ?
+
+		self.objs[s] = self.knownTypes[str(s_type)](URI=s)
+		if self.profile != None:
+			self.profile.count("objects")
+		if self.unknownTypes.has_key(s):
+			del self.unknownTypes[s]
+		for (p, o) in self.untyped.pop(s, []):
+			self.addProperty(s, p, o)
+		for (subj, propName) in self.forwardRefs.pop(s, []):
+			self.setProperty(subj, propName, self.objs[s])
+
+	def addProperty(self, s, p, o):
+		subj = self.objs[s]
+		table = propertyTable(type(subj))
+		if not table.has_key(str(p)):
+			if self.strict:
+				raise ImportException("NO PROPERTY TO MODEL "+str(p)+" in class "+str(type(subj))+"\nKnown properties : "+str(table.keys()))
+			else:
+				error("NO PROPERTY TO MODEL "+str(p)+" in class "+str(type(subj)))
+				return
+		propName, validTypes, allowLits, coerce = table[str(p)]
+
+		# find object
+		if type(o) == URIRef:
+			if self.objs.has_key(str(o)):
+				obj = self.objs[str(o)]
+			elif self.knownInstances.has_key(str(o)):
+				obj = self.knownInstances[str(o)]
+			else:
+				# Not typed (yet ?), see close()
+				self.forwardRefs.setdefault(str(o), []).append((s, propName))
+				return
+		elif type(o) == Literal:
+			obj = coerce(o)
+		else:
+			if self.strict:
+				raise ImportException("Found object "+str(o)+" of "+str(s)+" whose type isn't URIRef or Literal ! What to do ?")
+			else:
+				error("Found object "+str(o)+" of "+str(s)+" whose type isn't URIRef or Literal ! What to do ?")
+				return
+		self.setProperty(s, propName, obj)
+
+	def setProperty(self, s, propName, obj):
+		subj = self.objs[s]
 		try:
-			s_type = g.objects(s, RDF.type).next()
-		except StopIteration, e:
-			if strict:
-				raise ImportException("NO TYPE SPECIFIED for "+ str(s)+" !")
+			if self.validate:
+				getattr(subj, propName).add(obj)
 			else:
-				error("NO TYPE SPECIFIED for "+ str(s)+" ! Ignoring...")
-				continue
-		# FIXME : Definately want some type inference here
-	
-		if str(s_type) not in knownTypes.keys():
-			if strict:
-				raise ImportException("NO CLASS TO MODEL TYPE : "+str(s_type)+" OF URI "+str(s)+" !")
+				getattr(subj, propName).add_many((obj,), validate=False)
+		except TypeError, e:
+			if self.profile != None:
+				self.profile.count("type errors")
+			if self.strict:
+				raise ImportException("Exception when adding "+str(obj)+" type "+str(type(obj))\
+				+" to "+str(s)+" type "+str(type(subj))\
+				+" for property "+propName+" : \n" + str(e))
 			else:
-				error("NO CLASS TO MODEL TYPE : "+str(s_type)+" OF URI "+str(s)+" ! Ignoring...")
-				continue
-			# FIXME : Maybe use a Resource ?
+				warning("Exception when adding %s type %s to %s type %s for property %s...\n%s\nIgnoring...\n",\
+						obj, type(obj), s, type(subj), propName, e)
+
+	def partial(self):
+		"""
+		The state of an importer which has only seen part of the input, as plain
+		data which can be sent back from a worker process : (objects, untyped
+		subjects, unknown types, forward references, namespaces).
 		
-		objs[str(s)] = knownTypes[str(s_type)](URI=str(s))
-	
-	#
-	# Set object properties to model RDF properties
-	#
-	for s in objs.keys():
-		for (p, o) in g.predicate_objects(URIRef(s)):
-			if p == RDF.type:
-				continue # This is modelled above.
-			s_propnames = objs[s]._props.keys()
-			s_propURIs = [objs[s]._props[s_propname].propertyURI for s_propname in s_propnames]
-			s_propdict = dict(zip(s_propURIs, s_propnames))
-			
-			#print "Trying to find "+str(p)+" amongst : "+str(s_propURIs)
-			
-			if str(p) in s_propURIs:
-				# find object
-				if type(o) == URIRef:
-					if str(o) in objs.keys():
-						obj = objs[str(o)]
-					elif str(o) in knownInstances.keys():
-						obj = knownInstances[str(o)]
+		Objects are given as (URI, classURI, [(propName, values)]), with values
+		which are objects replaced by ("uri", URI).
+		"""
+		objs = []
+		for URI, obj in self.objs.iteritems():
+			props = []
+			for propName, propSet in obj._props.iteritems():
+				values = []
+				for v in propSet:
+					if isinstance(v, propSet.Lits):
+						values.append(v)
 					else:
-						warning("Unknown URI "+str(o)+" as object of "+str(s)+", using a Resource to model.")
-						obj = Resource(str(o))
-						objs[str(o)] = obj
-				elif type(o) == Literal:
-					# FIXME : this needs some more careful thought.
-					typeMapping = {"http://www.w3.org/2001/XMLSchema#integer" : int,\
-								   "http://www.w3.org/2001/XMLSchema#int" : int,\
-								   "http://www.w3.org/2001/XMLSchema#decimal" : float,\
-								   "http://www.w3.org/2001/XMLSchema#float" : float,\
-								   "http://www.w3.org/2001/XMLSchema#nonNegativeInteger" : int,\
-								   "http://www.w3.org/2001/XMLSchema#duration": str,\
-								   "http://www.w3.org/2001/XMLSchema#date" : str,\
-								   "http://www.w3.org/2001/XMLSchema#dateTime" : str,\
-							   	   "http://www.w3.org/2001/XMLSchema#gYear" : int,\
-								   "http://www.w3.org/2001/XMLSchema#gYearMonth" : str,\
-								   "http://www.w3.org/2001/XMLSchema#gMonth" : int,\
-								   "http://www.w3.org/2001/XMLSchema#gDay" : int}
-					if (str(o.datatype) in typeMapping.keys()):
-						obj = typeMapping[str(o.datatype)](o)
-					else:
-						obj = str(o)
-					
+						values.append(("uri", v.URI))
+				props.append((propName, values))
+			objs.append((URI, obj.classURI, props))
+		untyped = dict([(s, []) for s in self.untyped.keys()])
+		return (objs, untyped, self.unknownTypes, self.forwardRefs, self.namespaces)
+
+	def addPartials(self, partials):
+		"""Merge the partial() states of importers which were given disjoint sets of subjects."""
+		for objs, untyped, unknownTypes, forwardRefs, namespaces in partials:
+			for URI, classURI, props in objs:
+				self.objs[URI] = self.knownTypes[classURI](URI=URI)
+		for objs, untyped, unknownTypes, forwardRefs, namespaces in partials:
+			for URI, classURI, props in objs:
+				subj = self.objs[URI]
+				for propName, values in props:
+					# Already checked by the worker
+					getattr(subj, propName).add_many([self.partialValue(v) for v in values], validate=False)
+			self.untyped.update(untyped)
+			self.unknownTypes.update(unknownTypes)
+			for prefix, namespace in namespaces.iteritems():
+				self.bind(prefix, namespace)
+			for o, refs in forwardRefs.iteritems():
+				if self.objs.has_key(o):
+					for (s, propName) in refs:
+						self.setProperty(s, propName, self.objs[o])
 				else:
-					if strict:
-						raise ImportException("Found object "+str(o)+" of "+str(s)+" whose type isn't URIRef or Literal ! What to do ?")
-					else:
-						error("Found object "+str(o)+" of "+str(s)+" whose type isn't URIRef or Literal ! What to do ?")
-						continue
-						
-				# set object for property :
-				try:
-					getattr(objs[s], s_propdict[str(p)]).add(obj)
-				except TypeError, e:
-					if strict:
-						raise ImportException("Exception when adding "+str(o)+" type "+str(type(obj))\
-						+" to "+str(s)+" type "+str(type(objs[s]))\
-						+" for property "+str(s_propdict[str(p)])+" : \n" + str(e))
-					else:
-						warning("Exception when adding "+str(o)+" type "+str(type(obj))\
-						+" to "+str(s)+" type "+str(type(objs[s]))\
-						+" for property "+str(s_propdict[str(p)])+"...\n" + str(e) +"\nIgnoring...\n")
-						continue
-					
+					self.forwardRefs.setdefault(o, []).extend(refs)
+
+	def partialValue(self, v):
+		if type(v) == tuple:
+			if self.objs.has_key(v[1]):
+				return self.objs[v[1]]
+			return self.knownInstances[v[1]]
+		return v
+
+	def close(self):
+		mi = MusicInfo(self.resolve(), profile=self.profile)
+		# Add any namespaces mentioned in the file which we didn't already know :
+		mi.namespaceBindings.update(self.namespaces)
+		return mi
+
+	def resolve(self, known=None):
+		"""
+		Check that every subject was given a type, and point references to URIs
+		which weren't described at the objects the dict known has for them, or
+		else at new Resources. Returns the objects imported.
+		"""
+		for s in self.untyped.keys():
+			if self.unknownTypes.has_key(s):
+				msg = "NO CLASS TO MODEL TYPE : "+self.unknownTypes[s]+" OF URI "+s+" !"
+			else:
+				msg = "NO TYPE SPECIFIED for "+s+" !"
+			if self.strict:
+				raise ImportException(msg)
 			else:
-				if strict:
-					raise ImportException("NO PROPERTY TO MODEL "+str(p)+" in class "+str(type(objs[s]))+"\nKnown properties : "+str(s_propURIs))
+				error(msg+" Ignoring...")
+		for s in self.unknownTypes.keys():
+			if not self.untyped.has_key(s):
+				if self.strict:
+					raise ImportException("NO CLASS TO MODEL TYPE : "+self.unknownTypes[s]+" OF URI "+s+" !")
 				else:
-					error("NO PROPERTY TO MODEL "+str(p)+" in class "+str(type(objs[s])))
-					continue
-	
-	mi = MusicInfo(objs.values())
-	# Add any namespaces mentioned in the file which we didn't already know :
-	mi.namespaceBindings.update(dict([(NSName, str(NSURI)) for NSName, NSURI in g.namespaces()]))
-	return mi
+					error("NO CLASS TO MODEL TYPE : "+self.unknownTypes[s]+" OF URI "+s+" ! Ignoring...")
+		self.untyped = {}
+		
+		for o, refs in self.forwardRefs.items():
+			obj = None
+			if known != None:
+				obj = known.get(o)
+			if obj == None:
+				warning("Unknown URI "+o+" as object of "+refs[0][0]+", using a Resource to model.")
+				obj = model.rdfs___Resource(o)
+				self.objs[o] = obj
+			for (s, propName) in refs:
+				self.setProperty(s, propName, obj)
+		self.forwardRefs = {}
+		return self.objs.values()
 
  
 # Python 2.4.4 (#1, Oct 18 2006, 10:34:39) 
@@ -186,18 +508,20 @@ def importRDFGraph(g, strict=True):
 # PropertySet(['Davy Crockett'])
 
 
-def exportRDFGraph(mi):
+def exportRDFGraph(mi, profile=None):
+	"""An rdflib graph of the objects of mi. A Profile given as profile times the
+	stages "bnodes" (finding blind nodes) and "triples" (adding the triples)."""
 	g = ConjunctiveGraph()
 	bnodes = {}
 	for NSName, NSuriStr in mi.namespaceBindings.iteritems():
 		g.namespace_manager.bind(NSName, URIRef(NSuriStr))
 
-	modelAttrs = [model.__dict__[c] for c in model.__dict__.keys()]
-	knownTypes = dict([(c.classURI, c) for c in modelAttrs if hasattr(c, "classURI")])
-	knownInstances = dict([(i.URI, i) for i in modelAttrs if hasattr(i, "URI")])
+	types = knownTypes()
 
 	# Assign blind nodes :
-	for s in mi.MainIdx.values():
+	if profile != None:
+		profile.begin("bnodes")
+	for s in mi.MainIdx.itervalues():
 		if s.URI == None or isBlind(s):
 			snode = BNode()
 			bnodes[s.URI] = snode
@@ -207,10 +531,12 @@ def exportRDFGraph(mi):
 					if not bnodes.has_key(v.URI):
 						vnode = BNode()
 						bnodes[v.URI] = vnode
-					
+	if profile != None:
+		profile.end()
+		profile.begin("triples")
 
-	for s in mi.MainIdx.values():
-		if not hasattr(s, "classURI") or s.classURI not in knownTypes.keys():
+	for s in mi.MainIdx.itervalues():
+		if not hasattr(s, "classURI") or not types.has_key(s.classURI):
 			raise ExportException("Object "+str(s)+" has no classURI, or classURI is not known in the MO model.")
 			# FIXME : Maybe use a Resource ?
 		
@@ -221,32 +547,267 @@ def exportRDFGraph(mi):
 
 		g.add((snode, RDF.type, URIRef(s.classURI)))
 
+		predicates = predicateRefs(type(s))
 		for propName, propSet in s._props.iteritems():
+			if len(propSet) == 0:
+				continue
+			if not predicates.has_key(propName):
+				raise ExportException("Property "+str(propName)+" on object "+str(s)+" has no propertyURI !")
+			pnode = predicates[propName]
 			for v in propSet:
-				if not hasattr(propSet, "propertyURI"):
-					raise ExportException("Property "+str(propName)+" on object "+str(s)+" has no propertyURI !")
-				
 				if type(v) not in propSet.Lits:
 					if not hasattr(v, "URI"):
 						raise ExportException("Property value "+str(v)+" is not a Literal, but has no URI !")
 					if isBlind(v):
-						g.add((snode, URIRef(propSet.propertyURI), bnodes[v.URI]))
+						g.add((snode, pnode, bnodes[v.URI]))
 					else:
-						g.add((snode, URIRef(propSet.propertyURI), URIRef(v.URI)))
+						g.add((snode, pnode, URIRef(v.URI)))
+				elif XSD.lexicalForm(v) != None:
+					lexical, datatype = XSD.lexicalForm(v)
+					g.add((snode, pnode, Literal(lexical, datatype=URIRef(datatype))))
 				else:
-					g.add((snode, URIRef(propSet.propertyURI), Literal(v)))
+					g.add((snode, pnode, Literal(v)))
 		
-		info("Added "+str(type(s))+" @ "+str(snode))
+		info("Added %s @ %s", type(s), snode)
 		
+	if profile != None:
+		profile.end()
+		profile.count("objects", len(mi.MainIdx))
+		profile.count("triples", len(g))
 	return g
 
-def exportRDFFile(mi, filename, format="xml"):
+#
+# Streaming export, writing triples straight to a file without an rdflib graph
+#
+
+streamExportFormats = ("nt", "nq", "turtle")
+
+literalDatatypes = {int : XSD.NS+"integer", long : XSD.NS+"long", float : XSD.NS+"float", bool : XSD.NS+"boolean"}
+
+_ntEscapes = {u"\\" : u"\\\\", u"\"" : u"\\\"", u"\n" : u"\\n", u"\r" : u"\\r", u"\t" : u"\\t"}
+_ntSafe = re.compile(r'^[ !#-\[\]-~]*$') # Printable ASCII, except " and \
+_qnameLocal = re.compile(r'^[A-Za-z_][A-Za-z0-9_\-]*$')
+_turtlePrefix = re.compile(r'^([A-Za-z][A-Za-z0-9_\-]*)?$')
+
+def ntEscape(s):
+	"""Escape a string for use in N-Triples (and Turtle), leaving only printable ASCII."""
+	if isinstance(s, str):
+		if _ntSafe.match(s):
+			return s
+		s = s.decode("utf-8", "replace")
+	elif _ntSafe.match(s):
+		return str(s)
+	chars = []
+	for c in s:
+		if _ntEscapes.has_key(c):
+			chars.append(_ntEscapes[c])
+		elif ord(c) < 0x20 or ord(c) > 0x7e:
+			chars.append(u"\\u%04X" % ord(c))
+		else:
+			chars.append(c)
+	return str(u"".join(chars))
+
+_labelEscape = re.compile(r'[^A-Za-wyz0-9]')
+
+def bnodeLabel(uri):
+	"""Stable blank node label for a blind: URI. N-Triples labels can only have
+	letters and digits, so other characters, and x, are written as x and their
+	two hex digits, keeping different URIs apart."""
+	rest = uri[len("blind:"):]
+	if type(rest) == unicode:
+		rest = rest.encode("utf-8")
+	return "_:b"+_labelEscape.sub(lambda m: "x%02x" % ord(m.group()), rest)
+
+termCacheSize = 100000 # Terms a TermWriter remembers
+
+class TermWriter(object):
+	"""Formats URIs, blind nodes and literals as N-Triples terms, or Turtle ones if given prefixes."""
+	def __init__(self, prefixes=None):
+		self.prefixes = prefixes # Namespace URI -> prefix, for Turtle
+		self.terms = {} # URI -> term, as most URIs are written many times
+
+	def uri(self, uri):
+		term = self.terms.get(uri)
+		if term == None:
+			if len(self.terms) >= termCacheSize:
+				self.terms.clear()
+			term = self.terms[uri] = self.term(uri)
+		return term
+
+	def term(self, uri):
+		if self.prefixes:
+			split = max(uri.rfind("#"), uri.rfind("/")) + 1
+			if self.prefixes.has_key(uri[:split]) and _qnameLocal.match(uri[split:]):
+				return self.prefixes[uri[:split]]+":"+uri[split:]
+		return "<"+ntEscape(uri)+">"
+
+	def node(self, obj):
+		if getattr(obj, "URI", None) == None:
+			raise ExportException("Property value "+str(obj)+" is not a Literal, but has no URI !")
+		if isBlind(obj):
+			return bnodeLabel(obj.URI)
+		return self.uri(obj.URI)
+
+	def literal(self, v):
+		if XSD.lexicalForm(v) != None:
+			lexical, datatype = XSD.lexicalForm(v)
+			return "\""+ntEscape(lexical)+"\"^^"+self.uri(datatype)
+		if literalDatatypes.has_key(type(v)):
+			return "\""+ntEscape(unicode(v))+"\"^^"+self.uri(literalDatatypes[type(v)])
+		return "\""+ntEscape(v)+"\""
+
+def exportRDFStream(mi, out, format="nt", context=None, chunkSize=1000, profile=None):
+	"""
+	Write the triples of mi to the file object out, in subject order, without
+	building an rdflib graph. format is one of streamExportFormats. For "nq",
+	context is the URI of the graph to put the triples in.
+
+	A Profile given as profile times the stages "triples" (formatting them) and
+	"write" (writing them to out), and counts "objects" and "triples".
+	"""
+	if format not in streamExportFormats:
+		raise ExportException("Can't stream format "+format+", try one of "+str(streamExportFormats))
+	write = out.write
+	if profile != None:
+		write = profile.timed("write", write)
+		profile.begin("triples")
+	types = knownTypes()
+	prefixes = None
+	if format == "turtle":
+		prefixes = {}
+		for NSName, NSuriStr in sorted(mi.namespaceBindings.items()):
+			if NSName != None and _turtlePrefix.match(NSName):
+				prefixes.setdefault(NSuriStr, NSName)
+	terms = TermWriter(prefixes)
+	if format == "turtle":
+		rdfType = "a"
+	else:
+		rdfType = terms.uri(str(RDF.type))
+	if format == "nq" and context != None:
+		end = " "+terms.uri(context)+" .\n"
+	else:
+		end = " .\n"
+	predicates = {} # (class, propName) -> predicate term
+	
+	lines = []
+	if prefixes:
+		for NSuriStr, NSName in sorted(prefixes.items(), key=lambda x: x[1]):
+			lines.append("@prefix "+NSName+": <"+ntEscape(NSuriStr)+"> .\n")
+		lines.append("\n")
+	
+	triples = 0
+	uris = mi.MainIdx.keys()
+	uris.sort()
+	for uri in uris:
+		s = mi.MainIdx[uri]
+		if not hasattr(s, "classURI") or not types.has_key(s.classURI):
+			raise ExportException("Object "+str(s)+" has no classURI, or classURI is not known in the MO model.")
+		snode = terms.node(s)
+		
+		statements = [(rdfType, [terms.uri(s.classURI)])]
+		propNames = s._props.keys()
+		propNames.sort()
+		for propName in propNames:
+			propSet = s._props[propName]
+			if len(propSet) == 0:
+				continue
+			if not predicates.has_key((type(s), propName)):
+				refs = predicateRefs(type(s))
+				if not refs.has_key(propName):
+					raise ExportException("Property "+str(propName)+" on object "+str(s)+" has no propertyURI !")
+				predicates[(type(s), propName)] = terms.uri(str(refs[propName]))
+			values = []
+			for v in propSet:
+				if type(v) in propSet.Lits:
+					values.append(terms.literal(v))
+				else:
+					values.append(terms.node(v))
+			values.sort()
+			statements.append((predicates[(type(s), propName)], values))
+			triples += len(values)
+		
+		if format == "turtle":
+			lines.append(snode+" "+" ;\n\t".join([p+" "+", ".join(vs) for p, vs in statements])+" .\n\n")
+		else:
+			for p, vs in statements:
+				for v in vs:
+					lines.append(snode+" "+p+" "+v+end)
+		if len(lines) >= chunkSize:
+			write("".join(lines))
+			lines = []
+	write("".join(lines))
+	if profile != None:
+		profile.end()
+		profile.count("objects", len(uris))
+		profile.count("triples", triples + len(uris)) # and an rdf:type for each
+
+deltaFormats = ("nt", "sparql")
+
+def exportRDFDelta(mi, since, out, format="sparql", removedOut=None):
+	"""
+	Write the triples added to and removed from mi since a checkpoint (see
+	MusicInfo.checkpoint) to the file object out. For "sparql", out gets a
+	SPARQL Update request. For "nt", out gets the added triples and removedOut
+	the removed ones.
+	
+	SPARQL doesn't allow blank nodes in DELETE DATA, so removed triples about a
+	blind node are written as a DELETE WHERE with a variable in its place.
+	"""
+	if format not in deltaFormats:
+		raise ExportException("Can't write a delta as "+format+", try one of "+str(deltaFormats))
+	if format == "nt" and removedOut == None:
+		raise ExportException("Need a file for the removed triples of a N-Triples delta.")
+	added, removed = mi.changesSince(since)
+	terms = TermWriter()
+	def node(uri, variables):
+		if uri.startswith("blind:"):
+			if variables:
+				return "?"+bnodeLabel(uri)[2:]
+			return bnodeLabel(uri)
+		return terms.uri(uri)
+	def line(s, p, v, variables=False):
+		if type(v) == tuple:
+			o = node(v[1], variables)
+		else:
+			o = terms.literal(v)
+		return node(s, variables)+" "+terms.uri(p)+" "+o+" .\n"
+
+	if format == "nt":
+		out.write("".join([line(s, p, v) for s, p, v in added]))
+		removedOut.write("".join([line(s, p, v) for s, p, v in removed]))
+		return
+
+	blind = {} # blind URI -> removed triples mentioning it
+	plain = []
+	for s, p, v in removed:
+		if s.startswith("blind:"):
+			blind.setdefault(s, []).append((s, p, v))
+		elif type(v) == tuple and v[1].startswith("blind:"):
+			blind.setdefault(v[1], []).append((s, p, v))
+		else:
+			plain.append((s, p, v))
+	requests = []
+	if plain:
+		requests.append("DELETE DATA {\n"+"".join(["\t"+line(s, p, v) for s, p, v in plain])+"}")
+	for uri in sorted(blind.keys()):
+		requests.append("DELETE WHERE {\n"+"".join(["\t"+line(s, p, v, True) for s, p, v in blind[uri]])+"}")
+	if added:
+		requests.append("INSERT DATA {\n"+"".join(["\t"+line(s, p, v) for s, p, v in added])+"}")
+	out.write(" ;\n".join(requests)+"\n")
+
+def exportRDFFile(mi, filename, format="xml", profile=None):
+	if format in streamExportFormats:
+		info("Writing to file...")
+		out = open(filename,'w')
+		exportRDFStream(mi, out, format, profile=profile)
+		out.close()
+		return
 	info("Constructing graph...")
-	g = exportRDFGraph(mi)
+	g = exportRDFGraph(mi, profile)
 	info("Writing to file...")
+	serialize = g.serialize
+	if profile != None:
+		serialize = profile.timed("serialize", serialize)
 	out = open(filename,'w')
-	out.write(g.serialize(format=format))
+	out.write(serialize(format=format))
 	out.close()
-
-		
-		
\ No newline at end of file
@@ -0,0 +1,442 @@
+"""
+SQLiteStore.py
+
+A MusicInfo whose objects live in an SQLite database rather than in memory, for
+stores which don't fit in RAM.
+
+MainIdx and the <shortname>Idx attributes are views of the database : looking
+up a URI builds the object, whose properties are read when first used (as for
+snapshots), and keeps it in a cache of the cacheSize most recently used
+objects. Objects which are added or changed are written back when they leave
+the cache, when flush() or close() is called, and before queries which read
+the database. add() merges objects and blind nodes as an in-memory MusicInfo
+does, and exportRDFGraph, exportRDFStream and find() work on top of it.
+
+Objects which have left the cache are still followed : changing one puts it
+back in the cache, to be written back. Looking up its URI again in the meantime
+gives a new object, read from the database, and whichever of the two is changed
+last is the one saved, so look objects up again rather than holding on to them
+across many other lookups. referrersOf() loads the referring objects one at a
+time, as they are iterated. addIndex() and indexTimeLines(), whose indexes hold
+objects, aren't available.
+
+URIs are only stored once, in the uris table, split by a URITable into a
+namespace and a local name, and the other tables refer to them by id : objects,
+property values which are objects, classes and datatypes.
+
+Tables :
+	uris           id, namespace id and local name of each URI
+	uriNamespaces  id and URI of the namespaces of the uris table
+	objects        URI id, class URI id and shortname of each object
+	edges          subject URI id, property name, kind, value and datatype URI
+	               id (or class URI id of an object value) of each property value,
+	               object values being given by URI id
+	blinds         URI id, class URI id and signature digest of each blind node
+	namespaces     prefix and namespace of the namespace bindings
+"""
+
+import sqlite3
+import hashlib
+from collections import OrderedDict
+from UserDict import DictMixin
+from mopy import model, XSD
+from mopy.MusicInfo import MusicInfo, MusicInfoException, isBlind
+from mopy.RDFInterface import knownTypes, knownInstances
+from mopy.Snapshot import LazyProps
+from mopy.URITable import URITable
+
+# Kinds of edge values :
+OBJECT, STR, UNICODE, INT, FLOAT, LONG, TYPED = range(7)
+
+SCHEMA_VERSION = 3
+
+schema = """
+PRAGMA user_version = 3;
+CREATE TABLE IF NOT EXISTS uris (id INTEGER PRIMARY KEY, ns INTEGER NOT NULL, local TEXT NOT NULL, UNIQUE (ns, local));
+CREATE TABLE IF NOT EXISTS uriNamespaces (id INTEGER PRIMARY KEY, uri TEXT);
+CREATE TABLE IF NOT EXISTS objects (id INTEGER PRIMARY KEY, class INTEGER, shortname TEXT);
+CREATE INDEX IF NOT EXISTS objects_shortname ON objects (shortname);
+CREATE TABLE IF NOT EXISTS edges (subject INTEGER NOT NULL, property TEXT, kind INTEGER, value, extra INTEGER);
+CREATE INDEX IF NOT EXISTS edges_subject ON edges (subject);
+CREATE INDEX IF NOT EXISTS edges_value ON edges (kind, value);
+CREATE TABLE IF NOT EXISTS blinds (id INTEGER PRIMARY KEY, class INTEGER, sig TEXT);
+CREATE INDEX IF NOT EXISTS blinds_sig ON blinds (class, sig);
+CREATE TABLE IF NOT EXISTS namespaces (prefix TEXT PRIMARY KEY, uri TEXT);
+"""
+
+def digest(sig):
+	"""A digest of a blind node signature (see MusicInfo.signature) which is the
+	same from one run to the next, unlike its hash."""
+	return hashlib.sha1(canonicalRepr(sig)).hexdigest()
+
+def canonicalRepr(v):
+	"""repr(v), with the members of frozensets in sorted order, and values which
+	compare equal (1 and 1.0, "a" and u"a") given the same representation."""
+	if isinstance(v, frozenset):
+		return "{" + ", ".join(sorted([canonicalRepr(m) for m in v])) + "}"
+	elif isinstance(v, tuple):
+		return "(" + ", ".join([canonicalRepr(m) for m in v]) + ")"
+	elif type(v) == unicode:
+		try:
+			return repr(v.encode("ascii"))
+		except UnicodeEncodeError:
+			pass
+	elif isinstance(v, (int, long, float)):
+		try:
+			if v == int(v):
+				return str(int(v))
+		except (ValueError, OverflowError):
+			pass # nan or infinity
+	return repr(v)
+
+class SQLiteMusicInfo(MusicInfo):
+	def __init__(self, filename, objects=None, namespaceBindings=model.namespaceBindings, cacheSize=10000, profile=None):
+		self.db = sqlite3.connect(filename)
+		self.db.text_factory = str
+		version = self.db.execute("PRAGMA user_version").fetchone()[0]
+		if version != SCHEMA_VERSION and self.db.execute("SELECT 1 FROM sqlite_master WHERE name = 'objects'").fetchone() != None:
+			raise MusicInfoException(filename+" was written by another version of SQLiteMusicInfo, import its data again")
+		self.db.executescript(schema)
+		self.cacheSize = cacheSize
+		self.cache = OrderedDict() # URI -> live object, least recently used first
+		self.dirty = {} # URI -> object to write back, all of them in the cache
+		self.uriIds = {} # URI -> id in the uris table, for recently used URIs
+		self.terms = {} # id -> URI of classes and datatypes
+		MusicInfo.__init__(self, None, dict(namespaceBindings), profile)
+		for prefix, uri in self.db.execute("SELECT prefix, uri FROM namespaces"):
+			self.namespaceBindings[prefix] = uri
+		self.uris = URITable([uri for (uri,) in self.db.execute("SELECT uri FROM uriNamespaces ORDER BY id")])
+		self.savedNamespaces = len(self.uris.namespaces)
+		self.MainIdx = StoreIdx(self)
+		self.add_many(objects or ())
+
+	def __getattr__(self, name):
+		# <shortname>Idx attributes
+		if name.endswith("Idx") and not name.startswith("_") and self.__dict__.has_key("db"):
+			idx = StoreIdx(self, name[:-3])
+			setattr(self, name, idx)
+			return idx
+		raise AttributeError("'SQLiteMusicInfo' object has no attribute '"+name+"'")
+
+	def sameBlind(self, obj, found):
+		oldURI = obj.URI
+		MusicInfo.sameBlind(self, obj, found)
+		if oldURI != None:
+			# References to obj which were already written follow it
+			oldId = self.uriId(oldURI)
+			if oldId != None:
+				self.db.execute("UPDATE edges SET value = ? WHERE kind = ? AND value = ?", (self.uriId(found.URI, True), OBJECT, oldId))
+
+	#
+	# URIs :
+	#
+	def uriId(self, uri, create=False):
+		"""The id of uri in the uris table, adding it if create is True, or else None if it isn't there."""
+		uriId = self.uriIds.get(uri)
+		if uriId != None:
+			return uriId
+		nsId, local = self.uris.split(uri)
+		row = self.db.execute("SELECT id FROM uris WHERE ns = ? AND local = ?", (nsId, local)).fetchone()
+		if row != None:
+			uriId = row[0]
+		elif create:
+			uriId = self.db.execute("INSERT INTO uris (ns, local) VALUES (?, ?)", (nsId, local)).lastrowid
+		else:
+			return None
+		if len(self.uriIds) >= 16*self.cacheSize:
+			self.uriIds.clear()
+		self.uriIds[uri] = uriId
+		return uriId
+
+	def term(self, uriId):
+		"""The URI of a class or datatype, by id."""
+		uri = self.terms.get(uriId)
+		if uri == None:
+			uri = self.terms[uriId] = self.uris.join(*self.db.execute("SELECT ns, local FROM uris WHERE id = ?", (uriId,)).fetchone())
+		return uri
+
+	def termId(self, uri):
+		uriId = self.uriId(uri, True)
+		self.terms[uriId] = uri
+		return uriId
+
+	#
+	# Objects :
+	#
+	def load(self, uri, shortname=None):
+		"""The object with this URI, from the cache or the database, or None."""
+		obj = self.cache.get(uri)
+		if obj != None:
+			del self.cache[uri]
+			self.cache[uri] = obj
+		else:
+			uriId = self.uriId(uri)
+			if uriId == None:
+				return None
+			row = self.db.execute("SELECT class FROM objects WHERE id = ?", (uriId,)).fetchone()
+			if row == None:
+				return None
+			obj = knownTypes()[self.term(row[0])](uri)
+			obj._props = LazyProps(self, uri, obj)
+			self.keep(uri, obj)
+		if shortname != None and obj.shortname != shortname:
+			return None
+		return obj
+
+	def fill(self, uri, obj):
+		"""Read the properties of obj from the database. See LazyProps."""
+		obj._props = {}
+		values = {}
+		rows = self.db.execute("SELECT edges.property, edges.kind, edges.value, edges.extra, uris.ns, uris.local"\
+							   " FROM edges LEFT JOIN uris ON edges.kind = ? AND uris.id = edges.value"\
+							   " WHERE edges.subject = ?", (OBJECT, self.uriId(uri))).fetchall()
+		for propName, kind, value, extra, nsId, local in rows:
+			if kind == OBJECT:
+				value = self.uris.join(nsId, local)
+			values.setdefault(propName, []).append(self.value(kind, value, extra))
+		for propName, vs in values.iteritems():
+			getattr(obj, propName).add_many(vs, validate=False)
+		if self not in obj._watchers:
+			obj._watchers = obj._watchers + (self,)
+		return obj._props
+
+	def value(self, kind, value, extra):
+		if kind == OBJECT:
+			if knownInstances().has_key(value):
+				return knownInstances()[value]
+			obj = self.load(value)
+			if obj == None:
+				obj = knownTypes()[self.term(extra)](value) # Not (yet) in the store
+			return obj
+		elif kind == STR:
+			return intern(value)
+		elif kind == UNICODE:
+			return value.decode("utf-8")
+		elif kind == LONG:
+			return long(value)
+		elif kind == TYPED:
+			return XSD.parseLiteral(self.term(extra), value)
+		return value
+
+	def keep(self, uri, obj):
+		"""Put obj in the cache, writing back and forgetting the least recently used
+		object if it is full. Forgotten objects stay watched, see propertyChanged."""
+		self.cache[uri] = obj
+		while len(self.cache) > self.cacheSize:
+			oldURI, old = self.cache.popitem(False)
+			if self.dirty.has_key(oldURI):
+				self.write(self.dirty.pop(oldURI))
+
+	def put(self, uri, obj):
+		if self.cache.get(uri) is not obj:
+			self.cache.pop(uri, None)
+			self.keep(uri, obj)
+		self.dirty[uri] = obj
+
+	def delete(self, uri):
+		self.writeBack()
+		obj = self.cache.pop(uri, None)
+		if obj != None:
+			obj._watchers = tuple([w for w in obj._watchers if w is not self])
+		uriId = self.uriId(uri)
+		self.db.execute("DELETE FROM edges WHERE subject = ?", (uriId,))
+		self.db.execute("DELETE FROM objects WHERE id = ?", (uriId,))
+		self.db.execute("DELETE FROM blinds WHERE id = ?", (uriId,))
+
+	def write(self, obj):
+		"""Write obj's row, property values and blind node signature to the database."""
+		subject = self.uriId(obj.URI, True)
+		classId = self.termId(obj.classURI)
+		if self.db.execute("SELECT 1 FROM objects WHERE id = ?", (subject,)).fetchone() == None:
+			self.db.execute("INSERT INTO objects (id, class, shortname) VALUES (?, ?, ?)", (subject, classId, obj.shortname))
+		else:
+			self.db.execute("UPDATE objects SET class = ?, shortname = ? WHERE id = ?", (classId, obj.shortname, subject))
+			self.db.execute("DELETE FROM edges WHERE subject = ?", (subject,))
+		edges = []
+		for propName, propSet in obj._props.iteritems():
+			for v in propSet:
+				edges.append((subject, propName) + self.edge(v, obj))
+		self.db.executemany("INSERT INTO edges VALUES (?, ?, ?, ?, ?)", edges)
+		if isBlind(obj):
+			sig = digest(self.signature(obj))
+			row = self.db.execute("SELECT sig FROM blinds WHERE id = ?", (subject,)).fetchone()
+			if row == None or row[0] != sig:
+				self.db.execute("INSERT OR REPLACE INTO blinds VALUES (?, ?, ?)", (subject, classId, sig))
+				if row != None:
+					# The signatures of the blind nodes referring to obj include its own
+					for holderURI, propName in self.referrerURIs(obj.URI):
+						holder = self.load(holderURI)
+						if isBlind(holder):
+							self.dirty[holderURI] = holder
+
+	def edge(self, v, obj):
+		"""(kind, value, extra) of a property value in the edges table."""
+		if type(v) == str:
+			return (STR, v, None)
+		elif type(v) == unicode:
+			return (UNICODE, v.encode("utf-8"), None)
+		elif XSD.lexicalForm(v) != None:
+			lexical, datatype = XSD.lexicalForm(v)
+			return (TYPED, lexical, self.termId(datatype))
+		elif type(v) == float:
+			return (FLOAT, v, None)
+		elif isinstance(v, (int, long)):
+			if -2**63 <= v < 2**63:
+				return (INT, v, None)
+			return (LONG, str(v), None)
+		elif getattr(v, "URI", None) != None and hasattr(v, "classURI"):
+			return (OBJECT, self.uriId(v.URI, True), self.termId(v.classURI))
+		raise MusicInfoException("Can't store value "+str(v)+" of "+str(obj.URI))
+
+	def writeBack(self):
+		"""Write the objects which were added or changed to the database, before reading it."""
+		while self.dirty:
+			uri, obj = self.dirty.popitem()
+			self.write(obj)
+
+	def flush(self):
+		"""Write back the objects which were added or changed, and commit."""
+		self.writeBack()
+		self.db.executemany("INSERT INTO uriNamespaces VALUES (?, ?)",\
+							[(nsId, self.uris.namespaces[nsId]) for nsId in range(self.savedNamespaces, len(self.uris.namespaces))])
+		self.savedNamespaces = len(self.uris.namespaces)
+		self.db.commit()
+
+	def close(self):
+		self.flush()
+		self.db.executemany("INSERT OR REPLACE INTO namespaces VALUES (?, ?)",\
+							[(prefix, uri) for prefix, uri in self.namespaceBindings.iteritems() if prefix != None])
+		self.db.commit()
+		self.db.close()
+
+	#
+	# What MusicInfo keeps in memory, read from the database instead :
+	#
+	def propertyChanged(self, holder, propSet, v, added):
+		# An object which has left the cache is put back, in place of any copy read since
+		self.put(holder.URI, holder)
+		MusicInfo.propertyChanged(self, holder, propSet, v, added)
+
+	def addReferrer(self, uri, holder, propName):
+		pass # See referrersOf
+
+	def discardReferrer(self, uri, holder, propName):
+		pass
+
+	def referrerURIs(self, uri):
+		uriId = self.uriId(uri)
+		if uriId == None:
+			return []
+		return [(self.uris.join(nsId, local), propName) for nsId, local, propName in\
+				self.db.execute("SELECT uris.ns, uris.local, edges.property FROM edges JOIN uris ON uris.id = edges.subject"\
+								" WHERE edges.kind = ? AND edges.value = ?", (OBJECT, uriId))]
+
+	def referrersOf(self, uri):
+		self.writeBack()
+		return Referrers(self, self.referrerURIs(uri))
+
+	def findExistingBlindObj(self, o, sig=None):
+		if not hasattr(o, "shortname"):
+			raise MusicInfoException("No shortname property for object " + str(o) + ", did it come from the MO model ?")
+		if sig == None:
+			sig = self.signature(o)
+		self.writeBack()
+		for nsId, local in self.db.execute("SELECT uris.ns, uris.local FROM blinds JOIN uris ON uris.id = blinds.id"\
+										   " WHERE blinds.class = ? AND blinds.sig = ?", (self.termId(o.classURI), digest(sig))).fetchall():
+			obj = self.load(self.uris.join(nsId, local))
+			if type(obj) == type(o) and self.signature(obj) == sig:
+				return obj
+		return None
+
+	def indexBlind(self, obj, sig=None):
+		self.dirty[obj.URI] = obj # Its signature is written with it
+
+	def unindexBlind(self, obj):
+		uriId = self.uriId(obj.URI)
+		if uriId != None:
+			self.db.execute("DELETE FROM blinds WHERE id = ?", (uriId,))
+
+	def addIndex(self, propName, ordered=False):
+		raise MusicInfoException("SQLiteMusicInfo doesn't keep indexes of objects in memory")
+
+	def indexTimeLines(self):
+		raise MusicInfoException("SQLiteMusicInfo doesn't keep indexes of objects in memory")
+
+class Referrers(object):
+	"""
+	The (holder, propName) pairs of SQLiteMusicInfo.referrersOf, as a sequence
+	which loads each holder when it is reached, so that they needn't all fit in
+	the cache at once.
+	"""
+	def __init__(self, store, pairs):
+		self.store = store
+		self.pairs = pairs # (holder URI, propName)
+
+	def __len__(self):
+		return len(self.pairs)
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			return [(self.store.load(holderURI), propName) for holderURI, propName in self.pairs[i]]
+		holderURI, propName = self.pairs[i]
+		return self.store.load(holderURI), propName
+
+	def __iter__(self):
+		for holderURI, propName in self.pairs:
+			yield self.store.load(holderURI), propName
+
+class StoreIdx(DictMixin):
+	"""MainIdx, or a <shortname>Idx, of an SQLiteMusicInfo."""
+	def __init__(self, store, shortname=None):
+		self.store = store
+		self.shortname = shortname
+
+	def __getitem__(self, uri):
+		obj = self.store.load(uri, self.shortname)
+		if obj == None:
+			raise KeyError(uri)
+		return obj
+
+	def __setitem__(self, uri, obj):
+		self.store.put(uri, obj)
+
+	def __delitem__(self, uri):
+		if self.shortname == None:
+			if not self.has_key(uri):
+				raise KeyError(uri)
+			self.store.delete(uri)
+		# Objects are in the <shortname>Idx of their class, which changes with the object in MainIdx
+
+	def has_key(self, uri):
+		if self.store.cache.has_key(uri):
+			return self.shortname == None or self.store.cache[uri].shortname == self.shortname
+		uriId = self.store.uriId(uri)
+		if uriId == None:
+			return False
+		if self.shortname == None:
+			row = self.store.db.execute("SELECT 1 FROM objects WHERE id = ?", (uriId,)).fetchone()
+		else:
+			row = self.store.db.execute("SELECT 1 FROM objects WHERE id = ? AND shortname = ?", (uriId, self.shortname)).fetchone()
+		return row != None
+
+	__contains__ = has_key
+
+	def keys(self):
+		self.store.writeBack()
+		join = self.store.uris.join
+		if self.shortname == None:
+			rows = self.store.db.execute("SELECT uris.ns, uris.local FROM objects JOIN uris ON uris.id = objects.id")
+		else:
+			rows = self.store.db.execute("SELECT uris.ns, uris.local FROM objects JOIN uris ON uris.id = objects.id"\
+										 " WHERE objects.shortname = ?", (self.shortname,))
+		return [join(nsId, local) for nsId, local in rows]
+
+	def __iter__(self):
+		return iter(self.keys())
+
+	def iteritems(self):
+		for uri in self.keys():
+			yield uri, self[uri]
+
+	def __len__(self):
+		return len(self.keys())
@@ -0,0 +1,325 @@
+"""
+Snapshot.py
+
+Save a MusicInfo object as a compact binary file, and reopen it without
+parsing any RDF. The file is memory-mapped when reopened, and objects are only
+built when they are looked up in MainIdx or one of the <shortname>Idx dicts.
+Their properties are only read from the file when first used.
+
+Snapshots are meant for read-only workers : the reverse-reference and blind
+node indexes of the MusicInfo only know about objects which have been loaded,
+so call loadAll() on the MusicInfo's snapshot before adding to it.
+
+File layout (all integers little-endian) :
+	header      magic, version, counts and section offsets
+	strings     (nStrings+1) uint64 offsets, then the string data : unicode strings
+	            as UTF-8, str ones as they are. The kind of an edge tells which
+	            type its value is read back as.
+	classes     nClasses x (classURI string, shortname string, first object, object count)
+	objects     nObjects x URI string, then (nObjects+1) uint64 edge offsets
+	edges       nEdges x (property name string, value kind, int64 value). Literals
+	            of mopy.XSD's native types store (datatype string << 32) | lexical string.
+	externals   nExternals x (URI string, classURI string) for values not in MainIdx
+	namespaces  nNamespaces x (prefix string, namespace string)
+"""
+
+import mmap
+import struct
+from mopy.MusicInfo import MusicInfo, isBlind
+from mopy.RDFInterface import knownTypes, knownInstances
+from mopy.XSD import lexicalForm, parseLiteral
+
+MAGIC = "MOPYSNAP"
+VERSION = 1
+HEADER = "<8sIIIIQII8Q"
+EDGE = "IBq"
+
+# Kinds of edge values :
+OBJECT, STR, UNICODE, INT, FLOAT, EXTERNAL, LONG, TYPED = range(8)
+
+class SnapshotException(Exception):
+	def __init__(self, message) :
+		self.message = message
+	def __str__(self) :
+		return self.message
+
+def saveSnapshot(mi, filename):
+	strings = {} # bytes -> string number
+	stringList = []
+	def sid(s):
+		if type(s) == unicode:
+			s = s.encode("utf-8")
+		if not strings.has_key(s):
+			strings[s] = len(stringList)
+			stringList.append(s)
+		return strings[s]
+
+	# Objects grouped by class, so each <shortname>Idx can be rebuilt from a range
+	objs = mi.MainIdx.values()
+	objs.sort(key=lambda o: (o.classURI, o.URI))
+	objIdx = dict([(id(o), i) for i, o in enumerate(objs)])
+	classes = []
+	for i, o in enumerate(objs):
+		if len(classes) == 0 or classes[-1][0] != o.classURI:
+			classes.append([o.classURI, o.shortname, i, 0])
+		classes[-1][3] += 1
+
+	externals = []
+	externalIdx = {}
+	edges = []
+	edgeOffsets = [0]
+	for o in objs:
+		for propName, propSet in o._props.iteritems():
+			for v in propSet:
+				if objIdx.has_key(id(v)):
+					edges.append((sid(propName), OBJECT, objIdx[id(v)]))
+				elif type(v) == str:
+					edges.append((sid(propName), STR, sid(v)))
+				elif type(v) == unicode:
+					edges.append((sid(propName), UNICODE, sid(v)))
+				elif lexicalForm(v) != None:
+					lexical, datatype = lexicalForm(v)
+					edges.append((sid(propName), TYPED, sid(datatype) << 32 | sid(lexical)))
+				elif type(v) == float:
+					edges.append((sid(propName), FLOAT, struct.unpack("<q", struct.pack("<d", v))[0]))
+				elif isinstance(v, (int, long)):
+					if -2**63 <= v < 2**63:
+						edges.append((sid(propName), INT, v))
+					else:
+						edges.append((sid(propName), LONG, sid(str(v))))
+				elif getattr(v, "URI", None) != None and hasattr(v, "classURI"):
+					if not externalIdx.has_key(id(v)):
+						externalIdx[id(v)] = len(externals)
+						externals.append((sid(v.URI), sid(v.classURI)))
+					edges.append((sid(propName), EXTERNAL, externalIdx[id(v)]))
+				else:
+					raise SnapshotException("Can't store value "+str(v)+" of property "+propName+" of "+str(o.URI))
+		edgeOffsets.append(len(edges))
+
+	classRows = [(sid(c), sid(shortname), first, count) for c, shortname, first, count in classes]
+	objURIs = [sid(o.URI) for o in objs]
+	namespaces = [(sid(NSName), sid(NSuriStr)) for NSName, NSuriStr in mi.namespaceBindings.iteritems() if NSName != None]
+
+	stringOffsets = [0]
+	for s in stringList:
+		stringOffsets.append(stringOffsets[-1] + len(s))
+
+	out = open(filename, "wb")
+	offsets = []
+	pos = struct.calcsize(HEADER)
+	for size in [8*len(stringOffsets), stringOffsets[-1], 16*len(classRows), 4*len(objURIs),\
+				 8*len(edgeOffsets), struct.calcsize("<"+EDGE)*len(edges), 8*len(externals), 8*len(namespaces)]:
+		offsets.append(pos)
+		pos += size
+	out.write(struct.pack(HEADER, MAGIC, VERSION, len(stringList), len(classRows), len(objs), len(edges),\
+						  len(externals), len(namespaces), *offsets))
+	writeArray(out, "Q", stringOffsets)
+	for s in stringList:
+		out.write(s)
+	writeArray(out, "IIII", classRows)
+	writeArray(out, "I", objURIs)
+	writeArray(out, "Q", edgeOffsets)
+	writeArray(out, EDGE, edges)
+	writeArray(out, "II", externals)
+	writeArray(out, "II", namespaces)
+	out.close()
+
+def writeArray(out, fmt, rows, chunkSize=65536):
+	for start in xrange(0, len(rows), chunkSize):
+		chunk = rows[start:start+chunkSize]
+		if len(fmt) > 1:
+			chunk = [x for row in chunk for x in row]
+		out.write(struct.pack("<"+fmt*(len(chunk)/len(fmt)), *chunk))
+
+def loadSnapshot(filename):
+	"""Returns a MusicInfo whose objects are read from the snapshot file on demand."""
+	snapshot = Snapshot(filename)
+	mi = MusicInfo()
+	mi.snapshot = snapshot
+	snapshot.mi = mi
+	mi.MainIdx = SnapshotIdx(snapshot)
+	types = knownTypes()
+	for c in xrange(snapshot.nClasses):
+		classSid, shortnameSid, first, count = struct.unpack_from("<IIII", snapshot.mm, snapshot.classesOff + 16*c)
+		classURI = snapshot.string(classSid)
+		if not types.has_key(classURI):
+			raise SnapshotException("Class "+classURI+" of the snapshot isn't in the MO model.")
+		cls = types[classURI]
+		shortname = snapshot.string(shortnameSid)
+		if not hasattr(mi, shortname+"Idx"):
+			setattr(mi, shortname+"Idx", SnapshotIdx(snapshot))
+		idx = getattr(mi, shortname+"Idx")
+		for i in xrange(first, first+count):
+			snapshot.classes[i] = cls
+			uri = snapshot.uri(i)
+			dict.__setitem__(mi.MainIdx, uri, i)
+			dict.__setitem__(idx, uri, i)
+	mi.namespaceBindings = dict(mi.namespaceBindings)
+	for n in xrange(snapshot.nNamespaces):
+		prefixSid, uriSid = struct.unpack_from("<II", snapshot.mm, snapshot.namespacesOff + 8*n)
+		mi.namespaceBindings[snapshot.string(prefixSid)] = snapshot.string(uriSid)
+	return mi
+
+class Snapshot(object):
+	"""An open snapshot file, and the objects built from it so far."""
+	def __init__(self, filename):
+		f = open(filename, "rb")
+		self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		f.close()
+		header = struct.unpack_from(HEADER, self.mm, 0)
+		if header[0] != MAGIC or header[1] != VERSION:
+			raise SnapshotException(filename+" is not a version "+str(VERSION)+" mopy snapshot.")
+		(self.nStrings, self.nClasses, self.nObjects, self.nEdges, self.nExternals, self.nNamespaces) = header[2:8]
+		(self.stringOffsetsOff, self.stringDataOff, self.classesOff, self.objectsOff, self.edgeOffsetsOff,\
+		 self.edgesOff, self.externalsOff, self.namespacesOff) = header[8:]
+		self.edgeSize = struct.calcsize("<"+EDGE)
+		self.classes = [None]*self.nObjects
+		self.objects = {} # Object number -> object
+		self.externals = {} # External number -> object
+		self.mi = None
+
+	def raw(self, sid):
+		start, end = struct.unpack_from("<QQ", self.mm, self.stringOffsetsOff + 8*sid)
+		return self.mm[self.stringDataOff+start:self.stringDataOff+end]
+
+	def string(self, sid):
+		"""A URI, name or lexical form : a str if it is ASCII, or else unicode if it is UTF-8."""
+		s = self.raw(sid)
+		try:
+			s.decode("ascii")
+			return s
+		except UnicodeDecodeError:
+			try:
+				return s.decode("utf-8")
+			except UnicodeDecodeError:
+				return s
+
+	def uri(self, i):
+		return self.string(struct.unpack_from("<I", self.mm, self.objectsOff + 4*i)[0])
+
+	def object(self, i):
+		"""The object numbered i, whose properties are filled in when first used."""
+		if not self.objects.has_key(i):
+			obj = self.classes[i](self.uri(i))
+			obj._props = LazyProps(self, i, obj)
+			self.objects[i] = obj
+		return self.objects[i]
+
+	def external(self, n):
+		if not self.externals.has_key(n):
+			uriSid, classSid = struct.unpack_from("<II", self.mm, self.externalsOff + 8*n)
+			uri = self.string(uriSid)
+			if knownInstances().has_key(uri):
+				self.externals[n] = knownInstances()[uri]
+			else:
+				self.externals[n] = knownTypes()[self.string(classSid)](uri)
+		return self.externals[n]
+
+	def value(self, kind, v):
+		if kind == OBJECT:
+			return self.object(v)
+		elif kind == STR:
+			return intern(self.raw(v))
+		elif kind == UNICODE:
+			return self.raw(v).decode("utf-8")
+		elif kind == INT:
+			return int(v)
+		elif kind == FLOAT:
+			return struct.unpack("<d", struct.pack("<q", v))[0]
+		elif kind == EXTERNAL:
+			return self.external(v)
+		elif kind == LONG:
+			return long(self.string(v))
+		elif kind == TYPED:
+			return parseLiteral(self.string(v >> 32), self.string(v & 0xffffffff))
+		raise SnapshotException("Unknown kind of value "+str(kind)+" in snapshot.")
+
+	def fill(self, i, obj):
+		"""Read the properties of object i from the file."""
+		start, end = struct.unpack_from("<QQ", self.mm, self.edgeOffsetsOff + 8*i)
+		obj._props = {}
+		if end > start:
+			edges = struct.unpack_from("<"+EDGE*(end-start), self.mm, self.edgesOff + self.edgeSize*start)
+			values = {}
+			for e in xrange(0, len(edges), 3):
+				values.setdefault(edges[e], []).append(self.value(edges[e+1], edges[e+2]))
+			for propSid, vs in values.iteritems():
+				getattr(obj, self.string(propSid)).add_many(vs, validate=False)
+		if self.mi != None and self.mi.MainIdx.get(obj.URI) is obj:
+			self.mi.watch(obj)
+			if isBlind(obj):
+				self.mi.indexBlind(obj)
+		return obj._props
+
+	def loadAll(self):
+		"""Build every object, so the MusicInfo's indexes are complete."""
+		for i in xrange(self.nObjects):
+			self.object(i)._props.keys()
+
+class SnapshotIdx(dict):
+	"""
+	An index dict whose values start out as object numbers in a snapshot, and
+	are replaced by the objects the first time they are looked up.
+	"""
+	def __init__(self, snapshot):
+		dict.__init__(self)
+		self.snapshot = snapshot
+
+	def load(self, key, v):
+		if type(v) == int:
+			v = self.snapshot.object(v)
+			dict.__setitem__(self, key, v)
+		return v
+
+	def __getitem__(self, key):
+		return self.load(key, dict.__getitem__(self, key))
+
+	def get(self, key, default=None):
+		if not self.has_key(key):
+			return default
+		return self[key]
+
+	def pop(self, key, *default):
+		if self.has_key(key):
+			self[key]
+		return dict.pop(self, key, *default)
+
+	def itervalues(self):
+		for key in self.keys():
+			yield self[key]
+
+	def iteritems(self):
+		for key in self.keys():
+			yield key, self[key]
+
+	def values(self):
+		return list(self.itervalues())
+
+	def items(self):
+		return list(self.iteritems())
+
+class LazyProps(dict):
+	"""
+	_props of an object built from a snapshot (or another store). The first use
+	of it reads the object's properties with source.fill(key, obj), which
+	replaces it with an ordinary dict.
+	"""
+	def __init__(self, source, key, obj):
+		dict.__init__(self)
+		self.source = source
+		self.key = key
+		self.obj = obj
+
+def _filling(name):
+	def method(self, *args):
+		if self.obj._props is self:
+			props = self.source.fill(self.key, self.obj)
+		else:
+			props = self.obj._props
+		return getattr(props, name)(*args)
+	method.__name__ = name
+	return method
+
+for _name in ["__getitem__", "__setitem__", "__delitem__", "__contains__", "__iter__", "__len__", "get",\
+			  "has_key", "keys", "values", "items", "iterkeys", "itervalues", "iteritems", "pop", "setdefault"]:
+	setattr(LazyProps, _name, _filling(_name))
@@ -0,0 +1,234 @@
+"""
+TimeLine.py
+
+Interval index of the instants and intervals on each timeline of a MusicInfo.
+
+An Interval or Instant is placed on the timelines given by its onTimeLine
+values, from its first beginsAt* (or at*) position to its first endsAt*
+position, or its beginning plus its duration. Durations are counted in seconds,
+so that beginsAtDuration "PT30S" is at 30 and matches intervals on the same
+timeline placed with beginsAtInt or atReal. Positions given as datetimes are
+kept apart from numeric ones. Intervals are closed : one ending at 30 overlaps
+one beginning at 30.
+
+Each timeline's intervals are held in a few centred interval trees, of
+decreasing sizes. An added interval goes in a new tree, which is merged with
+the smallest trees while they are no bigger than it, as in a binary counter, so
+that adding costs O(log^2 n) on average and queries visit O(log n) trees of
+depth O(log n). Building the index for a whole store makes one tree per
+timeline.
+"""
+
+import bisect
+from datetime import datetime, timedelta
+
+# Properties giving the position of an Instant or Interval, the first found being used
+beginProperties = ["beginsAtDuration", "beginsAtInt", "beginsAtDateTime", "atDuration", "atInt", "atReal", "atDateTime"]
+endProperties = ["endsAtDuration", "endsAtInt", "endsAtDateTime"]
+durationProperties = ["durationXSD", "durationInt"]
+timeLineProperties = set(beginProperties + endProperties + durationProperties + ["onTimeLine"])
+
+def position(v):
+	"""A value of a timeline property as a number of seconds or a datetime, or None if it has no position."""
+	if isinstance(v, timedelta):
+		return v.days*86400 + v.seconds + v.microseconds/1e6
+	if isinstance(v, (int, long, float, datetime)) and not isinstance(v, bool):
+		return v
+	return None
+
+def firstPosition(obj, propNames):
+	for propName in propNames:
+		for v in obj._props.get(propName, ()):
+			pos = position(v)
+			if pos != None:
+				return pos
+	return None
+
+def extent(obj):
+	"""(begin, end) of an Instant or Interval, or None if it has no usable position."""
+	begin = firstPosition(obj, beginProperties)
+	if begin == None:
+		return None
+	end = firstPosition(obj, endProperties)
+	if end == None:
+		end = begin
+		length = firstPosition(obj, durationProperties)
+		if isinstance(length, datetime):
+			return None
+		if length != None:
+			if isinstance(begin, datetime):
+				end = begin + timedelta(seconds=length)
+			else:
+				end = begin + length
+	if isinstance(begin, datetime) != isinstance(end, datetime) or end < begin:
+		return None
+	return begin, end
+
+class Entry(object):
+	__slots__ = ("begin", "end", "obj", "live")
+	def __init__(self, begin, end, obj):
+		self.begin = begin
+		self.end = end
+		self.obj = obj
+		self.live = True
+
+class Node(object):
+	"""A node of a centred interval tree : the entries containing center, sorted
+	by beginning and by end, and subtrees for the entries either side of it."""
+	__slots__ = ("center", "begins", "byBegin", "ends", "byEnd", "left", "right")
+
+def buildTree(entries):
+	"""A centred interval tree of entries, which must be sorted by beginning."""
+	if len(entries) == 0:
+		return None
+	node = Node()
+	node.center = entries[len(entries)/2].begin
+	left, here, right = [], [], []
+	for e in entries:
+		if e.end < node.center:
+			left.append(e)
+		elif e.begin > node.center:
+			right.append(e)
+		else:
+			here.append(e)
+	node.byBegin = here
+	node.begins = [e.begin for e in here]
+	node.byEnd = sorted(here, key=lambda e: e.end)
+	node.ends = [e.end for e in node.byEnd]
+	node.left = buildTree(left)
+	node.right = buildTree(right)
+	return node
+
+def searchTree(node, start, end, found):
+	"""Append to found the entries of the tree overlapping [start, end]."""
+	while node != None:
+		if end < node.center:
+			found.extend(node.byBegin[:bisect.bisect_right(node.begins, end)])
+			node = node.left
+		elif start > node.center:
+			found.extend(node.byEnd[bisect.bisect_left(node.ends, start):])
+			node = node.right
+		else:
+			found.extend(node.byBegin)
+			searchTree(node.left, start, end, found)
+			node = node.right
+
+class IntervalSet(object):
+	"""The entries of one timeline, in trees of decreasing sizes."""
+	def __init__(self, entries=()):
+		self.trees = [] # (entries, root) pairs, largest first
+		self.size = 0
+		self.dead = 0 # Removed entries still in the trees
+		if entries:
+			self.rebuild(list(entries))
+
+	def rebuild(self, entries):
+		entries.sort(key=lambda e: e.begin)
+		self.trees = [(entries, buildTree(entries))]
+		self.size = len(entries)
+		self.dead = 0
+
+	def add(self, entry):
+		merged = [entry]
+		self.size += 1
+		while self.trees and len(self.trees[-1][0]) <= len(merged):
+			entries = self.trees.pop()[0]
+			live = [e for e in entries if e.live]
+			self.size -= len(entries) - len(live)
+			self.dead -= len(entries) - len(live)
+			merged.extend(live)
+		merged.sort(key=lambda e: e.begin)
+		self.trees.append((merged, buildTree(merged)))
+
+	def remove(self, entry):
+		entry.live = False
+		self.dead += 1
+		if self.dead*2 > self.size:
+			self.rebuild([e for t in self.trees for e in t[0] if e.live])
+
+	def __len__(self):
+		return self.size - self.dead
+
+	def overlapping(self, start, end):
+		found = []
+		for entries, root in self.trees:
+			searchTree(root, start, end, found)
+		return [e for e in found if e.live]
+
+class TimeLineIndex(object):
+	"""The Instants and Intervals of a MusicInfo, by timeline. See MusicInfo.indexTimeLines.
+	
+	Objects whose positions change are only marked stale, and are placed again
+	before the next query, all at once if there are many of them as after an
+	import."""
+	def __init__(self, objs=()):
+		self.stale = set()
+		self.build(objs)
+
+	def build(self, objs):
+		self.sets = {} # (timeline, whether positions are datetimes) -> IntervalSet
+		self.entries = {} # object -> list of (key in sets, Entry)
+		pending = {}
+		for obj in objs:
+			for key, entry in self.entriesFor(obj):
+				pending.setdefault(key, []).append(entry)
+				self.entries.setdefault(obj, []).append((key, entry))
+		for key, entries in pending.iteritems():
+			self.sets[key] = IntervalSet(entries)
+
+	def refresh(self):
+		stale, self.stale = self.stale, set()
+		if len(stale) > len(self.entries):
+			self.build(stale.union(self.entries.keys()))
+			return
+		for obj in stale:
+			self.remove(obj)
+			self.add(obj)
+
+	def entriesFor(self, obj):
+		timeLines = obj._props.get("onTimeLine")
+		if not timeLines:
+			return []
+		pos = extent(obj)
+		if pos == None:
+			return []
+		return [((timeLine, isinstance(pos[0], datetime)), Entry(pos[0], pos[1], obj)) for timeLine in set(timeLines)]
+
+	def add(self, obj):
+		for key, entry in self.entriesFor(obj):
+			self.sets.setdefault(key, IntervalSet()).add(entry)
+			self.entries.setdefault(obj, []).append((key, entry))
+
+	def remove(self, obj):
+		self.stale.discard(obj)
+		for key, entry in self.entries.pop(obj, ()):
+			intervals = self.sets[key]
+			intervals.remove(entry)
+			if len(intervals) == 0:
+				del self.sets[key]
+
+	def changed(self, obj):
+		self.stale.add(obj)
+
+	def overlapping(self, timeLine, start, end):
+		"""The objects on timeLine from start to end or overlapping it, in no particular order."""
+		start, end = position(start), position(end)
+		if start == None or end == None:
+			raise TypeError("Timeline positions are numbers of seconds, timedeltas or datetimes")
+		if self.stale:
+			self.refresh()
+		intervals = self.sets.get((timeLine, isinstance(start, datetime)))
+		if intervals == None or end < start:
+			return []
+		return [e.obj for e in intervals.overlapping(start, end)]
+
+	def within(self, timeLine, start, end):
+		"""The objects on timeLine lying between start and end."""
+		start, end = position(start), position(end)
+		found = []
+		for obj in self.overlapping(timeLine, start, end):
+			for key, entry in self.entries[obj]:
+				if key[0] is timeLine and entry.begin >= start and entry.end <= end:
+					found.append(obj)
+					break
+		return found
@@ -0,0 +1,34 @@
+"""
+URITable.py
+
+Splits URIs into a namespace, numbered by the table, and a local name, so that
+stores can keep each namespace once and refer to URIs by compact ids.
+
+The namespace of a URI is always the part up to its last "/" or "#", whatever
+namespaces are known, so that a URI is split the same way however the namespace
+bindings change between runs. Namespaces are numbered in the order they are
+added, so a table rebuilt from the same list gives the same ids.
+"""
+
+class URITable(object):
+	def __init__(self, namespaces=()):
+		self.namespaces = [] # id -> namespace URI
+		self.ids = {} # namespace URI -> id
+		for namespace in namespaces:
+			self.addNamespace(namespace)
+
+	def addNamespace(self, namespace):
+		"""The id of namespace, adding it if it isn't known."""
+		nsId = self.ids.get(namespace)
+		if nsId == None:
+			nsId = self.ids[namespace] = len(self.namespaces)
+			self.namespaces.append(namespace)
+		return nsId
+
+	def split(self, uri):
+		"""(namespace id, local name) of uri, adding its namespace if it isn't known."""
+		cut = max(uri.rfind("/"), uri.rfind("#")) + 1
+		return self.addNamespace(uri[:cut]), uri[cut:]
+
+	def join(self, nsId, local):
+		return self.namespaces[nsId] + local
@@ -0,0 +1,241 @@
+"""
+XSD.py
+
+Python values for literals typed with XML Schema datatypes, and back.
+
+When RDF is imported, literals of the datatypes in the coercers table below
+become numbers, datetimes, timedeltas or Decimals, which compare and sort
+without reparsing any text. DateTime, Date, Duration, GYear and GYearMonth
+values remember their lexical form when it isn't the one they would be written
+as, and literals which can't be read as their datatype keep it as TypedStrings,
+so exporting them gives back the text which was read.
+"""
+
+import re
+from datetime import datetime, date, timedelta
+from decimal import Decimal, InvalidOperation
+
+NS = "http://www.w3.org/2001/XMLSchema#"
+
+_timezone = r'(Z|[+-]\d\d:\d\d)?'
+_dateTime = re.compile(r'^(-?\d{4,})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d+))?'+_timezone+'$')
+_date = re.compile(r'^(-?\d{4,})-(\d\d)-(\d\d)'+_timezone+'$')
+_duration = re.compile(r'^(-)?P(?:(\d+)Y)?(?:(\d+)M)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)(?:\.(\d+))?S)?)?$')
+_gYearMonth = re.compile(r'^(-?\d{4,})-(\d\d)'+_timezone+'$')
+_gYear = re.compile(r'^(-?\d{4,})'+_timezone+'$')
+
+def parseLiteral(datatype, text):
+	"""The value of a literal with this lexical form and datatype URI."""
+	return coercers.get(datatype, str)(text)
+
+class TypedString(str):
+	"""A literal whose lexical form doesn't give a value of its datatype, eg. an xsd:duration with years."""
+	def __new__(cls, text, datatype):
+		v = str.__new__(cls, text)
+		v.datatype = datatype
+		return v
+	def __reduce__(self):
+		return (TypedString, (str(self), self.datatype))
+
+class DateTime(datetime):
+	"""An xsd:dateTime. Times with a timezone are converted to UTC."""
+	__slots__ = ("lexical",)
+	datatype = NS+"dateTime"
+	def __reduce__(self):
+		return (parseLiteral, lexicalForm(self)[::-1])
+
+class Date(date):
+	"""An xsd:date. Its timezone, if any, is only kept in its lexical form."""
+	__slots__ = ("lexical",)
+	datatype = NS+"date"
+	def __reduce__(self):
+		return (parseLiteral, lexicalForm(self)[::-1])
+
+class Duration(timedelta):
+	"""An xsd:duration without years or months, which have no fixed length."""
+	__slots__ = ("lexical",)
+	datatype = NS+"duration"
+	def __reduce__(self):
+		return (parseLiteral, lexicalForm(self)[::-1])
+
+class GYear(int):
+	"""An xsd:gYear, as the year number."""
+	__slots__ = ("lexical",)
+	datatype = NS+"gYear"
+	def __reduce__(self):
+		return (parseLiteral, lexicalForm(self)[::-1])
+
+class GYearMonth(int):
+	"""An xsd:gYearMonth, as year*12 + month-1 so that months sort and subtract."""
+	__slots__ = ("lexical",)
+	datatype = NS+"gYearMonth"
+	def __reduce__(self):
+		return (parseLiteral, lexicalForm(self)[::-1])
+	def __str__(self):
+		return lexicalForm(self)[0]
+
+def withLexical(v, text):
+	"""Give v the lexical form it was read from, unless it would be written that way anyway."""
+	v.lexical = None
+	if formats[type(v)](v) != text:
+		v.lexical = text
+	return v
+
+def utcOffset(tz):
+	if tz == None or tz == "Z":
+		return timedelta(0)
+	offset = timedelta(hours=int(tz[1:3]), minutes=int(tz[4:6]))
+	if tz[0] == "-":
+		return -offset
+	return offset
+
+def toDateTime(text):
+	m = _dateTime.match(text)
+	if m == None:
+		return None
+	year, month, day, hour, minute, second, fraction, tz = m.groups()
+	try:
+		v = DateTime(int(year), int(month), int(day), int(hour), int(minute), int(second), int(((fraction or "")+"000000")[:6]))
+		if tz != None:
+			v = v - utcOffset(tz)
+			v = DateTime(v.year, v.month, v.day, v.hour, v.minute, v.second, v.microsecond)
+	except (ValueError, OverflowError):
+		return None # eg. 24:00:00, or years datetime can't hold
+	return withLexical(v, str(text))
+
+def toDate(text):
+	m = _date.match(text)
+	if m == None:
+		return None
+	year, month, day, tz = m.groups()
+	try:
+		v = Date(int(year), int(month), int(day))
+	except ValueError:
+		return None
+	return withLexical(v, str(text))
+
+def toDuration(text):
+	m = _duration.match(text)
+	if m == None or text.endswith("P") or text.endswith("T"):
+		return None
+	sign, years, months, days, hours, minutes, seconds, fraction = m.groups()
+	if int(years or 0) != 0 or int(months or 0) != 0:
+		return None
+	try:
+		v = timedelta(days=int(days or 0), hours=int(hours or 0), minutes=int(minutes or 0), seconds=int(seconds or 0),\
+					  microseconds=int(((fraction or "")+"000000")[:6]))
+	except OverflowError:
+		return None
+	if sign:
+		v = -v
+	return withLexical(Duration(v.days, v.seconds, v.microseconds), str(text))
+
+def toGYearMonth(text):
+	m = _gYearMonth.match(text)
+	if m == None or not 1 <= int(m.group(2)) <= 12:
+		return None
+	return withLexical(GYearMonth(int(m.group(1))*12 + int(m.group(2)) - 1), str(text))
+
+def toGYear(text):
+	m = _gYear.match(text)
+	if m == None:
+		return None
+	return withLexical(GYear(int(m.group(1))), str(text))
+
+def toDecimal(text):
+	try:
+		return Decimal(text)
+	except InvalidOperation:
+		return None
+
+def toNumber(numberType):
+	def parse(text):
+		try:
+			return numberType(text)
+		except ValueError:
+			return None
+	return parse
+
+def coercer(datatype, parse):
+	"""The function coercing literals of datatype, from one returning None for lexical forms it can't read."""
+	def coerce(text):
+		v = parse(text)
+		if v == None:
+			return TypedString(text, datatype)
+		return v
+	return coerce
+
+def formatDuration(v):
+	if v < timedelta(0):
+		return "-"+formatDuration(-v)
+	hours, minutes, seconds = v.seconds/3600, v.seconds/60%60, v.seconds%60
+	text = "P"
+	if v.days:
+		text += "%dD" % v.days
+	if v.seconds or v.microseconds or not v.days:
+		text += "T"
+		if hours:
+			text += "%dH" % hours
+		if minutes:
+			text += "%dM" % minutes
+		if v.microseconds:
+			text += ("%d.%06d" % (seconds, v.microseconds)).rstrip("0")+"S"
+		elif seconds or not (hours or minutes):
+			text += "%dS" % seconds
+	return text
+
+def formatYearMonth(v):
+	year, month = divmod(int(v), 12)
+	return "%04d-%02d" % (year, month+1)
+
+# Datatype URI -> function turning a lexical form into a value. Lexical forms
+# which don't parse are kept as TypedStrings.
+coercers = {}
+for _datatype, _parse in [("integer", toNumber(int)), ("int", toNumber(int)), ("long", toNumber(int)),\
+						  ("nonNegativeInteger", toNumber(int)), ("gMonth", toNumber(int)), ("gDay", toNumber(int)),\
+						  ("float", toNumber(float)), ("double", toNumber(float)), ("decimal", toDecimal),\
+						  ("dateTime", toDateTime), ("date", toDate), ("duration", toDuration),\
+						  ("gYear", toGYear), ("gYearMonth", toGYearMonth)]:
+	coercers[NS+_datatype] = coercer(NS+_datatype, _parse)
+
+# Type of value -> function giving its lexical form, and its datatype URI
+formats = {DateTime : datetime.isoformat,
+		   datetime : datetime.isoformat,
+		   Date : date.isoformat,
+		   date : date.isoformat,
+		   Duration : formatDuration,
+		   timedelta : formatDuration,
+		   GYear : lambda v: "%04d" % v,
+		   GYearMonth : formatYearMonth,
+		   Decimal : str}
+datatypes = {DateTime : DateTime.datatype,
+			 datetime : DateTime.datatype,
+			 Date : Date.datatype,
+			 date : Date.datatype,
+			 Duration : Duration.datatype,
+			 timedelta : Duration.datatype,
+			 GYear : GYear.datatype,
+			 GYearMonth : GYearMonth.datatype,
+			 Decimal : NS+"decimal"}
+
+# Literal types besides str, unicode, int and float, see PropertySet.Lits
+nativeTypes = tuple(formats.keys()) + (TypedString,)
+
+# validTypes of properties with these ranges in the generated classes. Strings
+# are still allowed, as they were before these literals were coerced.
+dateTimeTypes = (str, datetime)
+dateTypes = (str, date)
+durationTypes = (str, timedelta)
+gYearMonthTypes = (str, GYearMonth)
+decimalTypes = (float, Decimal)
+
+def lexicalForm(v):
+	"""(lexical form, datatype URI) to write v as, or None if v isn't of one of the nativeTypes."""
+	if type(v) == TypedString:
+		return str(v), v.datatype
+	if not formats.has_key(type(v)):
+		return None
+	lexical = getattr(v, "lexical", None)
+	if lexical == None:
+		lexical = formats[type(v)](v)
+	return lexical, datatypes[type(v)]
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_ingest.py
+
+Checks of ingestSources. See test_model.py for running the tests.
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, ".."))
+sys.path.insert(0, os.path.join(here, "..", "benchmarks"))
+sys.path.insert(0, here)
+
+import synthetic
+from mopy.MusicInfo import MusicInfo
+from mopy.RDFInterface import ImportException, parseFile
+from mopy.Ingest import ingestSources, SourceImporter
+from test_rdf import exportCanonical
+
+class IngestTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.sources = []
+		for i in range(4):
+			# Each document numbers its blank nodes from 1, as documents fetched apart do
+			filename = os.path.join(self.dir, "artist%d.nt" % i)
+			out = open(filename, "w")
+			synthetic.writeArtist(synthetic.Writer(out), synthetic.random.Random(i), i, 2)
+			out.close()
+			self.sources.append(filename)
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def testMatchesImportingOneByOne(self):
+		mi = MusicInfo()
+		for source in self.sources:
+			importer = SourceImporter() # Blind nodes of different documents kept apart
+			parseFile(importer, source, "nt")
+			for obj in importer.close().MainIdx.values():
+				mi.add(obj)
+		expected = exportCanonical(mi)
+		for processes in (0, 2):
+			ingested = ingestSources(self.sources, concurrency=3, processes=processes)
+			self.assertEqual(len(ingested.MainIdx), len(mi.MainIdx))
+			self.assertEqual(exportCanonical(ingested), expected, processes)
+
+	def testFailures(self):
+		sources = self.sources + [os.path.join(self.dir, "missing.nt")]
+		self.assertRaises(ImportException, ingestSources, sources, processes=0)
+		failures = []
+		mi = ingestSources(sources, processes=0, strict=False, failures=failures)
+		self.assertEqual([source for source, e in failures], sources[-1:])
+		self.assertEqual(len(mi.MusicArtistIdx), 4)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_model.py
+
+Checks of the generated model : it imports, lazily and all at once, and its
+objects survive pickling. Generate the model with "python genpy.py" first, then
+run the tests from the top of the repository :
+
+	$ python -m unittest discover tests
+"""
+
+import sys
+import os
+import pickle
+import cPickle
+import logging
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import mopy
+from mopy import model
+from mopy.model import mo___MusicArtist, mo___Track, foaf___Agent
+
+class ModelTest(unittest.TestCase):
+	def testLoadAll(self):
+		model.loadAll()
+		for name in model.classNames.values() + model.instanceNames.values():
+			self.assert_(hasattr(model, name), name)
+		namespace = {}
+		exec "from mopy.model import *" in namespace
+		self.assert_(namespace.has_key("mo___Track"))
+
+	def testNamespacePackages(self):
+		self.assert_(mopy.mo.Track is mo___Track)
+		self.assert_(mopy.foaf.Agent is foaf___Agent)
+
+	def testValidTypes(self):
+		self.assertEqual(mo___Track.maker.validTypes, (foaf___Agent,))
+		t = mo___Track("http://example.org/track")
+		self.assertRaises(TypeError, t.maker.add, mo___Track("http://example.org/other"))
+
+	def testPickle(self):
+		a = mo___MusicArtist("http://example.org/artist")
+		a.name = "An artist"
+		t = mo___Track("http://example.org/track")
+		t.title = "A track"
+		t.maker = a
+		a.made = t
+		protocols = (0, 2)
+		if hasattr(mo___Track, "__slots__"):
+			protocols = (2,) # genpy.py --compact
+		for m in (pickle, cPickle):
+			for protocol in protocols:
+				t2 = m.loads(m.dumps(t, protocol))
+				self.assert_(type(t2) is mo___Track)
+				self.assertEqual(t2.URI, t.URI)
+				self.assertEqual(list(t2.title), ["A track"])
+				a2 = list(t2.maker)[0]
+				self.assertEqual(list(a2.name), ["An artist"])
+				self.assert_(list(a2.made)[0] is t2)
+				self.assert_(t2.maker.schema is mo___Track.maker)
+				self.assert_(t2.maker.holder is t2)
+
+	def testUnknownValidTypes(self):
+		"""Ranges naming classes the model doesn't have are ignored."""
+		from mopy.PropertySet import PropertyDescriptor
+		logging.disable(logging.WARNING)
+		self.addCleanup(logging.disable, logging.NOTSET)
+		self.assertEqual(PropertyDescriptor("p", "http://example.org/p", ("rdf___List", "foaf___Agent"), False).validTypes, (foaf___Agent,))
+		self.assertEqual(PropertyDescriptor("p", "http://example.org/p", ("rdf___List",), False).validTypes, None)
+
+	def testPickleDescriptor(self):
+		self.assertEqual(pickle.loads(pickle.dumps(mo___Track.maker)).validTypes, (foaf___Agent,))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_musicinfo.py
+
+Checks of MusicInfo queries. See test_model.py for running the tests.
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import subprocess
+import random
+import unittest
+from datetime import datetime, timedelta
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.join(here, "..")
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, "benchmarks"))
+sys.path.insert(0, here)
+
+import mopy
+from mopy.MusicInfo import MusicInfo
+from test_rdf import writeSynthetic, exportCanonical
+from mopy.model import mo___MusicArtist, mo___SoloMusicArtist, mo___Track, foaf___Agent, foaf___Person
+from mopy.model import timeline___TimeLine, timeline___Interval, timeline___Instant
+
+class InstancesOfTest(unittest.TestCase):
+	def setUp(self):
+		self.mi = MusicInfo()
+		self.artist = mo___MusicArtist("http://example.org/artist")
+		self.solo = mo___SoloMusicArtist("http://example.org/solo")
+		self.person = foaf___Person("http://example.org/person")
+		for o in [self.artist, self.solo, self.person, mo___Track("http://example.org/track")]:
+			self.mi.add(o)
+
+	def testSubclasses(self):
+		self.assertEqual(set(self.mi.instances_of(foaf___Agent)), set([self.artist, self.solo, self.person]))
+		self.assertEqual(set(self.mi.instances_of(mo___MusicArtist)), set([self.artist, self.solo]))
+
+	def testClassOnly(self):
+		self.assertEqual(self.mi.instances_of(mo___MusicArtist, include_subclasses=False), [self.artist])
+		self.assertEqual(self.mi.instances_of(foaf___Agent, include_subclasses=False), [])
+
+	def testNamespacesNotLoaded(self):
+		"""Looking for agents doesn't import the namespaces of their subclasses."""
+		code = "import sys, mopy; from mopy.MusicInfo import MusicInfo;"\
+			   "MusicInfo().instances_of(mopy.foaf.Agent);"\
+			   "print sorted([m for m in sys.modules if m.endswith('._model') and sys.modules[m] != None])"
+		out = subprocess.Popen([sys.executable, "-c", code], cwd=root, stdout=subprocess.PIPE).communicate()[0]
+		self.assert_("mopy.myspace._model" not in out, out)
+		self.assert_("mopy.mo._model" not in out, out)
+
+class AddManyTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def testMatchesAdd(self):
+		"""add_many of further imports, which overlap the store, gives the same store as add() of each object."""
+		filename = writeSynthetic(os.path.join(self.dir, "data.nt"), 3)
+		extra = writeSynthetic(os.path.join(self.dir, "extra.nt"), 2, seed=1)
+		stores = []
+		for bulk in (False, True):
+			mi = mopy.importRDFFile(filename, "nt")
+			for name in (filename, extra):
+				objs = mopy.importRDFFile(name, "nt").MainIdx.values()
+				if bulk:
+					mi.add_many(objs)
+				else:
+					for obj in objs:
+						mi.add(obj)
+			stores.append(mi)
+		self.assertEqual(len(stores[1].MainIdx), len(stores[0].MainIdx))
+		self.assertEqual(exportCanonical(stores[1]), exportCanonical(stores[0]))
+
+class IndexTest(unittest.TestCase):
+	def setUp(self):
+		self.mi = MusicInfo()
+		self.artists = [mo___MusicArtist("http://example.org/artist/%d" % i) for i in range(2)]
+		self.tracks = []
+		for i in range(10):
+			t = mo___Track("http://example.org/track/%d" % i)
+			t.track_number = i
+			t.maker = self.artists[i % 2]
+			self.tracks.append(t)
+		self.mi.add_many(self.artists + self.tracks)
+
+	def numbers(self, objs):
+		return sorted([list(o.track_number)[0] for o in objs])
+
+	def testFind(self):
+		"""find() gives the same objects with and without an index, objects being compared by URI."""
+		unindexed = self.mi.find(maker=self.artists[0])
+		self.mi.addIndex("maker")
+		self.assertEqual(self.numbers(self.mi.find(maker=self.artists[0])), [0, 2, 4, 6, 8])
+		self.assertEqual(set(self.mi.find(maker=mo___MusicArtist(self.artists[0].URI))), set(unindexed))
+		self.assertEqual(self.numbers(self.mi.find(mo___Track, maker=self.artists[1], track_number=3)), [3])
+		self.assertEqual(self.mi.find(mo___MusicArtist, maker=self.artists[1]), [])
+
+	def testOrderedRange(self):
+		self.mi.addIndex("track_number", ordered=True)
+		self.assertEqual(self.numbers(self.mi.find(track_number=slice(3, 6))), [3, 4, 5])
+		self.assertEqual(self.numbers(self.mi.find(track_number=slice(None, 2))), [0, 1])
+		self.assertEqual(self.numbers(self.mi.find(track_number=slice(8, None))), [8, 9])
+		self.assertEqual(self.numbers(self.mi.find(track_number=slice(3, 6), maker=self.artists[0])), [4])
+
+	def testFollowsChanges(self):
+		self.mi.addIndex("maker")
+		self.mi.addIndex("track_number", ordered=True)
+		self.tracks[0].maker = self.artists[1]
+		self.tracks[1].track_number = 20
+		t = mo___Track("http://example.org/track/new")
+		t.track_number = 4
+		self.mi.add(t)
+		self.assertEqual(self.numbers(self.mi.find(maker=self.artists[0])), [2, 4, 6, 8])
+		self.assertEqual(self.numbers(self.mi.find(track_number=slice(1, 5))), [2, 3, 4, 4])
+		self.assertEqual(self.numbers(self.mi.find(track_number=slice(10, None))), [20])
+
+class TimeLineTest(unittest.TestCase):
+	def setUp(self):
+		self.mi = MusicInfo()
+		self.tl = timeline___TimeLine("http://example.org/tl")
+		self.other = timeline___TimeLine("http://example.org/other")
+		self.mi.add_many([self.tl, self.other])
+		self.add("a", self.tl, beginsAtDuration=timedelta(0), durationXSD=timedelta(seconds=10))
+		self.add("b", self.tl, beginsAtInt=5, endsAtInt=20)
+		self.add("c", self.tl, beginsAtDuration=timedelta(seconds=30), endsAtDuration=timedelta(seconds=45))
+		self.add("d", self.other, beginsAtInt=0, endsAtInt=100)
+		self.add("e", self.tl, beginsAtDateTime=datetime(2007, 10, 15, 12), durationInt=3600)
+		self.add("i40", self.tl, cls=timeline___Instant, atReal=40.0)
+		self.add("i50", self.tl, cls=timeline___Instant, atDuration=timedelta(seconds=50))
+
+	def add(self, name, timeLine, cls=timeline___Interval, **values):
+		obj = cls("http://example.org/"+name)
+		obj.onTimeLine = timeLine
+		for propName, v in values.iteritems():
+			setattr(obj, propName, v)
+		self.mi.add(obj)
+		return obj
+
+	def names(self, objs):
+		return sorted([o.URI.split("/")[-1] for o in objs])
+
+	def testQueries(self):
+		self.assertEqual(self.names(self.mi.overlapping(self.tl, 8, 12)), ["a", "b"])
+		self.assertEqual(self.names(self.mi.overlapping(self.tl.URI, 20, 30)), ["b", "c"]) # Closed intervals
+		self.assertEqual(self.names(self.mi.at(self.tl, 40)), ["c", "i40"])
+		self.assertEqual(self.names(self.mi.within(self.tl, 25, 46)), ["c", "i40"])
+		self.assertEqual(self.names(self.mi.overlapping(self.tl, timedelta(seconds=48), timedelta(seconds=60))), ["i50"])
+		self.assertEqual(self.names(self.mi.overlapping(self.other, 0, 1)), ["d"])
+		self.assertEqual(self.names(self.mi.at(self.tl, datetime(2007, 10, 15, 12, 30))), ["e"])
+
+	def testFollowsChanges(self):
+		self.mi.indexTimeLines()
+		a = self.mi.MainIdx["http://example.org/a"]
+		a.durationXSD = timedelta(seconds=100)
+		self.add("f", self.tl, beginsAtInt=55, endsAtInt=70)
+		self.mi.MainIdx["http://example.org/i50"].onTimeLine = self.other
+		self.assertEqual(self.names(self.mi.at(self.tl, 60)), ["a", "f"])
+		self.assertEqual(self.names(self.mi.at(self.other, 50)), ["d", "i50"])
+
+	def testMatchesScan(self):
+		"""Queries over many intervals, added before and after indexing, give what a scan would."""
+		rnd = random.Random(0)
+		extents = {}
+		for i in range(300):
+			if i == 150:
+				self.mi.indexTimeLines()
+			begin = rnd.randint(0, 1000)
+			end = begin + rnd.randint(0, 50)
+			self.add("r%d" % i, self.tl, beginsAtInt=begin, endsAtInt=end)
+			extents["r%d" % i] = (begin, end)
+		for i in range(50):
+			start = rnd.randint(0, 1000)
+			stop = start + rnd.randint(0, 100)
+			found = [n for n in self.names(self.mi.overlapping(self.tl, start, stop)) if n.startswith("r")]
+			self.assertEqual(found, sorted([n for n, (b, e) in extents.items() if b <= stop and e >= start]))
+			found = [n for n in self.names(self.mi.within(self.tl, start, stop)) if n.startswith("r")]
+			self.assertEqual(found, sorted([n for n, (b, e) in extents.items() if b >= start and e <= stop]))
+
+class LiteralsTest(unittest.TestCase):
+	def testSharedPerStore(self):
+		"""Equal unicode literals of the objects of a store are one object, kept by the store."""
+		names = [u"caf\xe9", u"caf\xe9", u"\u97f3\u697d"]
+		names = [n.encode("utf-8").decode("utf-8") for n in names] # Distinct objects
+		mi = MusicInfo()
+		artists = []
+		for i, name in enumerate(names):
+			a = mo___MusicArtist("http://example.org/artist%d" % i)
+			a.name.set(name)
+			artists.append(a)
+		mi.add(artists[0])
+		mi.add_many(artists[1:])
+		a = mo___MusicArtist("http://example.org/late")
+		mi.add(a)
+		a.name.set(u"caf\xe9".encode("utf-8").decode("utf-8"))
+		shared = list(artists[0].name)[0]
+		self.assert_(list(artists[1].name)[0] is shared)
+		self.assert_(list(a.name)[0] is shared)
+		self.assertEqual(sorted(mi.literals), sorted([u"caf\xe9", u"\u97f3\u697d"]))
+		self.assertEqual(MusicInfo().literals, {})
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_rdf.py
+
+Checks of RDF import and export. See test_model.py for running the tests.
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import logging
+import unittest
+from StringIO import StringIO
+from datetime import datetime, timedelta
+from decimal import Decimal
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, "benchmarks"))
+
+from rdflib import ConjunctiveGraph, BNode, Literal
+import synthetic
+import mopy
+from mopy import XSD
+from mopy.MusicInfo import MusicInfo, MusicInfoException
+from mopy.RDFInterface import bnodeLabel, exportRDFStream
+from mopy.Profile import Profile
+from mopy.model import mo___MusicArtist, mo___Track
+
+def writeSynthetic(filename, artists, seed=0):
+	"""Write synthetic data (see benchmarks/synthetic.py) to filename, as N-Triples."""
+	out = open(filename, "w")
+	synthetic.writeData(out, artists, seed, events=2)
+	out.close()
+	return filename
+
+def canonical(g):
+	"""
+	The triples of the rdflib graph g, sorted, with each blank node replaced by
+	a hash of the triples around it, so that graphs which only differ by their
+	blank node labels compare equal.
+	"""
+	def key(term, colours):
+		if isinstance(term, BNode):
+			return ("_", colours[term])
+		elif isinstance(term, Literal):
+			return (unicode(term), term.datatype and unicode(term.datatype), term.language)
+		return unicode(term)
+	triples = list(g.triples((None, None, None)))
+	colours = dict([(t, 0) for s, p, o in triples for t in (s, o) if isinstance(t, BNode)])
+	for i in range(4):
+		around = dict([(b, []) for b in colours])
+		for s, p, o in triples:
+			if isinstance(s, BNode):
+				around[s].append((">", unicode(p), key(o, colours)))
+			if isinstance(o, BNode):
+				around[o].append(("<", unicode(p), key(s, colours)))
+		colours = dict([(b, hash(tuple(sorted(edges)))) for b, edges in around.iteritems()])
+	return sorted([(key(s, colours), unicode(p), key(o, colours)) for s, p, o in triples])
+
+def exportCanonical(mi):
+	return canonical(mopy.exportRDFGraph(mi))
+
+class RDFTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def testBlankNodeLabels(self):
+		uris = ["blind:ab.c1", "blind:abc.1", "blind:abcx2e1", "blind:a_b", "blind:a-b", u"blind:\xe9"]
+		labels = [bnodeLabel(uri) for uri in uris]
+		self.assertEqual(len(set(labels)), len(uris))
+		for label in labels:
+			self.assert_(label[2:].isalnum(), label)
+
+	def testBlankNodesKeptApart(self):
+		mi = MusicInfo()
+		for uri, name in [("blind:ab.c1", "One"), ("blind:abc.1", "Two")]:
+			a = mo___MusicArtist(uri)
+			a.name = name
+			mi.add(a)
+		out = StringIO()
+		exportRDFStream(mi, out)
+		filename = os.path.join(self.dir, "blinds.nt")
+		open(filename, "w").write(out.getvalue())
+		names = [list(a.name)[0] for a in mopy.importRDFFile(filename, "nt").MusicArtistIdx.values()]
+		self.assertEqual(sorted(names), ["One", "Two"])
+
+	def testStreamMatchesGraph(self):
+		mi = mopy.importRDFFile(writeSynthetic(os.path.join(self.dir, "data.nt"), 3), "nt")
+		mi.add_many(mopy.importRDFFile(os.path.join(root, "L1 small.n3"), "n3").MainIdx.values())
+		expected = exportCanonical(mi)
+		for format, parseAs in [("nt", "nt"), ("turtle", "n3")]:
+			out = StringIO()
+			exportRDFStream(mi, out, format)
+			g = ConjunctiveGraph()
+			g.parse(StringIO(out.getvalue()), format=parseAs)
+			self.assertEqual(canonical(g), expected, format)
+
+	def testParallelMatchesSerial(self):
+		filename = writeSynthetic(os.path.join(self.dir, "data.nt"), 4)
+		quads = os.path.join(self.dir, "data.nq")
+		out = open(quads, "w")
+		for line in open(filename):
+			out.write(line.rstrip()[:-1]+"<http://example.org/graph> .\n")
+		out.close()
+		serial = mopy.importRDFFile(filename, "nt")
+		expected = exportCanonical(serial)
+		for name, format in [(filename, "nt"), (quads, "nq")]:
+			for processes in (2, 3):
+				parallel = mopy.importRDFFile(name, format, processes=processes)
+				self.assertEqual(len(parallel.MainIdx), len(serial.MainIdx))
+				self.assertEqual(exportCanonical(parallel), expected, (format, processes))
+
+	def testNonStrictImport(self):
+		"""event.rdf has properties whose ranges aren't in the model, eg. rdf:List."""
+		logging.disable(logging.ERROR) # What can't be modelled is logged
+		try:
+			mi = mopy.importRDFFile(os.path.join(root, "event.rdf"), "xml", False)
+		finally:
+			logging.disable(logging.NOTSET)
+		self.assert_(mi.MainIdx.has_key("http://moustaki.org/foaf.rdf#moustaki"))
+
+	def testPropertiesResolvedWhenSeen(self):
+		from mopy.RDFInterface import propertyTable
+		from mopy.model import mo___Track
+		table = propertyTable(mo___Track)
+		maker = "http://xmlns.com/foaf/0.1/maker"
+		self.assertEqual(table[maker][:2], ("maker", mo___Track.maker.validTypes))
+		self.assert_(len(dict.__getitem__(table, "http://purl.org/ontology/mo/olga")) == 2)
+
+	def testStreamExportProfile(self):
+		mi = MusicInfo()
+		for i in range(3):
+			a = mo___MusicArtist("http://example.org/artist/%d" % i)
+			a.name = "Artist %d" % i
+			mi.add(a)
+		filename = os.path.join(self.dir, "artists.nt")
+		p = Profile()
+		mopy.exportRDFFile(mi, filename, "nt", profile=p)
+		self.assertEqual(p.counts["objects"], 3)
+		self.assertEqual(p.counts["triples"], len(open(filename).readlines()))
+		self.assert_(p.calls.has_key("triples") and p.calls.has_key("write"))
+
+class XSDTest(unittest.TestCase):
+	def testParse(self):
+		v = XSD.parseLiteral(XSD.NS+"dateTime", "2007-10-15T12:30:00+01:00")
+		self.assertEqual(v, datetime(2007, 10, 15, 11, 30))
+		self.assertEqual(XSD.lexicalForm(v), ("2007-10-15T12:30:00+01:00", XSD.NS+"dateTime"))
+		self.assertEqual(XSD.lexicalForm(XSD.parseLiteral(XSD.NS+"dateTime", "2007-10-15T11:30:00")),\
+						 ("2007-10-15T11:30:00", XSD.NS+"dateTime"))
+		self.assertEqual(XSD.parseLiteral(XSD.NS+"duration", "-PT1M30.5S"), -timedelta(seconds=90.5))
+		self.assertEqual(XSD.parseLiteral(XSD.NS+"decimal", "1.50"), Decimal("1.50"))
+		self.assertEqual(XSD.parseLiteral(XSD.NS+"integer", "42"), 42)
+		self.assert_(XSD.parseLiteral(XSD.NS+"gYearMonth", "2007-12") < XSD.parseLiteral(XSD.NS+"gYearMonth", "2008-01"))
+		for datatype, text in [("dateTime", "2007-10-15"), ("duration", "P1Y"), ("date", "2007-02-30"), ("integer", "x")]:
+			v = XSD.parseLiteral(XSD.NS+datatype, text)
+			self.assertEqual(type(v), XSD.TypedString, (datatype, text))
+			self.assertEqual(XSD.lexicalForm(v), (text, XSD.NS+datatype))
+		self.assertEqual(XSD.parseLiteral("http://example.org/type", "text"), "text")
+
+	def testRoundTrip(self):
+		"""Typed literals are imported as values, and exported with the lexical forms they were read from."""
+		tl = "http://purl.org/NET/c4dm/timeline.owl#"
+		def literal(text, datatype):
+			return '"%s"^^<%s%s>' % (text, XSD.NS, datatype)
+		data = [("i1", "atDateTime", literal("2007-10-15T12:30:00+01:00", "dateTime")),
+				("i2", "atDateTime", literal("2007-10-15T11:00:00", "dateTime")),
+				("i3", "atDateTime", literal("15/10/2007", "dateTime")),
+				("i4", "atDate", literal("2007-10-15", "date")),
+				("i4", "atYearMonth", literal("2007-10", "gYearMonth")),
+				("iv", "durationXSD", literal("PT1M30S", "duration"))]
+		lines = ["<http://example.org/%s> <%s%s> %s .\n" % triple for triple in [(s, tl, p, o) for s, p, o in data]]
+		for s, cls in [("i1", "Instant"), ("i2", "Instant"), ("i3", "Instant"), ("i4", "Instant"), ("iv", "Interval")]:
+			lines.append("<http://example.org/%s> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <%s%s> .\n" % (s, tl, cls))
+		g = ConjunctiveGraph()
+		g.parse(StringIO("".join(lines)), format="nt")
+		mi = mopy.importRDFGraph(g)
+		def value(uri, propName):
+			return list(getattr(mi.MainIdx["http://example.org/"+uri], propName))[0]
+		self.assertEqual(value("i1", "atDateTime"), datetime(2007, 10, 15, 11, 30))
+		self.assert_(value("i2", "atDateTime") < value("i1", "atDateTime"))
+		self.assertEqual(type(value("i3", "atDateTime")), XSD.TypedString)
+		self.assertEqual(value("iv", "durationXSD"), timedelta(seconds=90))
+		self.assertEqual(type(value("i4", "atYearMonth")), XSD.GYearMonth)
+		self.assertEqual(exportCanonical(mi), canonical(g))
+
+class DeltaTest(unittest.TestCase):
+	def setUp(self):
+		self.mi = MusicInfo()
+		self.artist = mo___MusicArtist("http://example.org/artist")
+		self.artist.name = "An artist"
+		self.tracks = []
+		for i in range(3):
+			t = mo___Track("http://example.org/track/%d" % i)
+			t.title = "Track %d" % i
+			t.maker = self.artist
+			self.tracks.append(t)
+		self.mi.add_many([self.artist] + self.tracks)
+		self.before = mopy.exportRDFGraph(self.mi)
+		self.since = self.mi.checkpoint()
+		self.tracks[0].title = "Renamed"
+		self.tracks[1].title.add("Temporary")
+		self.tracks[1].title.remove("Temporary")
+		self.artist.name.add(u"Un artiste")
+		t = mo___Track("http://example.org/track/new")
+		t.maker = self.artist
+		self.mi.add(t)
+
+	def testChangesSince(self):
+		added, removed = self.mi.changesSince(self.since)
+		title = mo___Track.title.propertyURI
+		self.assertEqual(removed, [("http://example.org/track/0", title, "Track 0")])
+		self.assert_(("http://example.org/track/0", title, "Renamed") in added)
+		self.assert_(("http://example.org/track/new", mo___Track.maker.propertyURI, ("uri", self.artist.URI)) in added)
+		self.assert_("Temporary" not in [v for s, p, v in added + removed])
+		self.assertEqual(self.mi.changesSince(self.mi.checkpoint()), ([], []))
+
+	def testDeltaApplies(self):
+		"""The N-Triples delta turns an export made at the checkpoint into an export of the store now."""
+		out, removedOut = StringIO(), StringIO()
+		self.mi.export_delta(self.since, out, "nt", removedOut)
+		g = self.before
+		for delta, change in [(removedOut, g.remove), (out, g.add)]:
+			d = ConjunctiveGraph()
+			d.parse(StringIO(delta.getvalue()), format="nt")
+			for triple in d.triples((None, None, None)):
+				change(triple)
+		self.assertEqual(canonical(g), exportCanonical(self.mi))
+		out = StringIO()
+		self.mi.export_delta(self.since, out)
+		self.assert_("DELETE DATA" in out.getvalue() and "INSERT DATA" in out.getvalue(), out.getvalue())
+
+	def testForgottenChanges(self):
+		later = self.mi.checkpoint()
+		self.mi.forgetChanges(later)
+		self.assertRaises(MusicInfoException, self.mi.changesSince, self.since)
+		self.assertEqual(self.mi.changesSince(later), ([], []))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_snapshot.py
+
+Checks of saving and reloading MusicInfo snapshots. See test_model.py for
+running the tests.
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mopy import saveSnapshot, loadSnapshot
+from mopy.MusicInfo import MusicInfo
+from mopy.model import mo___MusicArtist, mo___Track, mo___DigitalSignal, time___Instant, event___Event
+
+class SnapshotTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.filename = os.path.join(self.dir, "store.snapshot")
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def roundTrip(self, mi):
+		saveSnapshot(mi, self.filename)
+		return loadSnapshot(self.filename)
+
+	def testStrings(self):
+		"""str and unicode literals, ASCII or not, come back with their types."""
+		mi = MusicInfo()
+		a = mo___MusicArtist("http://example.org/artist")
+		names = ["plain", "caf\xc3\xa9", "\xe9t\xe9", u"plain unicode", u"caf\xe9", u"\u97f3\u697d"]
+		for name in names:
+			a.name.add(name)
+		mi.add(a)
+		a2 = self.roundTrip(mi).MainIdx["http://example.org/artist"]
+		self.assertEqual(sorted([repr(n) for n in a2.name]), sorted([repr(n) for n in names]))
+
+	def testValues(self):
+		mi = MusicInfo()
+		a = mo___MusicArtist("http://example.org/artist")
+		mi.add(a)
+		t = mo___Track("http://example.org/track")
+		t.track_number = 3
+		t.maker = a
+		mi.add(t)
+		s = mo___DigitalSignal("http://example.org/signal")
+		s.sample_rate = 44100.0
+		mi.add(s)
+		i = time___Instant("http://example.org/instant")
+		i.atDateTime = datetime(2007, 10, 15, 12, 30)
+		mi.add(i)
+		e = event___Event("http://example.org/event")
+		e.agent = mo___MusicArtist("http://example.org/not-in-the-store")
+		mi.add(e)
+		mi2 = self.roundTrip(mi)
+		self.assertEqual(sorted(mi2.MainIdx.keys()), sorted(mi.MainIdx.keys()))
+		t2 = mi2.MainIdx["http://example.org/track"]
+		self.assertEqual(list(t2.track_number), [3])
+		self.assert_(list(t2.maker)[0] is mi2.MainIdx["http://example.org/artist"])
+		self.assertEqual(list(mi2.MainIdx["http://example.org/signal"].sample_rate), [44100.0])
+		self.assertEqual(list(mi2.MainIdx["http://example.org/instant"].atDateTime), [datetime(2007, 10, 15, 12, 30)])
+		agent = list(mi2.MainIdx["http://example.org/event"].agent)[0]
+		self.assertEqual((type(agent), agent.URI), (mo___MusicArtist, "http://example.org/not-in-the-store"))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+test_sqlite.py
+
+Checks of SQLiteMusicInfo with a cache much smaller than the store. See
+test_model.py for running the tests.
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import subprocess
+import unittest
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.join(here, "..")
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, "benchmarks"))
+sys.path.insert(0, here)
+
+import mopy
+from mopy.SQLiteStore import SQLiteMusicInfo, digest
+from mopy.URITable import URITable
+from test_rdf import writeSynthetic, exportCanonical
+from mopy.model import mo___MusicArtist, mo___Track
+
+class SQLiteTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.filename = os.path.join(self.dir, "store.db")
+		self.mi = SQLiteMusicInfo(self.filename, cacheSize=5)
+		self.artist = mo___MusicArtist("http://example.org/artist")
+		self.artist.name = "An artist"
+		self.mi.add(self.artist)
+		for i in range(20):
+			t = mo___Track("http://example.org/track/%d" % i)
+			t.maker = self.artist
+			self.mi.add(t)
+
+	def tearDown(self):
+		self.mi.db.close()
+		shutil.rmtree(self.dir)
+
+	def reopen(self):
+		self.mi.close()
+		self.mi = SQLiteMusicInfo(self.filename, cacheSize=5)
+
+	def testEvictedChangesSaved(self):
+		self.assert_(not self.mi.cache.has_key(self.artist.URI))
+		self.artist.name = "Renamed"
+		self.reopen()
+		self.assertEqual(list(self.mi.MainIdx[self.artist.URI].name), ["Renamed"])
+
+	def testEvictedBeforeFilled(self):
+		self.reopen()
+		artist = self.mi.MainIdx["http://example.org/artist"]
+		for i in range(20):
+			self.mi.MainIdx["http://example.org/track/%d" % i]
+		self.assert_(not self.mi.cache.has_key(artist.URI))
+		artist.name.add("Another name")
+		self.reopen()
+		self.assertEqual(set(self.mi.MainIdx[artist.URI].name), set(["An artist", "Another name"]))
+
+	def testLastChangedCopySaved(self):
+		self.reopen()
+		old = self.mi.MainIdx["http://example.org/track/0"]
+		for i in range(1, 20):
+			self.mi.MainIdx["http://example.org/track/%d" % i]
+		new = self.mi.MainIdx["http://example.org/track/0"]
+		self.assert_(new is not old)
+		new.title = "New"
+		old.title = "Old"
+		self.reopen()
+		self.assertEqual(list(self.mi.MainIdx["http://example.org/track/0"].title), ["Old"])
+
+	def testReferrersLoadedLazily(self):
+		referrers = self.mi.referrersOf(self.artist.URI)
+		self.assertEqual(len(referrers), 20)
+		uris = set()
+		for holder, propName in referrers:
+			self.assertEqual(propName, "maker")
+			uris.add(holder.URI)
+			self.assert_(len(self.mi.cache) <= 5)
+		self.assertEqual(uris, set(["http://example.org/track/%d" % i for i in range(20)]))
+		self.assertEqual(referrers[0][1], "maker")
+
+	def testMatchesMemory(self):
+		"""A store built in SQLite, through a small cache, exports what one built in memory does."""
+		filename = writeSynthetic(os.path.join(self.dir, "data.nt"), 2)
+		extra = writeSynthetic(os.path.join(self.dir, "extra.nt"), 2, seed=1)
+		memory = mopy.importRDFFile(filename, "nt")
+		memory.add_many(mopy.importRDFFile(extra, "nt").MainIdx.values())
+		store = SQLiteMusicInfo(os.path.join(self.dir, "data.db"), cacheSize=50)
+		store.add_many(mopy.importRDFFile(filename, "nt").MainIdx.values())
+		store.add_many(mopy.importRDFFile(extra, "nt").MainIdx.values())
+		store.close()
+		store = SQLiteMusicInfo(os.path.join(self.dir, "data.db"), cacheSize=50)
+		self.assertEqual(len(store.MainIdx), len(memory.MainIdx))
+		self.assertEqual(exportCanonical(store), exportCanonical(memory))
+		store.close()
+
+	def testNewBindingsKeepURIs(self):
+		"""URIs are found again after namespaces are bound which split them differently."""
+		filename = os.path.join(self.dir, "bindings.db")
+		store = SQLiteMusicInfo(filename, namespaceBindings={"ex" : "http://example.org/"})
+		store.add(mo___MusicArtist("http://example.org/music/artist/1"))
+		store.close()
+		store = SQLiteMusicInfo(filename, namespaceBindings={"art" : "http://example.org/music/artist/"})
+		store.namespaceBindings["deep"] = "http://example.org/music/artist/1/"
+		self.assertEqual(store.MainIdx.keys(), ["http://example.org/music/artist/1"])
+		self.assert_(store.haveURI("http://example.org/music/artist/1"))
+		self.assertEqual(store.MainIdx.get("http://example.org/music/artist/1").URI, "http://example.org/music/artist/1")
+		store.close()
+
+	def testBlindFoundAfterReopen(self):
+		"""A blind node like one written by an earlier session is found in the database."""
+		def blind():
+			t = mo___Track()
+			t.title.add(u"Untitled")
+			t.track_number = 3
+			t.maker = self.artist
+			return t
+		self.mi.add(blind())
+		count = len(self.mi.MainIdx)
+		self.reopen()
+		t = blind()
+		self.mi.add(t)
+		self.assertEqual(len(self.mi.MainIdx), count)
+		self.assert_(self.mi.haveURI(t.URI))
+
+	def testDigestStable(self):
+		"""Signature digests don't depend on hash values or set order."""
+		sig = "frozenset([('title', frozenset(['a%d' % i for i in range(50)])), ('maker', frozenset([('uri', 'http://example.org/a')]))])"
+		code = "from mopy.SQLiteStore import digest; print digest(%s)" % sig
+		digests = set([digest(eval(sig))])
+		for seed in ("1", "2"):
+			env = dict(os.environ, PYTHONHASHSEED=seed)
+			out = subprocess.Popen([sys.executable, "-R", "-c", code], cwd=root, env=env, stdout=subprocess.PIPE).communicate()[0]
+			digests.add(out.strip())
+		self.assertEqual(len(digests), 1, digests)
+		self.assertEqual(digest(frozenset([1, "a"])), digest(frozenset([1.0, u"a"])))
+
+class URITableTest(unittest.TestCase):
+	def testSplit(self):
+		table = URITable(["http://example.org/"])
+		self.assertEqual(table.split("http://example.org/a"), (0, "a"))
+		self.assertEqual(table.split("http://example.org/music/artist/1"), (1, "1"))
+		self.assertEqual(table.split("http://purl.org/ontology/mo/Track"), (2, "Track"))
+		self.assertEqual(table.split("http://purl.org/NET/c4dm/event.owl#Event"), (3, "Event"))
+		self.assertEqual(table.split("urn:isbn:0451450523"), (4, "urn:isbn:0451450523"))
+		self.assertEqual(table.namespaces[4], "")
+
+	def testIndependentOfNamespaces(self):
+		"""URIs are split the same way whichever namespaces a table already has."""
+		uris = ["http://example.org/music/artist/1", "http://example.org/dir/", "http://x.org/a#b/c", "http://x.org/a/b#c"]
+		known = URITable(["http://example.org/", "http://example.org/music/artist/1", "http://x.org/a#"])
+		for uri in uris:
+			fresh = URITable()
+			nsId, local = fresh.split(uri)
+			self.assertEqual(known.join(*known.split(uri)), uri)
+			self.assertEqual(known.split(uri)[1], local)
+			self.assertEqual(known.namespaces[known.split(uri)[0]], fresh.namespaces[nsId])
+		self.assertEqual([known.split(uri)[1] for uri in uris], ["1", "", "c", "c"])
+
+	def testJoin(self):
+		table = URITable()
+		for uri in ["http://example.org/a/b", "http://example.org/a#c", "blind:12ab", u"http://example.org/\xe9"]:
+			self.assertEqual(table.join(*table.split(uri)), uri)
+
+	def testRebuilt(self):
+		"""A table rebuilt from the namespaces of another gives the same ids."""
+		table = URITable()
+		ids = [table.split(uri) for uri in ["http://a.org/x", "http://b.org/y#z", "http://a.org/w"]]
+		rebuilt = URITable(table.namespaces)
+		self.assertEqual([rebuilt.split(uri) for uri in ["http://a.org/x", "http://b.org/y#z", "http://a.org/w"]], ids)
+
+if __name__ == '__main__':
+	unittest.main()